@@ -1,3 +1,5 @@
 # encoding: UTF-8
 
-from .db_migration import DBMigration, MysqlCommando, AppException, Script, main
+from .db_migration import DBMigration, MysqlCommando, AppException, Script, ChecksumManifest,\
+    Statement, SqlSplitter, MysqlSplitter, SqlplusSplitter, MysqlDdlAnalyzer, MysqlDatabaseAdapter,\
+    SqlplusDatabaseAdapter, Throttle, ChunkedStep, OnlineSchemaChange, BatchStatement, Observer, main
@@ -4,17 +4,177 @@
 from __future__ import print_function
 from __future__ import with_statement
 import os
+import gc
 import re
 import sys
+import csv
 import glob
 import math
+import json
 import getopt
 import codecs
+import pstats
+import hashlib
+import shutil
 import getpass
+import random
+import cProfile
+import StringIO
 import tempfile
 import datetime
+import functools
+import threading
+import contextlib
 import subprocess
+import time
 import HTMLParser
+import multiprocessing.pool
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+###############################################################################
+#                                  TRACING                                    #
+###############################################################################
+
+class Tracer(object):
+    """
+    Record nested spans of a migration run, such as driver calls, and write
+    them in a Chrome trace file (to open in chrome://tracing or Perfetto) or
+    an OTLP JSON file. Spans are recorded by the active tracer, if any.
+    """
+
+    active = None
+    FORMATS = ('chrome', 'otlp')
+    # maximum length of span arguments (such as queries)
+    MAX_ARGUMENT = 200
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.trace_id = '%032x' % random.getrandbits(128)
+
+    @classmethod
+    @contextlib.contextmanager
+    def span(cls, name, **arguments):
+        """
+        Context manager that records a span with the active tracer, nested in
+        the current span of the thread. Errors are recorded in span arguments.
+        :param name: the name of the span
+        :param arguments: the arguments of the span
+        """
+        tracer = cls.active
+        if not tracer:
+            yield
+            return
+        stack = tracer.local.__dict__.setdefault('stack', [])
+        span = {
+            'id': '%016x' % random.getrandbits(64),
+            'parent': stack[-1]['id'] if stack else None,
+            'name': name,
+            'thread': threading.current_thread().ident,
+            'arguments': dict((key, value if not isinstance(value, basestring) else value[:cls.MAX_ARGUMENT])
+                              for key, value in arguments.items()),
+            'start': time.time(),
+        }
+        stack.append(span)
+        try:
+            yield
+        except Exception as e:
+            span['error'] = str(e)[:cls.MAX_ARGUMENT]
+            raise
+        finally:
+            stack.pop()
+            span['end'] = time.time()
+            with tracer.lock:
+                tracer.spans.append(span)
+
+    def write(self, path, format='chrome'): # pylint: disable=W0622
+        """
+        Write recorded spans in a file.
+        :param path: the path of the trace file
+        :param format: 'chrome' for Chrome trace format or 'otlp' for OTLP JSON
+        """
+        if format not in self.FORMATS:
+            raise AppException("Trace format must be one of %s" % ', '.join(self.FORMATS))
+        spans = sorted(self.spans, key=lambda span: span['start'])
+        trace = self.chrome_trace(spans) if format == 'chrome' else self.otlp_trace(spans)
+        try:
+            with open(path, 'w') as handle:
+                json.dump(trace, handle)
+        except IOError as e:
+            raise AppException("Error writing trace file '%s': %s" % (path, e))
+
+    @staticmethod
+    def chrome_trace(spans):
+        """
+        Build Chrome trace with complete events in microseconds, with a track
+        per thread.
+        :param spans: the list of spans
+        :return: the trace as a dictionary
+        """
+        threads = {}
+        events = []
+        for span in spans:
+            arguments = dict(span['arguments'])
+            if 'error' in span:
+                arguments['error'] = span['error']
+            events.append({
+                'name': span['name'],
+                'cat': 'db_migration',
+                'ph': 'X',
+                'ts': int(span['start'] * 1000000),
+                'dur': int((span['end'] - span['start']) * 1000000),
+                'pid': os.getpid(),
+                'tid': threads.setdefault(span['thread'], len(threads) + 1),
+                'args': arguments,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def otlp_trace(self, spans):
+        """
+        Build OTLP JSON trace, as exported by OpenTelemetry collectors.
+        :param spans: the list of spans
+        :return: the trace as a dictionary
+        """
+        result = []
+        for span in spans:
+            attributes = [{'key': key, 'value': {'stringValue': unicode(value)}}
+                          for key, value in sorted(span['arguments'].items())]
+            result.append({
+                'traceId': self.trace_id,
+                'spanId': span['id'],
+                'parentSpanId': span['parent'] or '',
+                'name': span['name'],
+                'kind': 1,
+                'startTimeUnixNano': str(int(span['start'] * 1000000000)),
+                'endTimeUnixNano': str(int(span['end'] * 1000000000)),
+                'attributes': attributes,
+                'status': {'code': 2, 'message': span['error']} if 'error' in span else {'code': 1},
+            })
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'db_migration'}}]},
+            'scopeSpans': [{'scope': {'name': 'db_migration'}, 'spans': result}],
+        }]}
+
+
+def traced(function):
+    """
+    Decorator that records calls of a function as spans of the active tracer.
+    :param function: the function to trace
+    :return: the decorated function
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with Tracer.span(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
 
 
 ###############################################################################
@@ -78,7 +238,7 @@ class MysqlCommando(object):
         self.cast = cast
 
     def run_query(self, query, parameters=None, cast=None,
-                  last_insert_id=False):
+                  last_insert_id=False, local_infile=False):
         """
         Run a given query.
         :param query: the query to run
@@ -86,6 +246,8 @@ class MysqlCommando(object):
                '%(name)s' in query) or tuple (with references such as '%s')
         :param cast: tells if we should cast result
         :param last_insert_id: tells if this should return last inserted id
+        :param local_infile: tells if query may load local files with LOAD
+               DATA LOCAL INFILE
         :return: result query as a tuple of dictionaries
         """
         query = self._process_parameters(query, parameters)
@@ -104,7 +266,10 @@ class MysqlCommando(object):
                        '-p%s' % self.password,
                        '-h%s' % self.hostname,
                        '-B', '-e', query, self.database]
-        output = self._execute_with_output(command)
+        if local_infile:
+            command.insert(1, '--local-infile=1')
+        with Tracer.span('mysql', query=query, size=len(query)):
+            output = self._execute_with_output(command)
         if cast is None:
             cast = self.cast
         if output:
@@ -136,7 +301,7 @@ class MysqlCommando(object):
                        '-B', self.database]
         if cast is None:
             cast = self.cast
-        with open(script) as stdin:
+        with open(script) as stdin, Tracer.span('mysql', script=script, size=os.path.getsize(script)):
             output = self._execute_with_output(command, stdin=stdin)
         if output:
             return self._output_to_result(output, cast=cast)
@@ -193,7 +358,7 @@ class MysqlCommando(object):
             process = subprocess.Popen(command, stdout=subprocess.PIPE,  stderr=subprocess.PIPE)
         output, errput = process.communicate()
         if process.returncode != 0:
-            raise MysqlException(errput.strip())
+            raise MysqlException(errput.strip(), output=output)
         return output
 
     @staticmethod
@@ -260,9 +425,17 @@ class MysqlException(Exception):
     Exception raised by this driver.
     """
 
-    def __init__(self, message, query=None):
+    # error codes of deadlocks and lock wait timeouts
+    TRANSIENT_CODES = (1205, 1213)
+    REGEXP_CODE = re.compile(r'\bERROR (\d+)')
+
+    def __init__(self, message, query=None, output=None):
         self.message = message
         self.query = query
+        self.output = output
+        match = self.REGEXP_CODE.search(message or '')
+        self.code = int(match.group(1)) if match else None
+        self.transient = self.code in self.TRANSIENT_CODES
 
     def __str__(self):
         return self.message
@@ -328,6 +501,31 @@ class SqlplusCommando(object):
         """
         if parameters:
             query = self._process_parameters(query, parameters)
+        with Tracer.span('sqlplus', query=query, size=len(query)):
+            return self._execute(query, cast=cast, check_errors=check_errors)
+
+    def run_script(self, script, cast=True, check_errors=True):
+        """
+        Run a given script.
+        :param script: the path to the script to run
+        :param cast: tells if we should cast result
+        :param check_errors: check for errors in output
+        :return: result query as a tuple of dictionaries
+        """
+        if not os.path.isfile(script):
+            raise SqlplusException("Script '%s' was not found" % script)
+        query = "@%s\n" % script
+        with Tracer.span('sqlplus', script=script, size=os.path.getsize(script)):
+            return self._execute(query, cast=cast, check_errors=check_errors)
+
+    def _execute(self, query, cast, check_errors):
+        """
+        Run a query with sqlplus.
+        :param query: the query to run
+        :param cast: tells if we should cast result
+        :param check_errors: check for errors in output
+        :return: result query as a tuple of dictionaries
+        """
         query = self.CATCH_ERRORS + query
         session = subprocess.Popen(['sqlplus', '-S', '-L', '-M', 'HTML ON',
                                     self._get_connection_url()],
@@ -341,24 +539,37 @@ class SqlplusCommando(object):
         output, _ = session.communicate(self.EXIT_COMMAND)
         code = session.returncode
         if code != 0:
-            raise SqlplusException(SqlplusErrorParser.parse(output), query, raised=True)
+            raise SqlplusException(SqlplusErrorParser.parse(output), query,
+                                   raised=True, output=output)
         else:
             if output:
                 result = SqlplusResultParser.parse(output, cast=cast, check_errors=check_errors)
                 return result
 
-    def run_script(self, script, cast=True, check_errors=True):
+    def run_loader(self, control):
         """
-        Run a given script.
-        :param script: the path to the script to run
-        :param cast: tells if we should cast result
-        :param check_errors: check for errors in output
-        :return: result query as a tuple of dictionaries
+        Load data with SQL*Loader.
+        :param control: the path of the SQL*Loader control file
         """
-        if not os.path.isfile(script):
-            raise SqlplusException("Script '%s' was not found" % script)
-        query = "@%s\n" % script
-        return self.run_query(query=query, cast=cast, check_errors=check_errors)
+        directory = tempfile.mkdtemp(prefix='db_migration_')
+        try:
+            log = os.path.join(directory, 'sqlldr.log')
+            with Tracer.span('sqlldr', control=control):
+                session = subprocess.Popen(['sqlldr', 'userid=%s' % self._get_connection_url(),
+                                            'control=%s' % control, 'log=%s' % log,
+                                            'bad=%s' % os.path.join(directory, 'sqlldr.bad'),
+                                            'silent=(header,feedback)'],
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE)
+                output, errput = session.communicate()
+            if session.returncode != 0:
+                if os.path.isfile(log):
+                    with open(log) as handle:
+                        output = handle.read()
+                raise SqlplusException((errput or output).strip(), control,
+                                       raised=True, output=output)
+        finally:
+            shutil.rmtree(directory)
 
     def _get_connection_url(self):
         """
@@ -439,6 +650,8 @@ class SqlplusResultParser(HTMLParser.HTMLParser):
 
     DATE_FORMAT = '%d/%m/%y %H:%M:%S'
     REGEXP_ERRORS = ('^.*unknown.*$|^.*warning.*$|^.*error.*$')
+    # errors of sqlplus client, that don't interrupt scripts
+    REGEXP_CLIENT_ERRORS = r'^.*\bSP2-\d+:.*$'
     CASTS = (
         (r'-?\d+', int),
         (r'-?\d*,?\d*([Ee][+-]?\d+)?', lambda f: float(f.replace(',', '.'))),
@@ -468,16 +681,19 @@ class SqlplusResultParser(HTMLParser.HTMLParser):
         Parse sqlplus output.
         :param source: the output
         :param cast: tells if we should cast result
-        :param check_errors: tells if we should parse output for errors
+        :param check_errors: tells if we should parse output for errors, or
+               the regular expression matching errors to look for
         :return: result as a tuple of dictionaries
         """
         if not source.strip():
             return ()
         if check_errors:
-            errors = re.findall(SqlplusResultParser.REGEXP_ERRORS, source,
+            regexp = check_errors if check_errors is not True else SqlplusResultParser.REGEXP_ERRORS
+            errors = re.findall(regexp, source,
                                 re.MULTILINE + re.IGNORECASE)
             if errors:
-                raise SqlplusException('\n'.join(errors), raised=False)
+                raise SqlplusException('\n'.join(errors), raised=False,
+                                       output=source)
         parser = SqlplusResultParser(cast)
         parser.feed(source)
         return tuple(parser.result)
@@ -600,7 +816,12 @@ class SqlplusException(Exception):
     Exception raised by this driver.
     """
 
-    def __init__(self, message, query=None, raised=False):
+    # error codes of resource busy (lock with NOWAIT or DDL_LOCK_TIMEOUT) and
+    # deadlocks
+    TRANSIENT_CODES = ('ORA-00054', 'ORA-00060')
+    REGEXP_CODE = re.compile(r'\bORA-\d{5}')
+
+    def __init__(self, message, query=None, raised=False, output=None):
         """
         Constructor.
         :param message: the error message
@@ -608,10 +829,15 @@ class SqlplusException(Exception):
         :param raised: raised is set to True if sqlplus stops on error running
                a script, it is set to False if the error was detected in output
                (with a text such as "Package compilation error")
+        :param output: the raw output of sqlplus
         """
         self.message = message
         self.query = query
         self.raised = raised
+        self.output = output
+        match = self.REGEXP_CODE.search(message or '')
+        self.code = match.group(0) if match else None
+        self.transient = self.code in self.TRANSIENT_CODES
 
     def __str__(self):
         """
@@ -621,6 +847,790 @@ class SqlplusException(Exception):
         return self.message
 
 
+###############################################################################
+#                                SQL PARSING                                  #
+###############################################################################
+
+class Statement(object):
+    """
+    A statement of an SQL script, with the delimiter that terminates it and
+    the line where it starts in the script.
+    """
+
+    __slots__ = ('text', 'delimiter', 'line')
+
+    def __init__(self, text, delimiter, line):
+        """
+        Constructor.
+        :param text: the text of the statement (without delimiter)
+        :param delimiter: the delimiter of the statement, '' for line commands
+               and None if statement is not terminated
+        :param line: the line of the statement in the script
+        """
+        self.text = text
+        self.delimiter = delimiter
+        self.line = line
+
+    def __str__(self):
+        """
+        String representation of the statement.
+        :return: the text of the statement
+        """
+        return self.text
+
+    def code(self):
+        """
+        Return the code of the statement, without leading comments.
+        :return: the code of the statement
+        """
+        return self.text[SqlSplitter.REGEXP_BLANK.match(self.text).end():]
+
+
+class SqlSplitter(object):
+    """
+    Parent class for SQL splitters that split a script into statements. The
+    body of each statement, with its strings, quoted identifiers and comments,
+    is matched by a single regular expression, so that scanning is mostly done
+    by the regular expression engine.
+    """
+
+    DELIMITER = ';'
+    # whitespaces and comments before a statement
+    REGEXP_BLANK = re.compile(r'(?:\s+|--[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)*')
+    # client command that must be alone on its line
+    REGEXP_COMMAND = None
+    # beginning of a block that is not terminated by delimiter
+    REGEXP_BLOCK = None
+    # terminator of blocks
+    REGEXP_TERMINATOR = None
+    # characters that might start a string or a comment
+    SPECIAL_CHARACTERS = ''
+    # strings, quoted identifiers and comments
+    REGEXP_SKIP = ''
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        self.regexps = {}
+
+    def split(self, source):
+        """
+        Split a script into statements.
+        :param source: the source of the script
+        :return: the list of statements
+        """
+        statements = []
+        delimiter = self.DELIMITER
+        body = self.regexp(delimiter, False)
+        block_body = self.regexp(delimiter, True)
+        blank = self.REGEXP_BLANK.match
+        command = self.REGEXP_COMMAND.match if self.REGEXP_COMMAND else None
+        block = self.REGEXP_BLOCK.match if self.REGEXP_BLOCK else None
+        terminator = self.REGEXP_TERMINATOR.match if self.REGEXP_TERMINATOR else None
+        length = len(source)
+        position = 0
+        line = 1
+        line_position = 0
+        while position < length:
+            previous = position
+            start = blank(source, position).end()
+            if start >= length:
+                break
+            if command:
+                match = command(source, start)
+                if match and self.at_line_start(source, start):
+                    groups = match.groupdict()
+                    if groups.get('delimiter'):
+                        delimiter = groups['delimiter']
+                        body = self.regexp(delimiter, False)
+                        block_body = self.regexp(delimiter, True)
+                    elif groups.get('command'):
+                        line += source.count('\n', line_position, start)
+                        line_position = start
+                        statements.append(Statement(groups['command'].strip(), '', line))
+                    position = match.end()
+                    continue
+            match = body.match if not block or not block(source, start) else block_body.match
+            end = start
+            while True:
+                end = match(source, end).end()
+                if end >= length:
+                    ending = None
+                    position = length
+                    break
+                if terminator:
+                    slash = terminator(source, end)
+                    if slash:
+                        ending = '/'
+                        position = slash.end()
+                        break
+                if source.startswith(delimiter, end):
+                    ending = delimiter
+                    position = end + len(delimiter)
+                    break
+                # unterminated string or comment
+                end += 1
+            line += source.count('\n', line_position, start)
+            line_position = start
+            statements.append(Statement(source[previous:end].strip(), ending, line))
+        return statements
+
+    def regexp(self, delimiter, block):
+        """
+        Build the regular expression that matches the body of a statement.
+        Strings and comments are not matched at the delimiter, that might
+        start with a special character (such as '//' or '--').
+        :param delimiter: the statement delimiter
+        :param block: tells if statement is a block that is not terminated by
+               delimiter
+        :return: compiled regular expression
+        """
+        key = (delimiter, block)
+        if key not in self.regexps:
+            stops = self.SPECIAL_CHARACTERS
+            alternatives = [self.REGEXP_SKIP]
+            guard = ''
+            if not block:
+                stops += delimiter[0]
+                guard = '(?!%s)' % re.escape(delimiter)
+                if len(delimiter) > 1:
+                    alternatives.append('%s(?!%s)' % (re.escape(delimiter[0]),
+                                                      re.escape(delimiter[1:])))
+            if '\n' in stops:
+                alternatives.append(self.REGEXP_NEWLINE)
+            stops = ''.join(['\\' + c if c in '\\]^-' else c for c in set(stops)])
+            pattern = '(?:[^%s]+|%s(?:%s))*' % (stops.replace('\n', '\\n'), guard, '|'.join(alternatives))
+            self.regexps[key] = re.compile(pattern, re.DOTALL)
+        return self.regexps[key]
+
+    @staticmethod
+    def at_line_start(source, position):
+        """
+        Tells if only whitespaces are before given position on its line.
+        :param source: the source of the script
+        :param position: the position
+        :return: True if position is at the beginning of a line
+        """
+        newline = source.rfind('\n', 0, position)
+        return not source[newline+1:position].strip()
+
+
+class MysqlSplitter(SqlSplitter):
+    """
+    Splitter for MySQL scripts, that manages DELIMITER commands, backslash
+    escapes in strings, backquoted identifiers and '#' comments.
+    """
+
+    REGEXP_BLANK = re.compile(r'(?:\s+|--(?=\s)[^\n]*|#[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)*')
+    REGEXP_COMMAND = re.compile(r'delimiter[ \t]+(?P<delimiter>\S+)[^\n]*', re.IGNORECASE)
+    SPECIAL_CHARACTERS = '\'"`#/-'
+    REGEXP_SKIP = r"'[^'\\]*(?:\\.[^'\\]*)*'|" \
+                  r'"[^"\\]*(?:\\.[^"\\]*)*"|' \
+                  r'`[^`]*`|' \
+                  r'--(?=\s)[^\n]*|#[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/|' \
+                  r'-(?!-\s)|/(?!\*)'
+
+
+class SqlplusSplitter(SqlSplitter):
+    """
+    Splitter for Oracle scripts run with sqlplus, that manages PL/SQL blocks
+    terminated with a slash on its own line and sqlplus line commands.
+    """
+
+    REGEXP_COMMAND = re.compile(r'(?P<slash>/[ \t]*(?=\r?\n|$))|'
+                                r'(?P<command>(?:@@?|(?:rem(?:ark)?|pro(?:mpt)?|set|whenever|'
+                                r'exec(?:ute)?|spo(?:ol)?|def(?:ine)?|undef(?:ine)?|'
+                                r'var(?:iable)?|col(?:umn)?|sho(?:w)?|conn(?:ect)?|'
+                                r'pri(?:nt)?|host|timing)\b)[^\n]*)', re.IGNORECASE)
+    SPECIAL_CHARACTERS = '\'"/-\nqQ'
+    REGEXP_SKIP = r"[qQ]'(?:\[.*?\]|\{.*?\}|\(.*?\)|<.*?>|(?P<quote>\S).*?(?P=quote))'|" \
+                  r"'[^']*'|" \
+                  r'"[^"]*"|' \
+                  r'--[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/|' \
+                  r"-(?!-)|/(?!\*)|[qQ](?!')"
+    REGEXP_NEWLINE = r'\n(?![ \t]*/[ \t]*(?:\r?\n|$))'
+    REGEXP_TERMINATOR = re.compile(r'\n[ \t]*/[ \t]*(?=\r?\n|$)')
+    REGEXP_BLOCK = re.compile(r'(?:declare|begin|create\s+(?:or\s+replace\s+)?'
+                              r'(?:(?:non)?editionable\s+)?'
+                              r'(?:procedure|function|package|trigger|type|library|java)'
+                              r')\b', re.IGNORECASE)
+
+
+class MysqlDdlAnalyzer(object):
+    """
+    Static analyzer that tells how MySQL 8.0 runs a DDL statement on an InnoDB
+    table: 'instant' only changes metadata, 'inplace' builds indexes or
+    rebuilds the table while allowing concurrent writes, 'lock' runs in place
+    but blocks writes and 'copy' copies the table blocking writes. Clauses
+    that are not recognized are considered as copies.
+    """
+
+    INSTANT = 'instant'
+    INPLACE = 'inplace'
+    LOCK = 'lock'
+    COPY = 'copy'
+    # algorithms, from least to most blocking
+    ALGORITHMS = (INSTANT, INPLACE, LOCK, COPY)
+    # algorithms that block writes on the table
+    BLOCKING = (LOCK, COPY)
+    # lexemes of a statement, with comments and whitespaces in blank group
+    REGEXP_LEXEME = re.compile(r"(?P<blank>\s+|--(?=\s)[^\n]*|#[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)|"
+                               r"'[^'\\]*(?:\\.[^'\\]*)*'|"
+                               r'"[^"\\]*(?:\\.[^"\\]*)*"|'
+                               r'`[^`]*`|[^\s\'"`#/-]+|.', re.DOTALL)
+    # table name, optionally qualified with its schema
+    TABLE = r'((?:`?\w+`?\.)?`?\w+`?)'
+    REGEXP_ALTER = re.compile(r'^ALTER\s+(?:ONLINE\s+|IGNORE\s+)?TABLE\s+' + TABLE + r'\s+(.*\S)\s*$',
+                              re.IGNORECASE | re.DOTALL)
+    REGEXP_CREATE_INDEX = re.compile(r'^CREATE\s+(?:(UNIQUE|FULLTEXT|SPATIAL)\s+)?INDEX\s+`?\w+`?\s+'
+                                     r'(?:USING\s+\w+\s+)?ON\s+' + TABLE + r'(.*)$', re.IGNORECASE | re.DOTALL)
+    REGEXP_DROP_INDEX = re.compile(r'^DROP\s+INDEX\s+`?\w+`?\s+ON\s+' + TABLE + r'(.*)$', re.IGNORECASE | re.DOTALL)
+    REGEXP_OPTIMIZE = re.compile(r'^OPTIMIZE\s+(?:NO_WRITE_TO_BINLOG\s+|LOCAL\s+)?TABLE\s+' + TABLE + r'\s*$',
+                                 re.IGNORECASE)
+    REGEXP_TOKEN = re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'|\"[^\"\\]*(?:\\.[^\"\\]*)*\"|`[^`]*`|[(),]|[^'\"`(),]+")
+    REGEXP_ALGORITHM = re.compile(r'\bALGORITHM\s*=?\s*(\w+)', re.IGNORECASE)
+    REGEXP_LOCK = re.compile(r'\bLOCK\s*=?\s*(\w+)', re.IGNORECASE)
+    REGEXP_CONSTRAINT = r'^ADD\s+(?:CONSTRAINT\s+(?:`?\w+`?\s+)?)?'
+    # algorithm of ALTER TABLE clauses, the first matching rule applies
+    RULES = (
+        (REGEXP_CONSTRAINT + r'(?:FULLTEXT|SPATIAL)\b', LOCK),
+        (REGEXP_CONSTRAINT + r'PRIMARY\s+KEY\b', INPLACE),
+        (REGEXP_CONSTRAINT + r'(?:FOREIGN\s+KEY|CHECK)\b', COPY),
+        (REGEXP_CONSTRAINT + r'(?:UNIQUE|INDEX|KEY)\b', INPLACE),
+        (r'^ADD\b.*\bAUTO_INCREMENT\b', LOCK),
+        (r'^ADD\b.*\bSTORED\b', COPY),
+        (r'^ADD\b(?!\s+PARTITION\b)', INSTANT),
+        (r'^DROP\s+PRIMARY\s+KEY\b', COPY),
+        (r'^DROP\s+(?:INDEX|KEY|FOREIGN\s+KEY|CHECK|CONSTRAINT)\b', INPLACE),
+        (r'^DROP\b(?!\s+PARTITION\b)', INSTANT),
+        (r'^RENAME\s+(?:INDEX|KEY)\b', INPLACE),
+        (r'^RENAME\b', INSTANT),
+        (r'^ALTER\s+(?:COLUMN\s+)?`?\w+`?\s+(?:SET|DROP)\s+(?:DEFAULT|VISIBLE|INVISIBLE)\b', INSTANT),
+        (r'^ALTER\s+INDEX\b', INSTANT),
+        (r'^(?:DEFAULT\s+)?(?:CHARACTER\s+SET|CHARSET|COLLATE)\b', INSTANT),
+        (r'^(?:FORCE|ENGINE\s*=?\s*InnoDB|ROW_FORMAT|KEY_BLOCK_SIZE|AUTO_INCREMENT|COMMENT|STATS_\w+)\b', INPLACE),
+    )
+
+    @classmethod
+    def analyze(cls, code):
+        """
+        Analyze a DDL statement.
+        :param code: the code of the statement, without leading comments
+        :return: a tuple (table, algorithm) or None if statement is not an
+                 ALTER TABLE, CREATE INDEX, DROP INDEX or OPTIMIZE TABLE, with
+                 the table as 'schema.table' if qualified with its schema
+        """
+        match = cls.REGEXP_ALTER.match(code)
+        if match:
+            table, clauses = match.groups()
+            algorithm = cls.INSTANT
+            for clause in cls.split_clauses(clauses):
+                algorithm = cls.worst(algorithm, cls.clause_algorithm(clause))
+            return table.replace('`', ''), cls.explicit_algorithm(clauses, algorithm)
+        match = cls.REGEXP_CREATE_INDEX.match(code)
+        if match:
+            kind, table, options = match.groups()
+            algorithm = cls.LOCK if kind and kind.upper() in ('FULLTEXT', 'SPATIAL') else cls.INPLACE
+            return table.replace('`', ''), cls.explicit_algorithm(options, algorithm)
+        match = cls.REGEXP_DROP_INDEX.match(code)
+        if match:
+            table, options = match.groups()
+            return table.replace('`', ''), cls.explicit_algorithm(options, cls.INPLACE)
+        match = cls.REGEXP_OPTIMIZE.match(code)
+        if match:
+            return match.group(1).replace('`', ''), cls.INPLACE
+        return None
+
+    @classmethod
+    def split_clauses(cls, clauses):
+        """
+        Split clauses of an ALTER TABLE on commas out of parentheses.
+        :param clauses: the clauses of the ALTER TABLE
+        :return: the list of clauses
+        """
+        result = []
+        current = ''
+        depth = 0
+        for token in cls.REGEXP_TOKEN.findall(clauses):
+            if token == ',' and depth == 0:
+                result.append(current.strip())
+                current = ''
+                continue
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+            current += token
+        result.append(current.strip())
+        return [clause for clause in result if clause]
+
+    @classmethod
+    def clause_algorithm(cls, clause):
+        """
+        Return the algorithm of an ALTER TABLE clause.
+        :param clause: the clause
+        :return: the algorithm, COPY if clause is not recognized
+        """
+        if cls.REGEXP_ALGORITHM.match(clause) or cls.REGEXP_LOCK.match(clause):
+            return cls.INSTANT
+        for regexp, algorithm in cls.RULES:
+            if re.match(regexp, clause, re.IGNORECASE | re.DOTALL):
+                return algorithm
+        return cls.COPY
+
+    @classmethod
+    def explicit_algorithm(cls, options, algorithm):
+        """
+        Apply ALGORITHM and LOCK options given in a statement, that MySQL
+        enforces, to the analyzed algorithm.
+        :param options: the text holding options
+        :param algorithm: the analyzed algorithm
+        :return: the algorithm the statement runs with
+        """
+        match = cls.REGEXP_ALGORITHM.search(options)
+        if match and match.group(1).upper() in ('INSTANT', 'INPLACE', 'COPY'):
+            algorithm = match.group(1).lower()
+        match = cls.REGEXP_LOCK.search(options)
+        if match and match.group(1).upper() in ('SHARED', 'EXCLUSIVE') and algorithm != cls.COPY:
+            algorithm = cls.LOCK
+        return algorithm
+
+    @classmethod
+    def worst(cls, first, second):
+        """
+        Return the most blocking of two algorithms.
+        :param first: the first algorithm
+        :param second: the second algorithm
+        :return: the most blocking algorithm
+        """
+        return max(first, second, key=cls.ALGORITHMS.index)
+
+    @classmethod
+    def enforce(cls, code, algorithm):
+        """
+        Append ALGORITHM and LOCK options to a DDL statement so that MySQL
+        fails instead of silently running it with a more blocking algorithm.
+        :param code: the code of the statement
+        :param algorithm: the analyzed algorithm
+        :return: the options to append or None if statement already sets
+                 them or would block writes anyway
+        """
+        if algorithm in cls.BLOCKING or cls.REGEXP_ALGORITHM.search(code) or \
+                cls.REGEXP_LOCK.search(code) or cls.REGEXP_OPTIMIZE.match(code):
+            return None
+        if cls.REGEXP_ALTER.match(code):
+            if algorithm == cls.INSTANT:
+                return ', ALGORITHM=INSTANT'
+            return ', ALGORITHM=INPLACE, LOCK=NONE'
+        return ' ALGORITHM=INPLACE LOCK=NONE'
+
+    @classmethod
+    def append(cls, text, options):
+        """
+        Append options to the text of a statement, before its trailing
+        comments so that they are not commented out.
+        :param text: the text of the statement
+        :param options: the options to append
+        :return: the text of the statement with options
+        """
+        end = 0
+        for match in cls.REGEXP_LEXEME.finditer(text):
+            if not match.group('blank'):
+                end = match.end()
+        return text[:end] + options + text[end:]
+
+
+###############################################################################
+#                              MIGRATION STEPS                                #
+###############################################################################
+
+class Throttle(object):
+    """
+    Pause between chunks of long running steps, for a time proportional to the
+    duration of the chunk, so that database keeps serving other clients. If a
+    function checking replication lag is given, pause also while replicas are
+    lagging behind, between chunks and between scripts.
+    """
+
+    def __init__(self, ratio=0.5, check=None, max_lag=10, interval=1, timeout=3600):
+        """
+        Constructor.
+        :param ratio: the ratio of the duration of a chunk to pause after it
+        :param check: function that returns the lag of replicas in seconds
+               (None if unknown) or None not to check replication lag
+        :param max_lag: the maximum lag of replicas in seconds
+        :param interval: the interval between lag checks in seconds
+        :param timeout: the maximum time to wait for replicas in seconds
+        """
+        self.ratio = ratio
+        self.check = check
+        self.max_lag = max_lag
+        self.interval = interval
+        self.timeout = timeout
+        self.checked = None
+        self.throttled = 0.0
+
+    def pause(self, elapsed):
+        """
+        Pause after a chunk, adding pause to throttled time.
+        :param elapsed: the duration of the chunk in seconds
+        """
+        delay = elapsed * self.ratio
+        if delay > 0:
+            time.sleep(delay)
+            self.throttled += delay
+        self.wait()
+
+    def wait(self):
+        """
+        Wait while replicas are lagging, adding waiting time to throttled
+        time. Lag is checked at most once per interval.
+        """
+        if not self.check:
+            return
+        if self.checked is not None and time.time() - self.checked < self.interval:
+            return
+        waited = 0.0
+        lag = self.check()
+        while lag is None or lag > self.max_lag:
+            if waited >= self.timeout:
+                raise AppException("Replicas still lagging after %s seconds (lag: %s)" % (int(waited), lag))
+            time.sleep(self.interval)
+            waited += self.interval
+            self.throttled += self.interval
+            lag = self.check()
+        self.checked = time.time()
+
+
+class ChunkedStep(object):
+    """
+    Parent class for steps that run a statement in chunks of primary key
+    ranges of a table. Each chunk is committed and followed by a pause, and
+    the position reached is recorded in progress meta table so that an
+    interrupted step is resumed.
+    """
+
+    NAME = None
+
+    def __init__(self, adapter, throttle, chunk_size):
+        """
+        Constructor.
+        :param adapter: the database adapter
+        :param throttle: the throttle to pause between chunks
+        :param chunk_size: the number of rows processed per chunk
+        """
+        self.adapter = adapter
+        self.database = adapter.database
+        self.throttle = throttle
+        self.chunk_size = chunk_size
+
+    def run_chunks(self, progress, table, key, statement):
+        """
+        Run a statement in chunks until the end of the table.
+        :param progress: the progress of the step
+        :param table: the table to process
+        :param key: the primary key of the table
+        :param statement: a function that returns the statement to run for a
+               chunk given the condition on key that selects the chunk
+        """
+        position = self.position(progress['POSITION'])
+        parameters = {'id': progress['ID'], 'size': self.chunk_size,
+                      'table': self.adapter.quote_identifier(table),
+                      'key': self.adapter.quote_identifier(key),
+                      'position': self.adapter.position_cast(table, key)}
+        while True:
+            first = position is None
+            parameters['where'] = '' if first else ' WHERE %s' % self.adapter.chunk_lower(parameters['key'])
+            parameters['statement'] = statement(self.adapter.chunk_condition(first))
+            start = time.time()
+            result = self.database.run_query(self.adapter.SQL_CHUNK % parameters, cast=False)
+            reached = self.position(result[0]['POSITION'] if result else None)
+            if reached == position:
+                break
+            position = reached
+            self.throttle.pause(time.time() - start)
+
+    @staticmethod
+    def position(value):
+        """
+        Normalize a position read in progress meta table.
+        :param value: the position as read in meta table
+        :return: the position or None if no chunk was processed
+        """
+        if value in (None, '', 'NULL'):
+            return None
+        return value
+
+
+class OnlineSchemaChange(ChunkedStep):
+    """
+    Run an ALTER TABLE on MySQL without blocking writes on the table: the
+    altered table is built as a shadow table, filled with rows copied in
+    primary key chunks while triggers report changes made meanwhile, and is
+    swapped with the original table with an atomic RENAME TABLE. Progress is
+    recorded in _progress meta table so that an interrupted copy is resumed.
+    Progress is recorded before the shadow table and its triggers are
+    created, that are created again if the step is interrupted before the
+    first chunk. Tables with foreign keys (that the shadow table would lose or
+    that would reference the old table) or triggers are refused.
+    """
+
+    NAME = 'online'
+    REGEXP_ALTER = re.compile(r'^ALTER\s+TABLE\s+`?(\w+)`?\s+(.*\S)\s*$', re.IGNORECASE | re.DOTALL)
+    SQL_COLUMNS = """SELECT column_name AS NAME FROM information_schema.columns
+    WHERE table_schema = database() AND table_name = '%(table)s'
+    ORDER BY ordinal_position;"""
+    SQL_SHADOW = """DROP TRIGGER IF EXISTS `%(shadow)s_ins`;
+    DROP TRIGGER IF EXISTS `%(shadow)s_upd`;
+    DROP TRIGGER IF EXISTS `%(shadow)s_del`;
+    DROP TABLE IF EXISTS `%(shadow)s`;
+    CREATE TABLE `%(shadow)s` LIKE `%(table)s`;
+    ALTER TABLE `%(shadow)s` %(alter)s;"""
+    SQL_TRIGGERS = """CREATE TRIGGER `%(shadow)s_ins` AFTER INSERT ON `%(table)s` FOR EACH ROW
+  REPLACE INTO `%(shadow)s` (%(columns)s) VALUES (%(new)s);
+DELIMITER ;;
+CREATE TRIGGER `%(shadow)s_upd` AFTER UPDATE ON `%(table)s` FOR EACH ROW
+BEGIN
+  DELETE IGNORE FROM `%(shadow)s` WHERE `%(key)s` = OLD.`%(key)s`;
+  REPLACE INTO `%(shadow)s` (%(columns)s) VALUES (%(new)s);
+END;;
+DELIMITER ;
+CREATE TRIGGER `%(shadow)s_del` AFTER DELETE ON `%(table)s` FOR EACH ROW
+  DELETE IGNORE FROM `%(shadow)s` WHERE `%(key)s` = OLD.`%(key)s`;"""
+    SQL_COPY = """INSERT IGNORE INTO `%(shadow)s` (%(columns)s)
+      SELECT %(columns)s FROM `%(table)s`
+      WHERE %(condition)s LOCK IN SHARE MODE"""
+    SQL_SWAP = """UPDATE _progress SET status = 'swap', update_date = now() WHERE id = %(id)s;
+    RENAME TABLE `%(table)s` TO `%(old)s`, `%(shadow)s` TO `%(table)s`;"""
+    SQL_CLEAN = """DROP TABLE IF EXISTS `%(old)s`;
+    UPDATE _progress SET status = 'done', update_date = now() WHERE id = %(id)s;"""
+    SQL_TABLE_EXISTS = """SELECT count(*) AS NB FROM information_schema.tables
+    WHERE table_schema = database() AND table_name = '%(table)s';"""
+    SQL_FOREIGN_KEYS = """SELECT count(*) AS NB FROM information_schema.referential_constraints
+    WHERE constraint_schema = database() AND (table_name = '%(table)s' OR referenced_table_name = '%(table)s');"""
+    SQL_TABLE_TRIGGERS = """SELECT count(*) AS NB FROM information_schema.triggers
+    WHERE event_object_schema = database() AND event_object_table = '%(table)s';"""
+
+    def accepts(self, statement, arguments):
+        """
+        Tells if a statement is run by this step.
+        :param statement: the statement
+        :param arguments: the arguments of the directive, that are the names
+               of the tables to alter online (all tables if empty)
+        :return: True if the statement is an ALTER TABLE to run online
+        """
+        match = self.REGEXP_ALTER.match(statement.code())
+        return bool(match) and (not arguments or match.group(1) in arguments.split())
+
+    def run(self, script, index, statement):
+        """
+        Run an ALTER TABLE statement online, resuming interrupted copy if any.
+        :param script: the script of the statement
+        :param index: the index of the statement in the script
+        :param statement: the ALTER TABLE statement
+        """
+        table, alter = self.REGEXP_ALTER.match(statement.code()).groups()
+        parameters = {'table': table, 'alter': alter, 'shadow': '_%s_new' % table, 'old': '_%s_old' % table}
+        progress = self.adapter.progress_find(script, index)
+        if progress and progress['STATUS'] == 'swap' and not self.table_exists(parameters['shadow']):
+            parameters['id'] = progress['ID']
+            self.database.run_query(self.SQL_CLEAN % parameters)
+            return
+        key = self.adapter.primary_key(table)
+        parameters['key'] = key
+        if not progress:
+            self.check_table(table)
+            progress = self.adapter.progress_begin(script, index, self.NAME, table)
+        if self.position(progress['POSITION']) is None:
+            self.database.run_query(self.SQL_SHADOW % parameters)
+            self.set_columns(parameters)
+            self.database.run_query(self.SQL_TRIGGERS % parameters)
+        else:
+            self.set_columns(parameters)
+        parameters['id'] = progress['ID']
+
+        def copy(condition):
+            parameters['condition'] = condition % {'column': '`%s`' % key}
+            return self.SQL_COPY % parameters
+
+        self.run_chunks(progress, table, key, copy)
+        self.database.run_query(self.SQL_SWAP % parameters)
+        self.database.run_query(self.SQL_CLEAN % parameters)
+
+    def set_columns(self, parameters):
+        """
+        Set columns copied in shadow table, that are columns of the table
+        that still exist in shadow table.
+        :param parameters: the parameters of queries
+        """
+        result = self.database.run_query(self.SQL_COLUMNS % {'table': parameters['shadow']}, cast=False)
+        altered = set([line['NAME'] for line in result])
+        result = self.database.run_query(self.SQL_COLUMNS % parameters, cast=False)
+        columns = [line['NAME'] for line in result if line['NAME'] in altered]
+        parameters['columns'] = ', '.join(['`%s`' % column for column in columns])
+        parameters['new'] = ', '.join(['NEW.`%s`' % column for column in columns])
+
+    def table_exists(self, table):
+        """
+        Tells if a table exists.
+        :param table: the table
+        :return: True if table exists
+        """
+        result = self.database.run_query(self.SQL_TABLE_EXISTS % {'table': table}, cast=False)
+        return int(result[0]['NB']) > 0
+
+    def check_table(self, table):
+        """
+        Check that a table can be altered online: it must not have foreign
+        keys, nor be referenced by foreign keys, nor have triggers. If not, an
+        AppException is raised.
+        :param table: the table
+        """
+        result = self.database.run_query(self.SQL_FOREIGN_KEYS % {'table': table}, cast=False)
+        if int(result[0]['NB']) > 0:
+            raise AppException("Table '%s' can't be altered online because of its foreign keys" % table)
+        result = self.database.run_query(self.SQL_TABLE_TRIGGERS % {'table': table}, cast=False)
+        if int(result[0]['NB']) > 0:
+            raise AppException("Table '%s' can't be altered online because of its triggers" % table)
+
+
+class BatchStatement(ChunkedStep):
+    """
+    Run an UPDATE, DELETE or INSERT ... SELECT statement in chunks of primary
+    key ranges of the updated, deleted or selected table, so that locks are
+    held for a short time and undo logs, binary logs and replicas keep up.
+    """
+
+    NAME = 'batch'
+    REGEXP_TOKEN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"[^\"]*\"|`[^`]*`|\w+|\s+|[^\w\s'\"`]")
+    # keywords that end the table reference of the chunked table
+    KEYWORDS = set(['SET', 'WHERE', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'CROSS', 'STRAIGHT_JOIN', 'NATURAL',
+                    'GROUP', 'HAVING', 'ORDER', 'LIMIT', 'ON', 'USING', 'PARTITION', 'FOR', 'LOCK'])
+    # keywords that end the WHERE clause
+    ENDINGS = set(['GROUP', 'HAVING', 'ORDER', 'LIMIT', 'FOR', 'LOCK', 'RETURNING'])
+    MODIFIERS = set(['LOW_PRIORITY', 'QUICK', 'IGNORE', 'DELAYED', 'HIGH_PRIORITY'])
+
+    def accepts(self, statement, arguments):
+        """
+        Tells if a statement is run by this step.
+        :param statement: the statement
+        :param arguments: the arguments of the directive, that are the names
+               of the tables to process in chunks (all tables if empty)
+        :return: True if the statement is a DML statement to run in chunks
+        """
+        parsed = self.parse(statement)
+        return bool(parsed) and (not arguments or parsed[0] in arguments.split())
+
+    def run(self, script, index, statement):
+        """
+        Run a DML statement in chunks, resuming interrupted run if any.
+        :param script: the script of the statement
+        :param index: the index of the statement in the script
+        :param statement: the DML statement
+        """
+        table, reference, head, where, tail = self.parse(statement)
+        key = self.adapter.primary_key(table)
+        column = '%s.%s' % (reference, self.adapter.quote_identifier(key))
+        progress = self.adapter.progress_find(script, index)
+        if not progress:
+            progress = self.adapter.progress_begin(script, index, self.NAME, table)
+
+        def chunk(condition):
+            condition = condition % {'column': column}
+            if where:
+                return '%s WHERE %s AND (%s)%s' % (head, condition, where, tail)
+            else:
+                return '%s WHERE %s%s' % (head, condition, tail)
+
+        self.run_chunks(progress, table, key, chunk)
+        self.database.run_query(self.adapter.progress_status(progress['ID'], 'done'))
+
+    def parse(self, statement):
+        """
+        Parse a DML statement to find the table to process in chunks and the
+        place where the condition on chunks is inserted.
+        :param statement: the statement
+        :return: a tuple (table, reference, head, where, tail) where table is
+                 the name of the table, reference the name or alias of the
+                 table in the statement, head the statement before WHERE
+                 clause, where the condition of WHERE clause (or None) and
+                 tail the statement after WHERE clause; None if statement
+                 can't be processed in chunks, such as statements with a LIMIT
+                 clause that would apply to each chunk
+        """
+        tokens = self.REGEXP_TOKEN.findall(statement.code())
+        words = list(self.top_level(tokens))
+        names = [token.upper() for _, token in words]
+        if not names or 'UNION' in names or 'LIMIT' in names:
+            return None
+        if names[0] in ('UPDATE', 'DELETE') and 'ORDER' in names:
+            return None
+        if names[0] == 'UPDATE':
+            position = 1
+        elif names[0] == 'DELETE' and 'FROM' in names:
+            position = names.index('FROM') + 1
+            if [name for name in names[1:position - 1] if name not in self.MODIFIERS]:
+                return None
+        elif names[0] in ('INSERT', 'REPLACE') and 'SELECT' in names and \
+                'FROM' in names[names.index('SELECT'):]:
+            position = names.index('FROM', names.index('SELECT')) + 1
+        else:
+            return None
+        while position < len(names) and names[position] in self.MODIFIERS:
+            position += 1
+        if position >= len(names):
+            return None
+        # table name, possibly prefixed with schema, and alias
+        first = position
+        if position + 2 < len(names) and names[position + 1] == '.':
+            position += 2
+        table = words[position][1].strip('`"')
+        reference = ''.join([token for _, token in words[first:position + 1]])
+        position += 1
+        if position < len(names) and names[position] == 'AS':
+            position += 1
+        if position < len(names) and names[position] not in self.KEYWORDS and \
+                (names[position][0].isalpha() or names[position][0] in '`"_'):
+            reference = words[position][1]
+            position += 1
+        if position < len(names) and names[position] == ',':
+            return None
+        # WHERE clause and what follows
+        where = None
+        end = len(tokens)
+        for index in range(position, len(names)):
+            name = names[index]
+            if name == 'WHERE' and where is None:
+                where = words[index][0]
+            elif name in self.ENDINGS or \
+                    (name == 'ON' and (where is not None or names[index + 1:index + 2] == ['DUPLICATE'])):
+                end = words[index][0]
+                break
+        tail = ''.join(tokens[end:]).strip()
+        tail = ' ' + tail if tail else ''
+        if where is None:
+            return table, reference, ''.join(tokens[:end]).rstrip(), None, tail
+        else:
+            return table, reference, ''.join(tokens[:where]).rstrip(), ''.join(tokens[where + 1:end]).strip(), tail
+
+    @staticmethod
+    def top_level(tokens):
+        """
+        Iterate on tokens out of parentheses that are not blanks.
+        :param tokens: the tokens
+        :return: generator of tuples (index, token)
+        """
+        depth = 0
+        for index, token in enumerate(tokens):
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+            elif depth == 0 and not token.isspace():
+                yield index, token
+
+
 ###############################################################################
 #                             DATABASE ADAPTERS                               #
 ###############################################################################
@@ -633,6 +1643,39 @@ class DatabaseAdapter(object):
 
     # SQL command to commit
     COMMIT = 'COMMIT;'
+    # class that splits scripts into statements
+    SPLITTER = None
+    # steps run by migration program, by name of script directive
+    STEPS = {}
+    # quoted identifier
+    IDENTIFIER = '%s'
+    # query that returns replication lag on a replica and columns of lag
+    SQL_REPLICA_LAG = None
+    REPLICA_LAG_COLUMNS = ('LAG',)
+    # analyzer of DDL statements and queries that return size of tables of
+    # current schema and of given schemas
+    DDL_ANALYZER = None
+    SQL_TABLE_SIZES = None
+    SQL_SCHEMA_TABLE_SIZES = None
+    # query that refreshes optimizer statistics of a table
+    SQL_GATHER_STATISTICS = None
+    # query that returns the type of a column and expressions that read
+    # position of progress meta table in the type of the key, by regular
+    # expression on this type
+    SQL_COLUMN_TYPE = None
+    POSITION_CASTS = ()
+    # query that lists invalid stored objects
+    SQL_INVALID_OBJECTS = None
+    # query that lists sessions with long transactions locking tables and
+    # query that sets the timeout of DDL waiting for locks
+    SQL_BLOCKING_SESSIONS = None
+    SQL_LOCK_TIMEOUT = None
+    # queries that record server cost of scripts in meta columns, the first
+    # one ranking scripts, and query that lists most costly scripts
+    COST_COLUMNS = ()
+    SQL_SCRIPT_COST_BEGIN = None
+    SQL_SCRIPT_COST = None
+    SQL_SCRIPTS_COST = None
 
     def __init__(self, database):
         """
@@ -640,8 +1683,11 @@ class DatabaseAdapter(object):
         :param database: the database connexion
         """
         self.database = database
+        self.splitter = self.SPLITTER()
         self.install_id = None
         self.installed_scripts = None
+        self.installed_checksums = None
+        self.checkpoint = None
 
     def run_script(self, script, cast=None):
         """
@@ -652,6 +1698,24 @@ class DatabaseAdapter(object):
         """
         return self.database.run_script(script=script, cast=cast)
 
+    def run_statements(self, query):
+        """
+        Run statements of a script run by migration program, such as scripts
+        with steps or retried on transient errors.
+        :param query: the statements to run
+        :return: the result of the statements
+        """
+        return self.database.run_query(query)
+
+    def run_catalog_query(self, query):
+        """
+        Run a query on dictionary of the database, which result is not cast.
+        :param query: the query to run
+        :return: the result of the query
+        """
+        return self.database.run_query(query, cast=False)
+
+    @traced
     def meta_create(self, init):
         """
         Called to create meta tables.
@@ -660,18 +1724,55 @@ class DatabaseAdapter(object):
         """
         if init:
             self.database.run_query(query=self.SQL_DROP_META)
-        self.database.run_query(query=self.SQL_CREATE_META)
+        query = self.SQL_CREATE_META
+        for table, column, definition in self.META_COLUMNS:
+            parameters = {'table': table, 'column': column, 'definition': definition}
+            query += self.SQL_ADD_COLUMN % parameters
+        self.database.run_query(query=query)
 
+    @traced
     def list_scripts(self):
         """
-        List all successfuly passed scripts on database.
-        :return: the list of passed scripts
+        List all successfuly passed scripts on database with their checksum.
+        :return: the list of passed scripts as tuples (script, checksum)
         """
-        result = self.database.run_query(query=self.SQL_LIST_SCRIPTS)
-        if result:
-            self.installed_scripts = [l['SCRIPT'] for l in result]
-        else:
-            self.installed_scripts = []
+        result = self.database.run_query(query=self.SQL_LIST_SCRIPTS, cast=False)
+        scripts = []
+        for line in result or ():
+            checksum = line['CHECKSUM']
+            scripts.append((line['SCRIPT'], checksum if checksum not in ('', 'NULL') else None))
+        return scripts
+
+    def load_scripts(self, scripts):
+        """
+        Load passed scripts, checked by script_passed() and script_checksum().
+        :param scripts: the list of passed scripts as tuples (script, checksum)
+        """
+        self.installed_scripts = [script for script, _ in scripts]
+        self.installed_checksums = dict(scripts)
+
+    def snapshot(self):
+        """
+        Build a snapshot of meta tables, with passed scripts, their checksum
+        and checkpoint of last failed migration.
+        :return: the snapshot as a dictionary
+        """
+        scripts = self.list_scripts()
+        checkpoint = self.last_checkpoint()
+        return {
+            'scripts': [list(script) for script in scripts],
+            'checkpoint': list(checkpoint) if checkpoint else None,
+        }
+
+    def load_snapshot(self, snapshot):
+        """
+        Load passed scripts and checkpoint from a snapshot, instead of querying
+        database.
+        :param snapshot: the snapshot as returned by snapshot()
+        """
+        self.load_scripts([tuple(script) for script in snapshot['scripts']])
+        checkpoint = snapshot.get('checkpoint')
+        self.checkpoint = tuple(checkpoint) if checkpoint else None
 
     def script_passed(self, script):
         """
@@ -679,7 +1780,15 @@ class DatabaseAdapter(object):
         :param script: the script to test
         :return: true is the script was successfuly passed else false
         """
-        return script in self.installed_scripts
+        return script in self.installed_checksums
+
+    def script_checksum(self, script):
+        """
+        Return the checksum of a given script when it was passed on database.
+        :param script: the script
+        :return: the checksum or None if unknown
+        """
+        return self.installed_checksums.get(script)
 
     def install_begin(self, version):
         """
@@ -705,7 +1814,7 @@ class DatabaseAdapter(object):
         :param script: the script that will run
         :return: generated query
         """
-        parameters = {'script': script}
+        parameters = {'script': script, 'checksum': self.format_checksum(script)}
         return self.SQL_SCRIPT_BEGIN % parameters
 
     def script_done(self, script):
@@ -717,6 +1826,135 @@ class DatabaseAdapter(object):
         parameters = {'script': script}
         return self.SQL_SCRIPT_DONE % parameters
 
+    def profile_setup(self, profile): # pylint: disable=W0613
+        """
+        Generate query that applies session settings of a profile.
+        :param profile: the settings as a dictionary
+        :return: generated query or None if database has no session profiles
+        """
+        return None
+
+    def profile_restore(self, profile): # pylint: disable=W0613
+        """
+        Generate query that restores session settings changed by a profile.
+        :param profile: the settings as a dictionary
+        :return: generated query or None if database has no session profiles
+        """
+        return None
+
+    def script_check_start(self):
+        """
+        Return the current date of the database, from which errors left by a
+        script run by migration program in several sessions are checked.
+        :return: the date or None if database has no such check
+        """
+        return None
+
+    def script_check_begin(self, start=None): # pylint: disable=W0613
+        """
+        Generate query run before a script to prepare the check of errors
+        after the script.
+        :param start: the date returned by script_check_start() if errors are
+               checked in another session than the script
+        :return: generated query or None if database has no such check
+        """
+        return None
+
+    def script_check(self, script): # pylint: disable=W0613
+        """
+        Generate query run after a script that fails if the script left errors
+        that did not interrupt it.
+        :param script: the script that was run
+        :return: generated query or None if database has no such check
+        """
+        return None
+
+    def script_cost_begin(self):
+        """
+        Generate query run before a script to record server statistics of the
+        session.
+        :return: generated query or None if cost can't be measured
+        """
+        return self.SQL_SCRIPT_COST_BEGIN
+
+    def script_cost(self, script):
+        """
+        Generate query run after a script that records in meta tables the
+        server cost of the script, as statistics of the session since the
+        beginning of the script.
+        :param script: the script that was run
+        :return: generated query or None if cost can't be measured
+        """
+        if not self.SQL_SCRIPT_COST:
+            return None
+        return self.SQL_SCRIPT_COST % {'script': script}
+
+    def scripts_cost(self, limit):
+        """
+        Return the most costly scripts recorded in meta tables.
+        :param limit: the maximum number of scripts
+        :return: a list of tuples (script, version, costs) where costs is the
+                 list of values of COST_COLUMNS
+        """
+        if not self.SQL_SCRIPTS_COST:
+            raise AppException("Cost of scripts is not available for this database")
+        result = self.database.run_query(self.SQL_SCRIPTS_COST % {'limit': limit}, cast=False)
+        return [(line['SCRIPT'], line['VERSION'], [line[column] for column in self.COST_COLUMNS])
+                for line in result or ()]
+
+    def script_marker(self, script):
+        """
+        Generate query that records the name of the running script in the
+        session (used in lean mode instead of meta rows).
+        :param script: the script that will run
+        :return: generated query
+        """
+        parameters = {'script': script}
+        return self.SQL_SCRIPT_MARKER % parameters
+
+    def marked_script(self, output):
+        """
+        Extract the name of the last script marked in the output of a
+        migration run in lean mode.
+        :param output: the output of the migration
+        :return: the name of the last marked script or None
+        """
+        if not output:
+            return None
+        markers = re.findall(self.REGEXP_SCRIPT_MARKER, output, re.MULTILINE)
+        if markers:
+            return markers[-1].strip()
+        else:
+            return None
+
+    def scripts_passed(self, scripts, success=True):
+        """
+        Generate a single query recording given scripts as passed (used to
+        write meta rows in a batch in lean mode).
+        :param scripts: the list of scripts that were run
+        :param success: tells if scripts were successful
+        :return: generated query
+        """
+        values = [self.SQL_SCRIPTS_PASSED_VALUE %
+                  {'script': script, 'success': 1 if success else 0,
+                   'checksum': self.format_checksum(script)}
+                  for script in scripts]
+        parameters = {'values': self.SQL_SCRIPTS_PASSED_SEPARATOR.join(values)}
+        return self.SQL_SCRIPTS_PASSED % parameters
+
+    @staticmethod
+    def format_checksum(script):
+        """
+        Format the checksum of a script for a query.
+        :param script: the script
+        :return: the checksum as an SQL string or NULL if unknown
+        """
+        checksum = getattr(script, 'checksum', None)
+        if checksum:
+            return "'%s'" % checksum
+        else:
+            return 'NULL'
+
     def scripts_error(self):
         """
         Called when we mus invalidate all scripts in current migration
@@ -737,20 +1975,411 @@ class DatabaseAdapter(object):
         else:
             return None
 
+    def last_checkpoint(self):
+        """
+        Return the script that failed in last migration, with the number of
+        statements it successfuly passed and its checksum.
+        :return: a tuple (script, statement, checksum) or None
+        """
+        if not self.database:
+            return self.checkpoint
+        result = self.database.run_query(self.SQL_LAST_CHECKPOINT, cast=False)
+        if not result:
+            return None
+        line = result[0]
+        statement = line['STATEMENT']
+        statement = int(statement) if statement not in ('', 'NULL') else 0
+        checksum = line['CHECKSUM']
+        checksum = checksum if checksum not in ('', 'NULL') else None
+        return line['SCRIPT'], statement, checksum
+
+    def statements_script(self, statements, skip=0, checkpoint=False):
+        """
+        Generate script from a list of statements.
+        :param statements: the list of statements
+        :param skip: the number of statements to skip
+        :param checkpoint: tells if we should record the number of passed
+               statements after each statement
+        :return: the generated script
+        """
+        result = []
+        delimiter = self.splitter.DELIMITER
+        if checkpoint and skip:
+            text, delimiter = self.format_statement(self.statement_checkpoint(skip), delimiter)
+            result.append(text)
+        for index, statement in enumerate(statements):
+            if index < skip:
+                continue
+            text, delimiter = self.format_statement(statement, delimiter)
+            result.append(text)
+            if checkpoint:
+                text, delimiter = self.format_statement(self.statement_checkpoint(index + 1), delimiter)
+                result.append(text)
+        reset = self.reset_delimiter(delimiter)
+        if reset:
+            result.append(reset)
+        return '\n'.join(result)
+
+    def statement_checkpoint(self, statement):
+        """
+        Build the statement that records the number of passed statements of
+        running script.
+        :param statement: the number of passed statements
+        :return: the checkpoint statement
+        """
+        return Statement(self.SQL_SCRIPT_CHECKPOINT % {'statement': statement}, None, 0)
+
+    def progress_find(self, script, statement):
+        """
+        Find unfinished progress of a step run by a statement of a script.
+        :param script: the script
+        :param statement: the index of the statement in the script
+        :return: progress as a dictionary with ID, POSITION and STATUS or None
+        """
+        parameters = {'script': script, 'statement': statement}
+        result = self.database.run_query(self.SQL_PROGRESS_FIND % parameters, cast=False)
+        if result:
+            return result[0]
+        else:
+            return None
 
-class MysqlDatabaseAdapter(DatabaseAdapter):
-    """
-    Adapter for MySQL.
-    """
+    def progress_begin(self, script, statement, step, target):
+        """
+        Record the beginning of a step run by a statement of a script.
+        :param script: the script
+        :param statement: the index of the statement in the script
+        :param step: the name of the step
+        :param target: the table processed by the step
+        :return: progress as a dictionary with ID, POSITION and STATUS
+        """
+        parameters = {'script': script, 'statement': statement, 'step': step, 'target': target}
+        self.database.run_query(self.SQL_PROGRESS_BEGIN % parameters)
+        return self.progress_find(script, statement)
+
+    def replica_lag(self, replica, query=None):
+        """
+        Return replication lag of a replica. An AppException is raised if the
+        replica has no replication status, as it would never catch up.
+        :param replica: the connection to the replica
+        :param query: the query that returns lag in a LAG column, default to
+               adapter query
+        :return: the lag in seconds or None if unknown
+        """
+        query = query or self.SQL_REPLICA_LAG
+        if not query:
+            raise AppException("REPLICA_LAG_QUERY must be set in configuration to check replication lag")
+        result = replica.run_query(query, cast=False)
+        if not result:
+            raise AppException("Replica '%s' has no replication status" % getattr(replica, 'hostname', replica))
+        for column in self.REPLICA_LAG_COLUMNS:
+            value = result[0].get(column)
+            if value not in (None, '', 'NULL'):
+                return float(value)
+        return None
+
+    def script_throttled(self, script, throttled):
+        """
+        Generate query that records time spent waiting for replicas while
+        running a script.
+        :param script: the script
+        :param throttled: the time in seconds
+        :return: generated query
+        """
+        parameters = {'script': script, 'throttled': throttled}
+        return self.SQL_SCRIPT_THROTTLED % parameters
 
-    SQL_DROP_META = """
-    DROP TABLE IF EXISTS _scripts;
-    DROP TABLE IF EXISTS _install;
-    """
-    SQL_CREATE_META = """
-    CREATE TABLE IF NOT EXISTS _install (
-      id integer NOT NULL AUTO_INCREMENT,
-      version varchar(20) NOT NULL,
+    def script_retried(self, script, retries, retry_time):
+        """
+        Generate query that records retries of statements of a script after
+        transient errors.
+        :param script: the script
+        :param retries: the number of retries
+        :param retry_time: the time in seconds waited before retries
+        :return: generated query
+        """
+        parameters = {'script': script, 'retries': retries, 'retry_time': retry_time}
+        return self.SQL_SCRIPT_RETRIED % parameters
+
+    def progress_status(self, progress, status):
+        """
+        Generate query that sets status of a step progress.
+        :param progress: the ID of the progress
+        :param status: the new status
+        :return: generated query
+        """
+        parameters = {'id': progress, 'status': status}
+        return self.SQL_PROGRESS_STATUS % parameters
+
+    def primary_key(self, table):
+        """
+        Return the primary key column of a table.
+        :param table: the table
+        :return: the name of the primary key column
+        """
+        result = self.database.run_query(self.SQL_PRIMARY_KEY % {'table': table}, cast=False)
+        if not result or len(result) != 1:
+            raise AppException("Table '%s' must have a single column primary key to be processed in chunks" % table)
+        return result[0]['NAME']
+
+    def table_sizes(self, schemas=()):
+        """
+        Return the size of tables of the database.
+        :param schemas: other schemas which tables are returned as
+               'schema.table', if database supports it
+        :return: a dictionary of (size in bytes, number of rows) by lower case
+                 table name, empty if sizes can't be queried
+        """
+        if not self.database or not self.SQL_TABLE_SIZES:
+            return {}
+        result = list(self.run_catalog_query(self.SQL_TABLE_SIZES) or ())
+        if schemas and self.SQL_SCHEMA_TABLE_SIZES:
+            parameters = {'schemas': ', '.join(["'%s'" % schema.lower() for schema in schemas])}
+            result += list(self.run_catalog_query(self.SQL_SCHEMA_TABLE_SIZES % parameters) or ())
+        sizes = {}
+        for line in result:
+            size = int(line['SIZE']) if line['SIZE'] not in (None, '', 'NULL') else None
+            rows = int(line['ROWS']) if line['ROWS'] not in (None, '', 'NULL') else None
+            sizes[line['NAME'].lower()] = size, rows
+        return sizes
+
+    def blocking_sessions(self, tables, age):
+        """
+        Return the other sessions with a transaction open for a given time that
+        hold locks on tables.
+        :param tables: the list of table names
+        :param age: the minimum age of transactions in seconds
+        :return: the list of tuples (session, user, table, age), empty if
+                 sessions can't be queried
+        """
+        if not self.database or not self.SQL_BLOCKING_SESSIONS or not tables:
+            return []
+        parameters = {'tables': ', '.join(["'%s'" % table.lower() for table in tables]), 'age': age}
+        result = self.database.run_query(self.SQL_BLOCKING_SESSIONS % parameters, cast=False)
+        return [(line['ID'], line['USER'], line['NAME'], int(float(line['AGE']))) for line in result or ()]
+
+    def lock_timeout(self, timeout):
+        """
+        Generate query that sets the time DDL statements wait for locks.
+        :param timeout: the timeout in seconds
+        :return: generated query or None if timeout can't be set
+        """
+        if not self.SQL_LOCK_TIMEOUT:
+            return None
+        return self.SQL_LOCK_TIMEOUT % {'timeout': timeout}
+
+    def gather_statistics(self, table):
+        """
+        Refresh optimizer statistics of a table.
+        :param table: the table
+        """
+        self.database.run_query(self.SQL_GATHER_STATISTICS % {'table': table})
+
+    def invalid_objects(self):
+        """
+        Return invalid stored objects, with their dependencies on other
+        invalid objects.
+        :return: a dictionary of sets of (type, name) dependencies by (type,
+                 name) of invalid objects
+        """
+        if not self.SQL_INVALID_OBJECTS:
+            return {}
+        objects = {}
+        for line in self.run_catalog_query(self.SQL_INVALID_OBJECTS) or ():
+            dependencies = objects.setdefault((line['TYPE'], line['NAME']), set())
+            if line['REFERENCED_NAME'] not in (None, '', 'NULL'):
+                dependencies.add((line['REFERENCED_TYPE'], line['REFERENCED_NAME']))
+        return objects
+
+    @staticmethod
+    def compile_levels(objects):
+        """
+        Sort invalid objects in levels so that objects of a level only depend
+        on objects of previous levels and can be compiled in parallel. Objects
+        in dependency cycles are put in the last level.
+        :param objects: dependencies of invalid objects, as returned by
+               invalid_objects()
+        :return: the list of levels, as sorted lists of (type, name)
+        """
+        levels = []
+        remaining = dict((key, set(value) & set(objects)) for key, value in objects.items())
+        while remaining:
+            level = sorted(key for key, dependencies in remaining.items() if not dependencies)
+            if not level:
+                levels.append(sorted(remaining))
+                break
+            levels.append(level)
+            for key in level:
+                del remaining[key]
+            for dependencies in remaining.values():
+                dependencies.difference_update(level)
+        return levels
+
+    def compile_object(self, kind, name): # pylint: disable=W0613
+        """
+        Compile a stored object. Databases without query listing invalid
+        objects have no object to compile.
+        :param kind: the type of the object
+        :param name: the name of the object
+        """
+        pass
+
+    def compilation_errors(self):
+        """
+        Return compilation errors of stored objects.
+        :return: a list of dictionaries with TYPE, NAME, LINE, POSITION and
+                 TEXT of errors
+        """
+        return []
+
+    def load_query(self, path, table, columns, separator, newline, encoding): # pylint: disable=W0613
+        """
+        Generate query that loads a data file in a table.
+        :param path: the path of the data file
+        :param table: the table to load
+        :param columns: the list of columns of the data file
+        :param separator: the field separator
+        :param newline: the line terminator of the data file
+        :param encoding: the encoding of the data file
+        :return: generated query or None if data files are not loaded with
+                 a query
+        """
+        return None
+
+    def load_data(self, path, table, columns, separator, newline, encoding):
+        """
+        Load a data file in a table with the query of load_query().
+        :param path: the path of the data file, with a header line
+        :param table: the table to load
+        :param columns: the list of columns of the data file
+        :param separator: the field separator
+        :param newline: the line terminator of the data file
+        :param encoding: the encoding of the data file
+        """
+        query = self.load_query(path, table, columns, separator, newline, encoding)
+        if not query:
+            raise AppException("Loading data files is not available for this database")
+        self.database.run_query(query)
+
+    def online_ddl(self, code): # pylint: disable=W0613
+        """
+        Tell if a DDL statement can be run online with hints.
+        :param code: the code of the statement
+        :return: the table the statement works on or None
+        """
+        return None
+
+    def hint_ddl(self, code, parallel): # pylint: disable=W0613
+        """
+        Add hints to a DDL statement so that it runs online. Databases where
+        no statement runs online with hints return code unchanged.
+        :param code: the code of the statement
+        :param parallel: the parallel degree or None to run serially
+        :return: the code with hints
+        """
+        return code
+
+    def quote_identifier(self, name):
+        """
+        Quote an identifier in queries.
+        :param name: the identifier
+        :return: quoted identifier
+        """
+        return self.IDENTIFIER % name
+
+    def chunk_lower(self, column):
+        """
+        Generate condition on lower bound of current chunk.
+        :param column: the key column
+        :return: the condition
+        """
+        return self.SQL_CHUNK_LOWER % {'column': column}
+
+    def chunk_condition(self, first):
+        """
+        Generate condition selecting rows of current chunk, with a reference
+        to the key column as '%(column)s'.
+        :param first: tells if this is the first chunk (without lower bound)
+        :return: the condition
+        """
+        if first:
+            return self.SQL_CHUNK_UPPER
+        else:
+            return self.SQL_CHUNK_LOWER + ' AND ' + self.SQL_CHUNK_UPPER
+
+    def position_cast(self, table, key):
+        """
+        Return the expression that reads position in progress meta table in
+        the type of the key column, so that keys are not compared with
+        strings (that would compare big integers as floating point numbers).
+        :param table: the table
+        :param key: the key column
+        :return: the expression
+        """
+        if not self.SQL_COLUMN_TYPE:
+            return 'position'
+        result = self.database.run_query(self.SQL_COLUMN_TYPE % {'table': table, 'column': key}, cast=False)
+        kind = result[0]['TYPE'] if result else ''
+        for regexp, cast in self.POSITION_CASTS:
+            if re.match(regexp, kind, re.IGNORECASE):
+                return cast
+        return 'position'
+
+    def format_statement(self, statement, delimiter):
+        """
+        Format a statement with its terminator.
+        :param statement: the statement to format
+        :param delimiter: the current delimiter
+        :return: formatted statement and the new current delimiter
+        """
+        if statement.delimiter == '':
+            return statement.text, delimiter
+        elif statement.delimiter == '/':
+            return statement.text + '\n/', delimiter
+        else:
+            return self.terminate(statement.text, delimiter), delimiter
+
+    def terminate(self, text, delimiter):
+        """
+        Append a delimiter to the text of a statement, on its own line if the
+        statement ends with a line comment that would comment it out.
+        :param text: the text of the statement
+        :param delimiter: the delimiter
+        :return: the terminated statement
+        """
+        last = text[text.rfind('\n') + 1:]
+        if '--' in last or '#' in last:
+            source = text + delimiter
+            if delimiter != self.splitter.DELIMITER:
+                source = "DELIMITER %s\n%s" % (delimiter, source)
+            statements = self.splitter.split(source)
+            if not statements or statements[-1].delimiter != delimiter:
+                return text + '\n' + delimiter
+        return text + delimiter
+
+    def reset_delimiter(self, delimiter): # pylint: disable=W0613
+        """
+        Generate command that resets delimiter to default one.
+        :param delimiter: the current delimiter
+        :return: the command or None
+        """
+        return None
+
+
+class MysqlDatabaseAdapter(DatabaseAdapter):
+    """
+    Adapter for MySQL.
+    """
+
+    SPLITTER = MysqlSplitter
+    SQL_DROP_META = """
+    DROP TABLE IF EXISTS _progress;
+    DROP TABLE IF EXISTS _scripts;
+    DROP TABLE IF EXISTS _install;
+    """
+    SQL_CREATE_META = """
+    CREATE TABLE IF NOT EXISTS _install (
+      id integer NOT NULL AUTO_INCREMENT,
+      version varchar(20) NOT NULL,
       start_date datetime NOT NULL,
       end_date datetime,
       success tinyint NOT NULL,
@@ -768,9 +2397,50 @@ class MysqlDatabaseAdapter(DatabaseAdapter):
         FOREIGN KEY (install_id)
         REFERENCES _install(id)
     );
+    CREATE TABLE IF NOT EXISTS _progress (
+      id integer NOT NULL AUTO_INCREMENT,
+      filename varchar(255) NOT NULL,
+      statement integer NOT NULL,
+      step varchar(20) NOT NULL,
+      target varchar(255) NOT NULL,
+      position varchar(255),
+      rows_done bigint NOT NULL,
+      chunks integer NOT NULL,
+      chunk_time double NOT NULL,
+      max_chunk_time double NOT NULL,
+      status varchar(20) NOT NULL,
+      start_date datetime NOT NULL,
+      update_date datetime NOT NULL,
+      install_id integer NOT NULL,
+      PRIMARY KEY (id)
+    );
     """
+    SQL_ADD_COLUMN = """
+    SET @db_migration_sql = (SELECT IF(count(*) = 0,
+      'ALTER TABLE %(table)s ADD %(column)s %(definition)s', 'DO 0')
+      FROM information_schema.columns
+      WHERE table_schema = database() AND table_name = '%(table)s'
+        AND column_name = '%(column)s');
+    PREPARE db_migration_statement FROM @db_migration_sql;
+    EXECUTE db_migration_statement;
+    DEALLOCATE PREPARE db_migration_statement;
+    """
+    META_COLUMNS = (
+        ('_scripts', 'checksum', 'varchar(64)'),
+        ('_scripts', 'last_statement', 'integer'),
+        ('_scripts', 'throttled', 'double'),
+        ('_scripts', 'retries', 'integer'),
+        ('_scripts', 'retry_time', 'double'),
+        ('_scripts', 'statement_time', 'double'),
+        ('_scripts', 'lock_time', 'double'),
+        ('_scripts', 'rows_examined', 'bigint'),
+        ('_scripts', 'rows_affected', 'bigint'),
+        ('_scripts', 'tmp_tables', 'bigint'),
+        ('_scripts', 'tmp_disk_tables', 'bigint'),
+    )
     SQL_LIST_SCRIPTS = """
-    SELECT filename AS SCRIPT FROM _scripts WHERE success = 1"""
+    SELECT filename AS SCRIPT, checksum AS CHECKSUM FROM _scripts
+    WHERE success = 1 ORDER BY id"""
     SQL_INSTALL_BEGIN = """INSERT INTO _install
   (version, start_date, end_date, success)
 VALUES
@@ -779,8 +2449,8 @@ VALUES
   SET end_date = now(), success = %(success)s
   ORDER BY id DESC LIMIT 1;"""
     SQL_SCRIPT_BEGIN = """INSERT INTO _scripts
-  (filename, install_date, success, install_id, error_message)
-VALUES ('%(script)s', now(), 0, (SELECT max(id) FROM _install), NULL);"""
+  (filename, install_date, success, install_id, error_message, checksum)
+VALUES ('%(script)s', now(), 0, (SELECT max(id) FROM _install), NULL, %(checksum)s);"""
     SQL_SCRIPT_DONE = """UPDATE _scripts
   SET success = 1
   ORDER BY id DESC LIMIT 1;"""
@@ -791,19 +2461,220 @@ VALUES ('%(script)s', now(), 0, (SELECT max(id) FROM _install), NULL);"""
     SQL_LAST_ERROR = """SELECT filename AS SCRIPT FROM _scripts
     WHERE success = 0
     ORDER BY id DESC LIMIT 1;"""
+    SQL_SCRIPTS_PASSED = """INSERT INTO _scripts
+  (filename, install_date, success, install_id, error_message, checksum)
+VALUES
+%(values)s;"""
+    SQL_SCRIPTS_PASSED_VALUE = """  ('%(script)s', now(), %(success)s, (SELECT max(id) FROM _install), NULL, %(checksum)s)"""
+    SQL_SCRIPTS_PASSED_SEPARATOR = ',\n'
+    SQL_SCRIPT_MARKER = """SET @db_migration_script = '%(script)s';
+SELECT @db_migration_script AS db_migration_script;"""
+    REGEXP_SCRIPT_MARKER = r'^db_migration_script\n(.+)$'
+    SQL_SCRIPT_CHECKPOINT = """UPDATE _scripts SET last_statement = %(statement)s ORDER BY id DESC LIMIT 1"""
+    SQL_LAST_CHECKPOINT = """SELECT filename AS SCRIPT, last_statement AS STATEMENT, checksum AS CHECKSUM
+    FROM _scripts
+    WHERE success = 0 AND install_id = (SELECT max(id) FROM _install)
+      AND (SELECT success FROM _install ORDER BY id DESC LIMIT 1) = 0
+    ORDER BY id DESC LIMIT 1;"""
+    SQL_PROGRESS_FIND = """SELECT id AS ID, position AS POSITION, status AS STATUS FROM _progress
+    WHERE filename = '%(script)s' AND statement = %(statement)s AND status <> 'done'
+    ORDER BY id DESC LIMIT 1;"""
+    SQL_PROGRESS_BEGIN = """INSERT INTO _progress
+  (filename, statement, step, target, position, rows_done, chunks, chunk_time, max_chunk_time,
+   status, start_date, update_date, install_id)
+VALUES ('%(script)s', %(statement)s, '%(step)s', '%(target)s', NULL, 0, 0, 0, 0,
+   'running', now(), now(), (SELECT max(id) FROM _install));"""
+    SQL_PROGRESS_STATUS = """UPDATE _progress SET status = '%(status)s', update_date = now() WHERE id = %(id)s;"""
+    SQL_PRIMARY_KEY = """SELECT column_name AS NAME FROM information_schema.key_column_usage
+    WHERE table_schema = database() AND table_name = '%(table)s' AND constraint_name = 'PRIMARY'
+    ORDER BY ordinal_position;"""
+    SQL_CHUNK = """SET @db_migration_start = NOW(6);
+SELECT %(position)s INTO @db_migration_last FROM _progress WHERE id = %(id)s;
+SELECT MAX(%(key)s) INTO @db_migration_upper FROM
+  (SELECT %(key)s FROM %(table)s%(where)s ORDER BY %(key)s LIMIT %(size)s) AS chunk;
+%(statement)s;
+SET @db_migration_rows = ROW_COUNT();
+SET @db_migration_time = TIMESTAMPDIFF(MICROSECOND, @db_migration_start, NOW(6)) / 1000000;
+UPDATE _progress
+  SET position = @db_migration_upper, rows_done = rows_done + @db_migration_rows, chunks = chunks + 1,
+    chunk_time = chunk_time + @db_migration_time,
+    max_chunk_time = GREATEST(max_chunk_time, @db_migration_time), update_date = now()
+  WHERE id = %(id)s AND @db_migration_upper IS NOT NULL;
+COMMIT;
+SELECT position AS POSITION FROM _progress WHERE id = %(id)s;"""
+    SQL_CHUNK_LOWER = "%(column)s > @db_migration_last"
+    SQL_CHUNK_UPPER = "%(column)s <= @db_migration_upper"
+    SQL_COLUMN_TYPE = """SELECT column_type AS TYPE FROM information_schema.columns
+    WHERE table_schema = database() AND table_name = '%(table)s' AND column_name = '%(column)s';"""
+    POSITION_CASTS = (
+        (r'(?:tiny|small|medium|big)?int\b.*\bunsigned\b', 'CAST(position AS UNSIGNED)'),
+        (r'(?:tiny|small|medium|big)?int\b', 'CAST(position AS SIGNED)'),
+        (r'(?:decimal|numeric)\b', 'CAST(position AS DECIMAL(65,30))'),
+    )
+    IDENTIFIER = '`%s`'
+    DDL_ANALYZER = MysqlDdlAnalyzer
+    SQL_TABLE_SIZES = """SELECT table_name AS NAME, data_length + index_length AS SIZE, table_rows AS ROWS
+    FROM information_schema.tables WHERE table_schema = database();"""
+    SQL_SCHEMA_TABLE_SIZES = """SELECT CONCAT(table_schema, '.', table_name) AS NAME,
+    data_length + index_length AS SIZE, table_rows AS ROWS
+    FROM information_schema.tables WHERE LOWER(table_schema) IN (%(schemas)s);"""
+    SQL_GATHER_STATISTICS = "ANALYZE TABLE `%(table)s`;"
+    SQL_BLOCKING_SESSIONS = """SELECT DISTINCT t.PROCESSLIST_ID AS ID, t.PROCESSLIST_USER AS USER, m.OBJECT_NAME AS NAME,
+    COALESCE(TIMESTAMPDIFF(SECOND, x.trx_started, NOW()), t.PROCESSLIST_TIME) AS AGE
+  FROM performance_schema.metadata_locks m
+  JOIN performance_schema.threads t ON t.THREAD_ID = m.OWNER_THREAD_ID
+  LEFT JOIN information_schema.innodb_trx x ON x.trx_mysql_thread_id = t.PROCESSLIST_ID
+  WHERE m.OBJECT_TYPE = 'TABLE' AND m.OBJECT_SCHEMA = database() AND LOWER(m.OBJECT_NAME) IN (%(tables)s)
+    AND t.PROCESSLIST_ID <> CONNECTION_ID()
+    AND COALESCE(TIMESTAMPDIFF(SECOND, x.trx_started, NOW()), t.PROCESSLIST_TIME) >= %(age)s;"""
+    SQL_LOCK_TIMEOUT = "SET SESSION lock_wait_timeout = %(timeout)s, innodb_lock_wait_timeout = %(timeout)s;"
+    SQL_LOAD_DATA = """LOAD DATA LOCAL INFILE '%(path)s' INTO TABLE `%(table)s`%(charset)s
+  FIELDS TERMINATED BY '%(separator)s' OPTIONALLY ENCLOSED BY '"'
+  LINES TERMINATED BY '%(newline)s' IGNORE 1 LINES
+  (%(columns)s);"""
+    SQL_REPLICA_LAG = "SHOW SLAVE STATUS;"
+    REPLICA_LAG_COLUMNS = ('LAG', 'Seconds_Behind_Master', 'Seconds_Behind_Source')
+    SQL_SCRIPT_THROTTLED = """UPDATE _scripts SET throttled = %(throttled)s
+  WHERE filename = '%(script)s' AND install_id = (SELECT max(id) FROM _install);"""
+    SQL_SCRIPT_RETRIED = """UPDATE _scripts SET retries = %(retries)s, retry_time = %(retry_time)s
+  WHERE filename = '%(script)s' AND install_id = (SELECT max(id) FROM _install);"""
+    COST_COLUMNS = ('STATEMENT_TIME', 'LOCK_TIME', 'ROWS_EXAMINED', 'ROWS_AFFECTED', 'TMP_TABLES', 'TMP_DISK_TABLES')
+    SQL_SCRIPT_COST_BEGIN = """SELECT SUM(SUM_TIMER_WAIT), SUM(SUM_LOCK_TIME), SUM(SUM_ROWS_EXAMINED), SUM(SUM_ROWS_AFFECTED),
+    SUM(SUM_CREATED_TMP_TABLES), SUM(SUM_CREATED_TMP_DISK_TABLES)
+  INTO @db_migration_statement_time, @db_migration_lock_time, @db_migration_rows_examined,
+    @db_migration_rows_affected, @db_migration_tmp_tables, @db_migration_tmp_disk_tables
+  FROM performance_schema.events_statements_summary_by_thread_by_event_name
+  WHERE THREAD_ID = (SELECT THREAD_ID FROM performance_schema.threads WHERE PROCESSLIST_ID = CONNECTION_ID());"""
+    SQL_SCRIPT_COST = """UPDATE _scripts s, (SELECT SUM(SUM_TIMER_WAIT) AS statement_time, SUM(SUM_LOCK_TIME) AS lock_time,
+    SUM(SUM_ROWS_EXAMINED) AS rows_examined, SUM(SUM_ROWS_AFFECTED) AS rows_affected,
+    SUM(SUM_CREATED_TMP_TABLES) AS tmp_tables, SUM(SUM_CREATED_TMP_DISK_TABLES) AS tmp_disk_tables
+  FROM performance_schema.events_statements_summary_by_thread_by_event_name
+  WHERE THREAD_ID = (SELECT THREAD_ID FROM performance_schema.threads WHERE PROCESSLIST_ID = CONNECTION_ID())) c
+  SET s.statement_time = (c.statement_time - @db_migration_statement_time) / 1000000000000,
+    s.lock_time = (c.lock_time - @db_migration_lock_time) / 1000000000000,
+    s.rows_examined = c.rows_examined - @db_migration_rows_examined,
+    s.rows_affected = c.rows_affected - @db_migration_rows_affected,
+    s.tmp_tables = c.tmp_tables - @db_migration_tmp_tables,
+    s.tmp_disk_tables = c.tmp_disk_tables - @db_migration_tmp_disk_tables
+  WHERE s.filename = '%(script)s' AND s.install_id = (SELECT max(id) FROM _install);"""
+    SQL_SCRIPTS_COST = """SELECT s.filename AS SCRIPT, i.version AS VERSION, s.statement_time AS STATEMENT_TIME,
+    s.lock_time AS LOCK_TIME, s.rows_examined AS ROWS_EXAMINED, s.rows_affected AS ROWS_AFFECTED,
+    s.tmp_tables AS TMP_TABLES, s.tmp_disk_tables AS TMP_DISK_TABLES
+  FROM _scripts s JOIN _install i ON i.id = s.install_id
+  WHERE s.statement_time IS NOT NULL
+  ORDER BY s.statement_time DESC LIMIT %(limit)s;"""
+    STEPS = {
+        OnlineSchemaChange.NAME: OnlineSchemaChange,
+        BatchStatement.NAME: BatchStatement,
+    }
 
     def script_header(self, db_config):
         return "USE `%(database)s`;" % db_config
 
+    def load_query(self, path, table, columns, separator, newline, encoding):
+        """
+        Generate query that loads a data file in a table.
+        :param path: the path of the data file
+        :param table: the table to load
+        :param columns: the list of columns of the data file
+        :param separator: the field separator
+        :param newline: the line terminator of the data file
+        :param encoding: the encoding of the data file
+        :return: generated query
+        """
+        parameters = {
+            'path': path.replace('\\', '\\\\').replace("'", "\\'"),
+            'table': table,
+            'charset': ' CHARACTER SET %s' % encoding if encoding else '',
+            'separator': '\\t' if separator == '\t' else separator,
+            'newline': newline.replace('\r', '\\r').replace('\n', '\\n'),
+            'columns': ', '.join([self.quote_identifier(column) for column in columns]),
+        }
+        return self.SQL_LOAD_DATA % parameters
+
+    def profile_setup(self, profile):
+        """
+        Generate query that saves current values of session variables of a
+        profile in user variables and sets them.
+        :param profile: the session variables as a dictionary
+        :return: generated query
+        """
+        names = sorted(profile)
+        saves = ', '.join(['@db_migration_%s = @@session.%s' % (name, name) for name in names])
+        values = ', '.join(['%s = %s' % (name, self.format_value(profile[name])) for name in names])
+        return "SET %s;\nSET SESSION %s;" % (saves, values)
+
+    def profile_restore(self, profile):
+        """
+        Generate query that restores values of session variables of a profile
+        saved in user variables.
+        :param profile: the session variables as a dictionary
+        :return: generated query
+        """
+        return "SET SESSION %s;" % ', '.join(['%s = @db_migration_%s' % (name, name) for name in sorted(profile)])
+
+    @staticmethod
+    def format_value(value):
+        """
+        Format the value of a session variable.
+        :param value: the value
+        :return: the value in SQL syntax
+        """
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if isinstance(value, (int, long, float)):
+            return str(value)
+        return "'%s'" % str(value).replace('\\', '\\\\').replace("'", "\\'")
+
+    def load_data(self, path, table, columns, separator, newline, encoding):
+        """
+        Load a data file in a table with LOAD DATA LOCAL INFILE, in a single
+        transaction.
+        :param path: the path of the data file, with a header line
+        :param table: the table to load
+        :param columns: the list of columns of the data file
+        :param separator: the field separator
+        :param newline: the line terminator of the data file
+        :param encoding: the encoding of the data file
+        """
+        self.database.run_query(self.load_query(path, table, columns, separator, newline, encoding),
+                                local_infile=True)
+
+    def format_statement(self, statement, delimiter):
+        """
+        Format a statement with its terminator, changing delimiter if needed.
+        :param statement: the statement to format
+        :param delimiter: the current delimiter
+        :return: formatted statement and the new current delimiter
+        """
+        if statement.delimiter == '':
+            return statement.text, delimiter
+        ending = statement.delimiter or delimiter
+        text = self.terminate(statement.text, ending)
+        if ending != delimiter:
+            text = "DELIMITER %s\n%s" % (ending, text)
+        return text, ending
+
+    def reset_delimiter(self, delimiter):
+        """
+        Generate command that resets delimiter to default one.
+        :param delimiter: the current delimiter
+        :return: the command or None
+        """
+        if delimiter != self.splitter.DELIMITER:
+            return "DELIMITER %s" % self.splitter.DELIMITER
+        return None
+
     def script_footer(self, db_config): # pylint: disable=W0613
         return "COMMIT;"
 
 
 class SqlplusDatabaseAdapter(DatabaseAdapter):
     """
-    Adapter for MySQL.
+    Adapter for Oracle.
     """
 
+    SPLITTER = SqlplusSplitter
     SQL_DROP_META = """
     DECLARE nb NUMBER(10);
     BEGIN
@@ -814,6 +2685,14 @@ class SqlplusDatabaseAdapter(DatabaseAdapter):
     END;
     /
     DECLARE nb NUMBER(10);
+    BEGIN
+      SELECT count(*) INTO nb FROM user_tables WHERE table_name = 'PROGRESS_';
+      IF (nb > 0) THEN
+        EXECUTE IMMEDIATE 'DROP TABLE PROGRESS_';
+      END IF;
+    END;
+    /
+    DECLARE nb NUMBER(10);
     BEGIN
       SELECT count(*) INTO nb FROM user_tables WHERE table_name = 'INSTALL_';
       IF (nb > 0) THEN
@@ -861,9 +2740,61 @@ class SqlplusDatabaseAdapter(DatabaseAdapter):
       END IF;
     END;
     /
+    DECLARE nb NUMBER(10);
+    BEGIN
+      nb := 0;
+      SELECT count(*) INTO nb FROM user_tables WHERE table_name = 'PROGRESS_';
+      IF (nb = 0) THEN
+        EXECUTE IMMEDIATE '
+        CREATE TABLE PROGRESS_ (
+          ID NUMBER(10) NOT NULL,
+          FILENAME VARCHAR(255) NOT NULL,
+          STATEMENT NUMBER(10) NOT NULL,
+          STEP VARCHAR(20) NOT NULL,
+          TARGET VARCHAR(255) NOT NULL,
+          POSITION VARCHAR(255),
+          ROWS_DONE NUMBER(19) NOT NULL,
+          CHUNKS NUMBER(10) NOT NULL,
+          CHUNK_TIME NUMBER NOT NULL,
+          MAX_CHUNK_TIME NUMBER NOT NULL,
+          STATUS VARCHAR(20) NOT NULL,
+          START_DATE TIMESTAMP NOT NULL,
+          UPDATE_DATE TIMESTAMP NOT NULL,
+          INSTALL_ID NUMBER(10) NOT NULL,
+          PRIMARY KEY (ID)
+        )';
+      END IF;
+    END;
+    /
+    """
+    SQL_ADD_COLUMN = """
+    DECLARE nb NUMBER(10);
+    BEGIN
+      nb := 0;
+      SELECT count(*) INTO nb FROM user_tab_columns
+      WHERE table_name = '%(table)s' AND column_name = '%(column)s';
+      IF (nb = 0) THEN
+        EXECUTE IMMEDIATE 'ALTER TABLE %(table)s ADD %(column)s %(definition)s';
+      END IF;
+    END;
+    /
     """
+    META_COLUMNS = (
+        ('SCRIPTS_', 'CHECKSUM', 'VARCHAR(64)'),
+        ('SCRIPTS_', 'LAST_STATEMENT', 'NUMBER(10)'),
+        ('SCRIPTS_', 'THROTTLED', 'NUMBER'),
+        ('SCRIPTS_', 'RETRIES', 'NUMBER(10)'),
+        ('SCRIPTS_', 'RETRY_TIME', 'NUMBER'),
+        ('SCRIPTS_', 'DB_TIME', 'NUMBER'),
+        ('SCRIPTS_', 'CPU_TIME', 'NUMBER'),
+        ('SCRIPTS_', 'LOGICAL_READS', 'NUMBER(19)'),
+        ('SCRIPTS_', 'PHYSICAL_READS', 'NUMBER(19)'),
+        ('SCRIPTS_', 'BLOCK_CHANGES', 'NUMBER(19)'),
+        ('SCRIPTS_', 'REDO_SIZE', 'NUMBER(19)'),
+    )
     SQL_LIST_SCRIPTS = """
-    SELECT filename AS SCRIPT FROM SCRIPTS_ WHERE success = 1;"""
+    SELECT FILENAME AS SCRIPT, CHECKSUM FROM SCRIPTS_
+    WHERE SUCCESS = 1 ORDER BY ID;"""
     SQL_INSTALL_BEGIN = """INSERT INTO INSTALL_
   (ID, VERSION, START_DATE, END_DATE, SUCCESS)
 VALUES
@@ -872,9 +2803,9 @@ VALUES
   SET END_DATE = CURRENT_TIMESTAMP, SUCCESS = %(success)s
   WHERE ID = (SELECT MAX(ID) FROM INSTALL_);"""
     SQL_SCRIPT_BEGIN = """INSERT INTO SCRIPTS_
-  (ID, FILENAME, INSTALL_DATE, SUCCESS, INSTALL_ID, ERROR_MESSAGE)
+  (ID, FILENAME, INSTALL_DATE, SUCCESS, INSTALL_ID, ERROR_MESSAGE, CHECKSUM)
 VALUES
-  ((SELECT NVL(MAX(ID), 1) FROM SCRIPTS_)+1, '%(script)s', CURRENT_TIMESTAMP, 0, (SELECT MAX(ID) FROM INSTALL_), NULL);"""
+  ((SELECT NVL(MAX(ID), 1) FROM SCRIPTS_)+1, '%(script)s', CURRENT_TIMESTAMP, 0, (SELECT MAX(ID) FROM INSTALL_), NULL, %(checksum)s);"""
     SQL_SCRIPT_DONE = """UPDATE SCRIPTS_
   SET SUCCESS = 1
   WHERE ID = (SELECT MAX(ID) FROM SCRIPTS_);"""
@@ -886,6 +2817,397 @@ VALUES
       SELECT FILENAME FROM SCRIPTS_
       WHERE SUCCESS = 0 ORDER BY ID DESC
     ) WHERE ROWNUM = 1;"""
+    SQL_SCRIPTS_PASSED = """INSERT INTO SCRIPTS_
+  (ID, FILENAME, INSTALL_DATE, SUCCESS, INSTALL_ID, ERROR_MESSAGE, CHECKSUM)
+SELECT (SELECT NVL(MAX(ID), 1) FROM SCRIPTS_)+ROWNUM, FILENAME, CURRENT_TIMESTAMP, SUCCESS, (SELECT MAX(ID) FROM INSTALL_), NULL, CHECKSUM
+FROM (
+%(values)s
+);"""
+    SQL_SCRIPTS_PASSED_VALUE = """  SELECT '%(script)s' AS FILENAME, %(success)s AS SUCCESS, %(checksum)s AS CHECKSUM FROM DUAL"""
+    SQL_SCRIPTS_PASSED_SEPARATOR = '\n  UNION ALL\n'
+    SQL_SCRIPT_MARKER = """EXEC DBMS_APPLICATION_INFO.SET_ACTION('%(script)s');
+PROMPT db_migration_script %(script)s"""
+    REGEXP_SCRIPT_MARKER = r'db_migration_script ([^<\s]+)'
+    SQL_SCRIPT_CHECKPOINT = """UPDATE SCRIPTS_ SET LAST_STATEMENT = %(statement)s
+  WHERE ID = (SELECT MAX(ID) FROM SCRIPTS_)"""
+    SQL_LAST_CHECKPOINT = """SELECT SCRIPT, STATEMENT, CHECKSUM FROM (
+      SELECT FILENAME AS SCRIPT, LAST_STATEMENT AS STATEMENT, CHECKSUM FROM SCRIPTS_
+      WHERE SUCCESS = 0 AND INSTALL_ID = (SELECT MAX(ID) FROM INSTALL_)
+        AND (SELECT SUCCESS FROM INSTALL_ WHERE ID = (SELECT MAX(ID) FROM INSTALL_)) = 0
+      ORDER BY ID DESC
+    ) WHERE ROWNUM = 1;"""
+    SQL_PROGRESS_FIND = """SELECT ID, POSITION, STATUS FROM (
+      SELECT ID, POSITION, STATUS FROM PROGRESS_
+      WHERE FILENAME = '%(script)s' AND STATEMENT = %(statement)s AND STATUS <> 'done'
+      ORDER BY ID DESC
+    ) WHERE ROWNUM = 1;"""
+    SQL_PROGRESS_BEGIN = """INSERT INTO PROGRESS_
+  (ID, FILENAME, STATEMENT, STEP, TARGET, POSITION, ROWS_DONE, CHUNKS, CHUNK_TIME, MAX_CHUNK_TIME,
+   STATUS, START_DATE, UPDATE_DATE, INSTALL_ID)
+VALUES ((SELECT NVL(MAX(ID), 1) FROM PROGRESS_)+1, '%(script)s', %(statement)s, '%(step)s', '%(target)s', NULL, 0, 0, 0, 0,
+   'running', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, (SELECT MAX(ID) FROM INSTALL_));"""
+    SQL_PROGRESS_STATUS = """UPDATE PROGRESS_ SET STATUS = '%(status)s', UPDATE_DATE = CURRENT_TIMESTAMP WHERE ID = %(id)s;"""
+    SQL_PRIMARY_KEY = """SELECT c.COLUMN_NAME AS NAME FROM USER_CONSTRAINTS k
+    JOIN USER_CONS_COLUMNS c ON c.CONSTRAINT_NAME = k.CONSTRAINT_NAME
+    WHERE k.TABLE_NAME = UPPER('%(table)s') AND k.CONSTRAINT_TYPE = 'P'
+    ORDER BY c.POSITION;"""
+    SQL_CHUNK = """DECLARE
+  db_migration_last %(table)s.%(key)s%%TYPE;
+  db_migration_upper %(table)s.%(key)s%%TYPE;
+  db_migration_start NUMBER := DBMS_UTILITY.GET_TIME;
+  db_migration_rows NUMBER;
+  db_migration_time NUMBER;
+BEGIN
+  SELECT POSITION INTO db_migration_last FROM PROGRESS_ WHERE ID = %(id)s;
+  SELECT MAX(%(key)s) INTO db_migration_upper FROM (
+    SELECT %(key)s FROM %(table)s%(where)s ORDER BY %(key)s
+  ) WHERE ROWNUM <= %(size)s;
+  IF db_migration_upper IS NOT NULL THEN
+    %(statement)s;
+    db_migration_rows := SQL%%ROWCOUNT;
+    db_migration_time := (DBMS_UTILITY.GET_TIME - db_migration_start) / 100;
+    UPDATE PROGRESS_
+      SET POSITION = db_migration_upper, ROWS_DONE = ROWS_DONE + db_migration_rows, CHUNKS = CHUNKS + 1,
+        CHUNK_TIME = CHUNK_TIME + db_migration_time,
+        MAX_CHUNK_TIME = GREATEST(MAX_CHUNK_TIME, db_migration_time), UPDATE_DATE = CURRENT_TIMESTAMP
+      WHERE ID = %(id)s;
+    COMMIT;
+  END IF;
+END;
+/
+SELECT POSITION FROM PROGRESS_ WHERE ID = %(id)s;"""
+    SQL_CHUNK_LOWER = "%(column)s > db_migration_last"
+    SQL_CHUNK_UPPER = "%(column)s <= db_migration_upper"
+    SQL_SCRIPT_THROTTLED = """UPDATE SCRIPTS_ SET THROTTLED = %(throttled)s
+  WHERE FILENAME = '%(script)s' AND INSTALL_ID = (SELECT MAX(ID) FROM INSTALL_);"""
+    SQL_SCRIPT_RETRIED = """UPDATE SCRIPTS_ SET RETRIES = %(retries)s, RETRY_TIME = %(retry_time)s
+  WHERE FILENAME = '%(script)s' AND INSTALL_ID = (SELECT MAX(ID) FROM INSTALL_);"""
+    COST_COLUMNS = ('DB_TIME', 'CPU_TIME', 'LOGICAL_READS', 'PHYSICAL_READS', 'BLOCK_CHANGES', 'REDO_SIZE')
+    SQL_SCRIPT_COST_BEGIN = """VARIABLE db_migration_db_time NUMBER
+VARIABLE db_migration_cpu_time NUMBER
+VARIABLE db_migration_logical_reads NUMBER
+VARIABLE db_migration_physical_reads NUMBER
+VARIABLE db_migration_block_changes NUMBER
+VARIABLE db_migration_redo_size NUMBER
+BEGIN
+  SELECT SUM(DECODE(STAT_NAME, 'DB time', VALUE)), SUM(DECODE(STAT_NAME, 'DB CPU', VALUE))
+    INTO :db_migration_db_time, :db_migration_cpu_time
+    FROM V$SESS_TIME_MODEL WHERE SID = SYS_CONTEXT('USERENV', 'SID');
+  SELECT SUM(DECODE(n.NAME, 'session logical reads', s.VALUE)), SUM(DECODE(n.NAME, 'physical reads', s.VALUE)),
+      SUM(DECODE(n.NAME, 'db block changes', s.VALUE)), SUM(DECODE(n.NAME, 'redo size', s.VALUE))
+    INTO :db_migration_logical_reads, :db_migration_physical_reads, :db_migration_block_changes,
+      :db_migration_redo_size
+    FROM V$MYSTAT s JOIN V$STATNAME n ON n.STATISTIC# = s.STATISTIC#;
+END;
+/"""
+    SQL_SCRIPT_COST = """DECLARE
+  db_time NUMBER;
+  cpu_time NUMBER;
+  logical_reads NUMBER;
+  physical_reads NUMBER;
+  block_changes NUMBER;
+  redo_size NUMBER;
+BEGIN
+  SELECT SUM(DECODE(STAT_NAME, 'DB time', VALUE)), SUM(DECODE(STAT_NAME, 'DB CPU', VALUE))
+    INTO db_time, cpu_time
+    FROM V$SESS_TIME_MODEL WHERE SID = SYS_CONTEXT('USERENV', 'SID');
+  SELECT SUM(DECODE(n.NAME, 'session logical reads', s.VALUE)), SUM(DECODE(n.NAME, 'physical reads', s.VALUE)),
+      SUM(DECODE(n.NAME, 'db block changes', s.VALUE)), SUM(DECODE(n.NAME, 'redo size', s.VALUE))
+    INTO logical_reads, physical_reads, block_changes, redo_size
+    FROM V$MYSTAT s JOIN V$STATNAME n ON n.STATISTIC# = s.STATISTIC#;
+  UPDATE SCRIPTS_ SET DB_TIME = (db_time - :db_migration_db_time) / 1000000,
+      CPU_TIME = (cpu_time - :db_migration_cpu_time) / 1000000,
+      LOGICAL_READS = logical_reads - :db_migration_logical_reads,
+      PHYSICAL_READS = physical_reads - :db_migration_physical_reads,
+      BLOCK_CHANGES = block_changes - :db_migration_block_changes,
+      REDO_SIZE = redo_size - :db_migration_redo_size
+    WHERE FILENAME = '%(script)s' AND INSTALL_ID = (SELECT MAX(ID) FROM INSTALL_);
+END;
+/"""
+    SQL_SCRIPTS_COST = """SELECT * FROM (
+      SELECT s.FILENAME AS SCRIPT, i.VERSION, s.DB_TIME, s.CPU_TIME, s.LOGICAL_READS, s.PHYSICAL_READS,
+        s.BLOCK_CHANGES, s.REDO_SIZE
+      FROM SCRIPTS_ s JOIN INSTALL_ i ON i.ID = s.INSTALL_ID
+      WHERE s.DB_TIME IS NOT NULL
+      ORDER BY s.DB_TIME DESC
+    ) WHERE ROWNUM <= %(limit)s;"""
+    SQL_TABLE_SIZES = """SELECT t.TABLE_NAME AS NAME, s.BYTES AS "SIZE", t.NUM_ROWS AS "ROWS" FROM USER_TABLES t
+    LEFT JOIN (SELECT SEGMENT_NAME, SUM(BYTES) AS BYTES FROM USER_SEGMENTS GROUP BY SEGMENT_NAME) s
+      ON s.SEGMENT_NAME = t.TABLE_NAME;"""
+    SQL_GATHER_STATISTICS = """BEGIN
+  DBMS_STATS.GATHER_TABLE_STATS(ownname => USER, tabname => UPPER('%(table)s'));
+END;
+/"""
+    SQL_BLOCKING_SESSIONS = """SELECT DISTINCT s.SID AS ID, s.USERNAME AS "USER", o.OBJECT_NAME AS NAME,
+    ROUND((SYSDATE - t.START_DATE) * 86400) AS AGE
+  FROM V$LOCKED_OBJECT l
+  JOIN USER_OBJECTS o ON o.OBJECT_ID = l.OBJECT_ID
+  JOIN V$SESSION s ON s.SID = l.SESSION_ID
+  JOIN V$TRANSACTION t ON t.ADDR = s.TADDR
+  WHERE LOWER(o.OBJECT_NAME) IN (%(tables)s) AND s.SID <> SYS_CONTEXT('USERENV', 'SID')
+    AND (SYSDATE - t.START_DATE) * 86400 >= %(age)s;"""
+    SQL_LOCK_TIMEOUT = "ALTER SESSION SET DDL_LOCK_TIMEOUT = %(timeout)s;"
+    STEPS = {
+        BatchStatement.NAME: BatchStatement,
+    }
+    REGEXP_CREATE_INDEX = re.compile(r'^CREATE\s+(?:UNIQUE\s+)?INDEX\s+([\w$#."]+)\s+ON\s+'
+                                     r'(?:[\w$#"]+\.)?"?([\w$#]+)"?\s*\(.*$', re.IGNORECASE | re.DOTALL)
+    REGEXP_MOVE = re.compile(r'^(ALTER\s+TABLE\s+((?:[\w$#"]+\.)?"?([\w$#]+)"?)\s+MOVE'
+                             r'(?:\s+(?:SUB)?PARTITION\s+[\w$#"]+)?)(.*?)(\s+UPDATE\s+(?:GLOBAL\s+)?INDEXES)?$',
+                             re.IGNORECASE | re.DOTALL)
+    REGEXP_HINTED = re.compile(r'\b(?:ONLINE|PARALLEL|NOPARALLEL)\b', re.IGNORECASE)
+    # lexemes of a statement, with comments and whitespaces in blank group
+    REGEXP_LEXEME = re.compile(r"(?P<blank>\s+|--[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)|"
+                               r"[qQ]'(?:\[.*?\]|\{.*?\}|\(.*?\)|<.*?>|(?P<quote>\S).*?(?P=quote))'|"
+                               r"'[^']*'|\"[^\"]*\"|[^\s'\"/-]+|.", re.DOTALL)
+    SQL_INVALID_OBJECTS = """SELECT o.OBJECT_TYPE AS TYPE, o.OBJECT_NAME AS NAME,
+    r.OBJECT_TYPE AS REFERENCED_TYPE, r.OBJECT_NAME AS REFERENCED_NAME
+  FROM USER_OBJECTS o
+  LEFT JOIN USER_DEPENDENCIES d ON d.NAME = o.OBJECT_NAME AND d.TYPE = o.OBJECT_TYPE
+    AND d.REFERENCED_OWNER = USER
+  LEFT JOIN USER_OBJECTS r ON r.OBJECT_NAME = d.REFERENCED_NAME AND r.OBJECT_TYPE = d.REFERENCED_TYPE
+    AND r.STATUS = 'INVALID'
+  WHERE o.STATUS = 'INVALID'
+    AND o.OBJECT_TYPE IN ('VIEW', 'PROCEDURE', 'FUNCTION', 'PACKAGE', 'PACKAGE BODY', 'TRIGGER', 'TYPE', 'TYPE BODY',
+                          'MATERIALIZED VIEW', 'SYNONYM');"""
+    SQL_COMPILE_OBJECT = 'ALTER %(type)s "%(name)s" COMPILE%(body)s;'
+    # Oracle character sets of Python encodings, for SQL*Loader
+    LOADER_CHARSETS = {'utf-8': 'AL32UTF8', 'iso8859-1': 'WE8ISO8859P1', 'iso8859-15': 'WE8ISO8859P15',
+                       'cp1252': 'WE8MSWIN1252', 'ascii': 'US7ASCII'}
+    # session parallel features with their default status
+    PARALLEL_DEFAULTS = {'PARALLEL DML': 'DISABLE', 'PARALLEL DDL': 'ENABLE', 'PARALLEL QUERY': 'ENABLE'}
+    LOADER_CONTROL = """OPTIONS (DIRECT=TRUE, SKIP=1, ERRORS=0)
+LOAD DATA%(charset)s
+INFILE '%(path)s'%(terminator)s
+APPEND
+INTO TABLE %(table)s
+FIELDS TERMINATED BY %(separator)s OPTIONALLY ENCLOSED BY '"'
+TRAILING NULLCOLS
+(%(columns)s)
+"""
+    SQL_SCRIPT_CHECK_BEGIN = """VARIABLE db_migration_start VARCHAR2(19)
+EXEC :db_migration_start := TO_CHAR(SYSDATE, 'YYYY-MM-DD HH24:MI:SS');"""
+    SQL_SCRIPT_CHECK_SINCE = """VARIABLE db_migration_start VARCHAR2(19)
+EXEC :db_migration_start := '%(start)s';"""
+    SQL_SCRIPT_CHECK_START = """SELECT TO_CHAR(SYSDATE, 'YYYY-MM-DD HH24:MI:SS') AS START_DATE FROM DUAL;"""
+    SQL_SCRIPT_CHECK = """DECLARE
+  db_migration_errors VARCHAR2(4000);
+BEGIN
+  FOR e IN (SELECT e.TYPE, e.NAME, e.LINE, e.POSITION, e.TEXT FROM USER_ERRORS e
+            JOIN USER_OBJECTS o ON o.OBJECT_NAME = e.NAME AND o.OBJECT_TYPE = e.TYPE
+            WHERE e.ATTRIBUTE = 'ERROR'
+              AND o.LAST_DDL_TIME >= TO_DATE(:db_migration_start, 'YYYY-MM-DD HH24:MI:SS')
+            ORDER BY e.NAME, e.TYPE, e.SEQUENCE) LOOP
+    db_migration_errors := SUBSTR(db_migration_errors || CHR(10) || e.TYPE || ' ' || e.NAME ||
+      ' line ' || e.LINE || ', position ' || e.POSITION || ': ' || e.TEXT, 1, 1800);
+  END LOOP;
+  IF db_migration_errors IS NOT NULL THEN
+    RAISE_APPLICATION_ERROR(-20000, 'Compilation errors in script %(script)s:' || db_migration_errors);
+  END IF;
+END;
+/"""
+    SQL_COMPILATION_ERRORS = """SELECT TYPE, NAME, LINE, POSITION, TEXT FROM USER_ERRORS
+  WHERE ATTRIBUTE = 'ERROR' ORDER BY NAME, TYPE, SEQUENCE;"""
+
+    def online_ddl(self, code):
+        """
+        Tell if a DDL statement can be run online with hints: CREATE INDEX and
+        ALTER TABLE MOVE statements without ONLINE or PARALLEL clause.
+        :param code: the code of the statement
+        :return: the table the statement works on or None
+        """
+        if self.REGEXP_HINTED.search(code):
+            return None
+        match = self.REGEXP_CREATE_INDEX.match(code)
+        if match:
+            return match.group(2)
+        match = self.REGEXP_MOVE.match(code)
+        if match:
+            return match.group(3)
+        return None
+
+    def run_script(self, script, cast=None):
+        """
+        Run a given script. Errors of SQL statements interrupt the script and
+        compilation errors are checked in USER_ERRORS after each script, thus
+        output is only scanned for errors of sqlplus client.
+        :param script: the path of the script to run
+        :param cast: tells if we should cast result
+        :return: the result of the script
+        """
+        return self.database.run_script(script=script, cast=cast,
+                                        check_errors=SqlplusResultParser.REGEXP_CLIENT_ERRORS)
+
+    def run_statements(self, query):
+        """
+        Run statements of a script run by migration program. As for scripts,
+        output is only scanned for errors of sqlplus client, compilation
+        errors being checked in USER_ERRORS after the script.
+        :param query: the statements to run
+        :return: the result of the statements
+        """
+        return self.database.run_query(query, check_errors=SqlplusResultParser.REGEXP_CLIENT_ERRORS)
+
+    def run_catalog_query(self, query):
+        """
+        Run a query on dictionary of the database, which result is not cast.
+        Output is not scanned for errors because names of tables (such as
+        ERROR_LOG) or error messages would be taken for errors.
+        :param query: the query to run
+        :return: the result of the query
+        """
+        return self.database.run_query(query, cast=False, check_errors=False)
+
+    def load_data(self, path, table, columns, separator, newline, encoding):
+        """
+        Load a data file in a table with SQL*Loader direct path, that fails on
+        the first rejected row.
+        :param path: the path of the data file, with a header line
+        :param table: the table to load
+        :param columns: the list of columns of the data file
+        :param separator: the field separator
+        :param newline: the line terminator of the data file
+        :param encoding: the encoding of the data file
+        """
+        charset = None
+        if encoding:
+            try:
+                charset = self.LOADER_CHARSETS.get(codecs.lookup(encoding).name)
+            except LookupError:
+                pass
+            if not charset:
+                raise AppException("No SQL*Loader character set for encoding '%s'" % encoding)
+        parameters = {
+            'path': path.replace("'", "''"),
+            'charset': ' CHARACTERSET %s' % charset if charset else '',
+            'terminator': ' "STR X\'%s\'"' % newline.encode('hex').upper() if newline != '\n' else '',
+            'table': table,
+            'separator': "X'09'" if separator == '\t' else "'%s'" % separator,
+            'columns': ', '.join(columns),
+        }
+        _, control = tempfile.mkstemp(suffix='.ctl', prefix='db_migration_')
+        try:
+            with open(control, 'w') as handle:
+                handle.write(self.LOADER_CONTROL % parameters)
+            self.database.run_loader(control)
+        finally:
+            os.remove(control)
+
+    def profile_setup(self, profile):
+        """
+        Generate query that sets parallel features of the session, such as
+        {'PARALLEL DML': 'ENABLE'} or {'PARALLEL QUERY': 'FORCE PARALLEL 4'}.
+        :param profile: the status of parallel features as a dictionary
+        :return: generated query
+        """
+        result = []
+        for feature in sorted(profile):
+            if feature.upper() not in self.PARALLEL_DEFAULTS:
+                raise AppException("Oracle session profiles only set %s, not '%s'" %
+                                   (', '.join(sorted(self.PARALLEL_DEFAULTS)), feature))
+            status = str(profile[feature]).split(None, 1)
+            result.append("ALTER SESSION %s %s%s;" % (status[0], feature.upper(),
+                                                      ' ' + status[1] if len(status) > 1 else ''))
+        return '\n'.join(result)
+
+    def profile_restore(self, profile):
+        """
+        Generate query that commits and restores the default status of
+        parallel features set by a profile (that can't be changed within a
+        transaction).
+        :param profile: the status of parallel features as a dictionary
+        :return: generated query
+        """
+        result = ['COMMIT;']
+        for feature in sorted(profile):
+            result.append("ALTER SESSION %s %s;" % (self.PARALLEL_DEFAULTS[feature.upper()], feature.upper()))
+        return '\n'.join(result)
+
+    def script_check_start(self):
+        """
+        Return the current date of the database, from which errors of objects
+        compiled by a script run by migration program are checked.
+        :return: the date as a string
+        """
+        result = self.run_catalog_query(self.SQL_SCRIPT_CHECK_START)
+        return result[0]['START_DATE'] if result else None
+
+    def script_check_begin(self, start=None):
+        """
+        Generate query that records the date before a script, or given date,
+        to check errors of objects it compiled.
+        :param start: the date returned by script_check_start() if errors are
+               checked in another session than the script
+        :return: generated query
+        """
+        if start:
+            return self.SQL_SCRIPT_CHECK_SINCE % {'start': start}
+        return self.SQL_SCRIPT_CHECK_BEGIN
+
+    def script_check(self, script):
+        """
+        Generate query that raises an error with the compilation errors of
+        objects compiled by a script, read in USER_ERRORS.
+        :param script: the script that was run
+        :return: generated query
+        """
+        return self.SQL_SCRIPT_CHECK % {'script': script}
+
+    def compile_object(self, kind, name):
+        """
+        Compile a stored object. Compilation errors don't raise an error and
+        must be read with compilation_errors().
+        :param kind: the type of the object
+        :param name: the name of the object
+        """
+        body = ''
+        if kind.endswith(' BODY'):
+            kind = kind[:-len(' BODY')]
+            body = ' BODY'
+        parameters = {'type': kind, 'name': name, 'body': body}
+        self.database.run_query(self.SQL_COMPILE_OBJECT % parameters, check_errors=False)
+
+    def compilation_errors(self):
+        """
+        Return compilation errors of stored objects.
+        :return: a list of dictionaries with TYPE, NAME, LINE, POSITION and
+                 TEXT of errors
+        """
+        return self.run_catalog_query(self.SQL_COMPILATION_ERRORS) or []
+
+    def hint_ddl(self, code, parallel):
+        """
+        Add ONLINE clause to a CREATE INDEX or ALTER TABLE MOVE statement and,
+        with a parallel degree, a PARALLEL clause followed by a statement that
+        resets the degree of the index or table with NOPARALLEL so that
+        queries don't run in parallel afterwards.
+        Hints are inserted before trailing comments so that they are not
+        commented out.
+        :param code: the code of the statement
+        :param parallel: the parallel degree or None to run serially
+        :return: the code with hints
+        """
+        end = 0
+        for match in self.REGEXP_LEXEME.finditer(code):
+            if not match.group('blank'):
+                end = match.end()
+        code, comments = code[:end], code[end:]
+        match = self.REGEXP_CREATE_INDEX.match(code)
+        if match:
+            result = code + ' ONLINE'
+            if parallel:
+                result += ' PARALLEL %s' % parallel
+            reset = 'ALTER INDEX %s NOPARALLEL' % match.group(1)
+        else:
+            head, table, _, clauses, update = self.REGEXP_MOVE.match(code).groups()
+            result = head + ' ONLINE' + clauses
+            if parallel:
+                result += ' PARALLEL %s' % parallel
+            result += update or ''
+            reset = 'ALTER TABLE %s NOPARALLEL' % table
+        if not parallel:
+            return result + comments
+        return self.terminate(result + comments, self.splitter.DELIMITER) + '\n' + reset
 
     def script_header(self, db_config): # pylint: disable=W0613
         return "WHENEVER SQLERROR EXIT SQL.SQLCODE;\nWHENEVER OSERROR EXIT 9;"
@@ -920,6 +3242,15 @@ class Config(object):
         """
         self.__dict__.update(fields)
 
+    def get(self, name, default=None):
+        """
+        Get an optional configuration field.
+        :param name: the name of the field
+        :param default: the value to return if field is not set
+        :return: the value of the field or default
+        """
+        return self.__dict__.get(name, default)
+
     def __repr__(self):
         """
         Representation as Python code.
@@ -958,6 +3289,12 @@ class Script(object):
             v = dirname
         self.version = Script.split_version(v)
         self.name = v + os.path.sep + os.path.basename(path)
+        parts = os.path.basename(path).split('.')
+        self.kind = parts[-2].lower() if len(parts) > 2 else None
+        self.checksum = None
+        self.statements = None
+        self.directives = None
+        self.rewritten = False
 
     def sort_key(self):
         """
@@ -997,6 +3334,463 @@ class Script(object):
             raise AppException("Unknown version '%s'" % version)
 
 
+class ChecksumManifest(object):
+    """
+    Cache of script checksums, stored in a manifest file and keyed by script
+    name, size and modification time. Checksums are only computed for scripts
+    that changed since the manifest was written, in a pool of threads. The
+    checksum of a script covers the files it depends on, such as data files,
+    whose size and modification time are also stored.
+    """
+
+    DIRECTORY = 'db_migration'
+    THREADS = 4
+
+    def __init__(self, path, threads=None, dependencies=None):
+        """
+        Constructor.
+        :param path: the path of the manifest file
+        :param threads: the number of threads computing checksums
+        :param dependencies: function that returns the paths of files a script
+               depends on, called for changed scripts only
+        """
+        self.path = path
+        self.threads = threads or self.THREADS
+        self.dependencies = dependencies
+        self.entries = {}
+        self.changed = False
+
+    @classmethod
+    def default_path(cls, sql_dir):
+        """
+        Return the default path of the manifest of an SQL directory, in the
+        cache directory of the user (XDG_CACHE_HOME or ~/.cache), so that SQL
+        directory is left untouched.
+        :param sql_dir: the SQL directory
+        :return: the path of the manifest file
+        """
+        cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        key = hashlib.sha1(os.path.abspath(sql_dir).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(cache, cls.DIRECTORY, 'checksums-%s.json' % key)
+
+    def load(self):
+        """
+        Load the manifest file, ignoring it if missing or corrupted.
+        """
+        try:
+            with open(self.path) as handle:
+                self.entries = json.load(handle)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        """
+        Save the manifest file if it changed, creating its directory, and
+        ignoring write errors (the cache is optional).
+        """
+        if not self.changed:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(self.path, 'w') as handle:
+                json.dump(self.entries, handle, sort_keys=True)
+            self.changed = False
+        except (IOError, OSError):
+            pass
+
+    def checksums(self, scripts):
+        """
+        Set the checksum of given scripts, computing it only for scripts that
+        changed since they were cached.
+        :param scripts: the list of scripts
+        """
+        changed = []
+        for script in scripts:
+            stat = os.stat(script.path)
+            entry = self.entries.get(script.name)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime and \
+                    self.unchanged(entry[3] if len(entry) > 3 else []):
+                script.checksum = entry[2]
+            else:
+                paths = [script.path] + (self.dependencies(script) if self.dependencies else [])
+                changed.append((script, stat, paths))
+        if not changed:
+            return
+        if len(changed) == 1:
+            checksums = [self.compute(*changed[0][2])]
+        else:
+            pool = multiprocessing.pool.ThreadPool(min(self.threads, len(changed)))
+            try:
+                checksums = pool.map(lambda paths: self.compute(*paths), [paths for _, _, paths in changed])
+            finally:
+                pool.close()
+        for (script, stat, paths), checksum in zip(changed, checksums):
+            script.checksum = checksum
+            self.entries[script.name] = [stat.st_size, stat.st_mtime, checksum]
+            if len(paths) > 1:
+                self.entries[script.name].append([[path, os.stat(path).st_size, os.stat(path).st_mtime]
+                                                  for path in paths[1:]])
+        self.changed = True
+
+    @staticmethod
+    def unchanged(dependencies):
+        """
+        Tell if files a script depends on didn't change since they were cached.
+        :param dependencies: the list of cached [path, size, mtime]
+        :return: True if no file changed
+        """
+        for path, size, mtime in dependencies:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stat.st_size != size or stat.st_mtime != mtime:
+                return False
+        return True
+
+    @staticmethod
+    def compute(path, *dependencies):
+        """
+        Compute the checksum of a given file, followed by files it depends on.
+        :param path: the path of the file
+        :param dependencies: the paths of files it depends on
+        :return: the checksum as an hexadecimal string
+        """
+        digest = hashlib.sha256()
+        for name in (path,) + dependencies:
+            with open(name, 'rb') as handle:
+                for block in iter(lambda: handle.read(65536), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+
+
+class Observer(object):
+    """
+    Observer of migration events, registered in OBSERVERS configuration. Each
+    event calls the method of the same name with the migration as first
+    argument. Observers don't have to extend this class that does nothing:
+    they only need methods for events they handle.
+    """
+
+    def meta_created(self, migration):
+        """
+        Called when meta tables were created.
+        :param migration: the migration
+        """
+        pass
+
+    def scripts_listed(self, migration, scripts):
+        """
+        Called when passed scripts were listed in meta tables.
+        :param migration: the migration
+        :param scripts: the list of names of passed scripts
+        """
+        pass
+
+    def plan_computed(self, migration, scripts):
+        """
+        Called when the scripts to run were selected.
+        :param migration: the migration
+        :param scripts: the list of scripts to run
+        """
+        pass
+
+    def migration_generated(self, migration, script):
+        """
+        Called when a migration script was generated.
+        :param migration: the migration
+        :param script: the source of the migration script
+        """
+        pass
+
+    def scripts_started(self, migration, scripts):
+        """
+        Called before running scripts in a database session.
+        :param migration: the migration
+        :param scripts: the list of scripts
+        """
+        pass
+
+    def scripts_finished(self, migration, scripts, elapsed):
+        """
+        Called after scripts were run successfully in a database session.
+        :param migration: the migration
+        :param scripts: the list of scripts
+        :param elapsed: the time spent running scripts in seconds
+        """
+        pass
+
+    def error(self, migration, error, script):
+        """
+        Called when preparing the migration or running scripts failed.
+        :param migration: the migration
+        :param error: the exception
+        :param script: the name of the failing script or None if unknown
+        """
+        pass
+
+    def install_finished(self, migration, success, elapsed):
+        """
+        Called at the end of a migration, even if its preparation failed.
+        :param migration: the migration
+        :param success: tells if migration was successful
+        :param elapsed: the duration of the migration in seconds
+        """
+        pass
+
+
+class PrometheusMetrics(Observer):
+    """
+    Observer that writes metrics of a migration in Prometheus exposition
+    format, for the textfile collector of node exporter. The file is written
+    when scripts are planned, after each group of scripts and at the end of
+    the migration. Driver calls are counted from spans of the tracer.
+    """
+
+    PREFIX = 'db_migration_'
+    # spans of driver calls
+    DRIVERS = ('mysql', 'sqlplus', 'sqlldr')
+    METRICS = (
+        ('running', 'Tells if the migration is running.'),
+        ('failed', 'Tells if the migration failed.'),
+        ('duration_seconds', 'Duration of the migration.'),
+        ('last_run_timestamp_seconds', 'Time of the last update of the migration.'),
+        ('scripts_planned', 'Number of scripts to run.'),
+        ('scripts_total', 'Number of scripts run.'),
+        ('sql_bytes_total', 'Bytes of SQL sent to database.'),
+        ('session_duration_seconds', 'Duration of sessions running scripts, by first script.'),
+        ('session_scripts', 'Number of scripts run in sessions, by first script.'),
+        ('driver_calls_total', 'Number of database client calls.'),
+        ('driver_seconds_total', 'Time spent in database client calls.'),
+    )
+
+    def __init__(self, path, tracer):
+        """
+        Constructor.
+        :param path: the path of the metrics file
+        :param tracer: the tracer recording driver calls
+        """
+        self.path = path
+        self.tracer = tracer
+        self.running = 1
+        self.failed = 0
+        self.duration = None
+        self.planned = 0
+        self.sessions = []
+
+    def plan_computed(self, migration, scripts):
+        self.planned = len(scripts)
+        self.write(migration)
+
+    def scripts_finished(self, migration, scripts, elapsed):
+        self.sessions.append((scripts[0].name, len(scripts), elapsed))
+        self.write(migration)
+
+    def error(self, migration, error, script):
+        self.failed = 1
+
+    def install_finished(self, migration, success, elapsed):
+        self.running = 0
+        self.failed = int(not success)
+        self.duration = elapsed
+        self.write(migration)
+
+    def write(self, migration):
+        """
+        Write metrics in a temporary file renamed to metrics file, so that the
+        collector never reads a partial file.
+        :param migration: the migration
+        """
+        labels = {'platform': migration.platform, 'version': migration.version}
+        with self.tracer.lock:
+            spans = [span for span in self.tracer.spans if span['name'] in self.DRIVERS]
+        values = {
+            'running': [(labels, self.running)],
+            'failed': [(labels, self.failed)],
+            'duration_seconds': [(labels, self.duration if self.duration is not None else
+                                  time.time() - migration.start_time)],
+            'last_run_timestamp_seconds': [(labels, time.time())],
+            'scripts_planned': [(labels, self.planned)],
+            'scripts_total': [(labels, sum([count for _, count, _ in self.sessions]))],
+            'sql_bytes_total': [(labels, sum([span['arguments'].get('size', 0) for span in spans]))],
+            'session_duration_seconds': [(dict(labels, script=script), elapsed)
+                                         for script, _, elapsed in self.sessions],
+            'session_scripts': [(dict(labels, script=script), count) for script, count, _ in self.sessions],
+            'driver_calls_total': [],
+            'driver_seconds_total': [],
+        }
+        for driver in self.DRIVERS:
+            calls = [span for span in spans if span['name'] == driver]
+            if calls:
+                values['driver_calls_total'].append((dict(labels, client=driver), len(calls)))
+                values['driver_seconds_total'].append((dict(labels, client=driver),
+                                                       sum([span['end'] - span['start'] for span in calls])))
+        lines = []
+        for name, description in self.METRICS:
+            lines.append('# HELP %s%s %s' % (self.PREFIX, name, description))
+            lines.append('# TYPE %s%s %s' % (self.PREFIX, name, 'counter' if name.endswith('_total') else 'gauge'))
+            for metric_labels, value in values[name]:
+                lines.append('%s%s{%s} %s' % (self.PREFIX, name, self.format_labels(metric_labels),
+                                              repr(value) if isinstance(value, float) else str(value)))
+        temporary = self.path + '.tmp'
+        try:
+            with codecs.open(temporary, mode='w', encoding='utf-8') as handle:
+                handle.write('\n'.join(lines) + '\n')
+            os.rename(temporary, self.path)
+        except (IOError, OSError) as e:
+            raise AppException("Error writing metrics file '%s': %s" % (self.path, e))
+
+    @staticmethod
+    def format_labels(labels):
+        """
+        Format labels of a metric, escaping their values.
+        :param labels: the labels as a dictionary
+        :return: the labels as a string
+        """
+        return ','.join(['%s="%s"' % (name, unicode(labels[name]).replace('\\', '\\\\').replace('"', '\\"').
+                                       replace('\n', '\\n')) for name in sorted(labels)])
+
+
+class Profiler(Observer):
+    """
+    Observer that profiles a run of the program: CPU time of functions with
+    cProfile and memory with a census of live objects by type, taken at the
+    beginning, when scripts are planned, when a migration script is generated
+    and at the end, along with maximum resident set size (tracemalloc is not
+    available in Python 2).
+    """
+
+    SORTS = ('calls', 'cumulative', 'tottime')
+
+    def __init__(self, cpu=True, memory=False, top=40, sort='cumulative'):
+        """
+        Constructor.
+        :param cpu: tells if CPU time is profiled
+        :param memory: tells if memory is profiled
+        :param top: the number of functions and types in report
+        :param sort: the sort key of functions, one of SORTS
+        """
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.sort = sort
+        self.profile = cProfile.Profile() if cpu else None
+        self.snapshots = []
+        self.running = False
+        self.elapsed = None
+
+    def run(self, function, *args, **kwargs):
+        """
+        Run and profile a function.
+        :param function: the function to run
+        :param args: the positional arguments of the function
+        :param kwargs: the keyword arguments of the function
+        :return: the result of the function
+        """
+        self.snapshot('begin')
+        start = time.time()
+        self.running = True
+        if self.profile:
+            self.profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self.profile:
+                self.profile.disable()
+            self.running = False
+            self.elapsed = time.time() - start
+            self.snapshot('end')
+
+    def plan_computed(self, migration, scripts):
+        self.snapshot('plan_computed')
+
+    def migration_generated(self, migration, script):
+        self.snapshot('migration_generated')
+
+    def snapshot(self, label):
+        """
+        Record maximum resident set size and live objects by type, if memory
+        is profiled. CPU profiling is paused while counting objects.
+        :param label: the label of the snapshot
+        """
+        if not self.memory:
+            return
+        if self.profile and self.running:
+            self.profile.disable()
+        try:
+            ignored = set()
+            ignored.add(id(ignored))
+            for _, _, census in self.snapshots:
+                ignored.add(id(census))
+                ignored.update(id(value) for value in census.values())
+            self.snapshots.append((label, self.max_rss(), self.census(ignored)))
+        finally:
+            if self.profile and self.running:
+                self.profile.enable()
+
+    @staticmethod
+    def max_rss():
+        """
+        Get maximum resident set size of the process.
+        :return: the size in KB or None if not available on the system
+        """
+        if not resource:
+            return None
+        size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return size / 1024 if sys.platform == 'darwin' else size
+
+    @staticmethod
+    def census(ignored=()):
+        """
+        Count live objects by type: objects tracked by garbage collector and
+        objects they refer to (such as strings).
+        :param ignored: the set of ids of objects not to count, with objects
+               they refer to
+        :return: a dictionary of (count, size in bytes) by type name
+        """
+        counts = {}
+        seen = set(ignored)
+        ignored = set(ignored)
+        ignored.update((id(seen), id(counts), id(ignored)))
+        seen.update(ignored)
+        for container in gc.get_objects():
+            if id(container) in ignored:
+                continue
+            for obj in [container] + gc.get_referents(container):
+                if id(obj) in seen:
+                    continue
+                seen.add(id(obj))
+                count, size = counts.get(type(obj).__name__, (0, 0))
+                counts[type(obj).__name__] = count + 1, size + sys.getsizeof(obj, 0)
+        return counts
+
+    def report(self):
+        """
+        Build report of profile.
+        :return: the report as text
+        """
+        lines = ["Profile of migration run in %.3f s" % (self.elapsed or 0)]
+        if self.profile:
+            stream = StringIO.StringIO()
+            stats = pstats.Stats(self.profile, stream=stream)
+            stats.sort_stats(self.sort).print_stats(self.top)
+            lines += ['', "Top %d functions sorted by %s:" % (self.top, self.sort), stream.getvalue().strip('\n')]
+        if self.snapshots:
+            _, begin_rss, begin = self.snapshots[0]
+            for label, rss, census in self.snapshots[1:]:
+                lines += ['', "Memory at %s (max RSS %s KB, %s KB more than beginning):" %
+                          (label, rss, rss - begin_rss if rss is not None else None)]
+                lines.append("%-32s %12s %12s %14s %14s" % ('type', 'objects', '+objects', 'bytes', '+bytes'))
+                growth = sorted(census.items(), key=lambda item: item[1][1] - begin.get(item[0], (0, 0))[1],
+                                reverse=True)
+                for name, (count, size) in growth[:self.top]:
+                    lines.append("%-32s %12d %+12d %14d %+14d" % (name, count, count - begin.get(name, (0, 0))[0],
+                                                                  size, size - begin.get(name, (0, 0))[1]))
+        return '\n'.join(lines) + '\n'
+
+
 class DBMigration(object):
     """
     The database migration script. It is abstracted from database with database
@@ -1006,6 +3800,45 @@ class DBMigration(object):
     VERSION_FILE = 'VERSION'
     SNAPSHOT_POSTFIX = '-SNAPSHOT'
     SCRIPTS_GLOB = '*/*.sql'
+    REGEXP_DIRECTIVE = re.compile(r'--\s*@(\w+)(.*)$')
+    # directive of session profile of scripts
+    PROFILE_DIRECTIVE = 'profile'
+    # directive of scripts which statements are retried on transient errors
+    RETRY_DIRECTIVE = 'retry'
+    # directive of data load scripts and field separators by data file extension
+    LOAD_DIRECTIVE = 'load'
+    LOAD_SEPARATORS = {'.csv': ',', '.tsv': '\t'}
+    REGEXP_ALTER = re.compile(r'^ALTER\s+TABLE\s+(`?(\w+)`?)\s+(.*\S)\s*$', re.IGNORECASE | re.DOTALL)
+    # statements that modify a table, with its name in group 'table'
+    REGEXP_TOUCHED = re.compile(r'^(?:(?:INSERT|REPLACE)\s+(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE)\s+)*'
+                                r'(?:INTO\s+)?|UPDATE\s+(?:(?:LOW_PRIORITY|IGNORE)\s+)*|'
+                                r'DELETE\s+(?:(?:LOW_PRIORITY|QUICK|IGNORE)\s+)*FROM\s+|'
+                                r'(?:ALTER|CREATE|TRUNCATE)\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?|'
+                                r'CREATE\s+(?:UNIQUE\s+|BITMAP\s+)?INDEX\s+\S+\s+ON\s+|'
+                                r'LOAD\s+DATA\b.*?\bINTO\s+TABLE\s+)'
+                                r'(?:[`"]?\w+[`"]?\.)?[`"]?(?P<table>[\w$#]+)', re.IGNORECASE | re.DOTALL)
+    # DDL statements that lock a table, with its name in group 'table'
+    REGEXP_DDL = re.compile(r'^(?:(?:ALTER|DROP|TRUNCATE|OPTIMIZE|RENAME)\s+TABLE\s+(?:IF\s+EXISTS\s+)?|'
+                            r'(?:CREATE\s+(?:UNIQUE\s+|BITMAP\s+|FULLTEXT\s+|SPATIAL\s+)?|DROP\s+)INDEX\s+\S+\s+ON\s+)'
+                            r'(?:[`"]?\w+[`"]?\.)?[`"]?(?P<table>[\w$#]+)', re.IGNORECASE)
+    # statements that create a stored object, with its type and name
+    REGEXP_CREATE_OBJECT = re.compile(r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:NON)?EDITIONABLE\s+)?'
+                                      r'(?:FORCE\s+|NO\s+FORCE\s+)?(?P<type>PACKAGE\s+BODY|TYPE\s+BODY|'
+                                      r'MATERIALIZED\s+VIEW|PACKAGE|TYPE|VIEW|PROCEDURE|FUNCTION|TRIGGER|SYNONYM)\s+'
+                                      r'(?:"?\w+"?\.)?"?(?P<name>[\w$#]+)', re.IGNORECASE)
+    # ALTER TABLE clauses that can't be coalesced with others
+    REGEXP_ALTER_ALONE = re.compile(r'\b(?:RENAME|ALGORITHM|LOCK|ORDER|PARTITION|PARTITIONS|DISCARD|IMPORT|'
+                                    r'TRUNCATE|COALESCE|REORGANIZE|EXCHANGE|ANALYZE|CHECK|OPTIMIZE|'
+                                    r'REBUILD|REPAIR|REMOVE|UPGRADE)\b', re.IGNORECASE)
+    # ALTER TABLE clauses that add a column, index or constraint, with its name
+    REGEXP_ALTER_ADDS = re.compile(r'^(?:ADD\s+(?:COLUMN\s+|CONSTRAINT\s+|(?:UNIQUE|FULLTEXT|SPATIAL)\s+)?'
+                                   r'(?:INDEX\s+|KEY\s+)?|CHANGE\s+(?:COLUMN\s+)?`?\w+`?\s+)`?(\w+)`?',
+                                   re.IGNORECASE)
+    # ALTER TABLE clauses that add several columns in parentheses
+    REGEXP_ALTER_ADDS_LIST = re.compile(r'^ADD\s+(?:COLUMN\s+)?\((.*)\)$', re.IGNORECASE | re.DOTALL)
+    # ALTER TABLE clauses that use an existing column, index or constraint, with its name
+    REGEXP_ALTER_USES = re.compile(r'^(?:MODIFY|CHANGE|ALTER|DROP)\s+(?:COLUMN\s+|INDEX\s+|KEY\s+|'
+                                   r'FOREIGN\s+KEY\s+|CONSTRAINT\s+)?`?(\w+)`?', re.IGNORECASE)
     LOCAL_DB_CONFIG = {
         'mysql': {
             'hostname': 'localhost',
@@ -1034,6 +3867,28 @@ class DBMigration(object):
             current directory.
 -m from     To print migration script from 'from' to 'version' on the console.
             'init' value indicates that we include initialization scripts.
+--statements Print the number of statements of each script with -d.
+--resume    Record statement checkpoints and restart the script that failed
+            in last migration at the failing statement.
+--lean      Lean meta mode: record passed scripts in batches (at the end or
+            every LEAN_CHECKPOINT scripts) instead of around each script.
+--coalesce  Merge consecutive ALTER TABLE on a same table of selected scripts
+            (MySQL only).
+--ddl-algorithm Append ALGORITHM=INSTANT or ALGORITHM=INPLACE, LOCK=NONE to
+            DDL statements that don't block writes (MySQL only).
+--export=file   Export meta tables of platform in a snapshot file.
+--cost      Print scripts recorded in meta tables of platform with the highest
+            server cost (measured with SCRIPT_COST configuration).
+--trace=file    Write spans of the run (driver calls, meta queries, generation
+            and scripts) in a Chrome trace or OTLP JSON file (TRACE_FORMAT).
+--metrics-file=file Write metrics of the migration in Prometheus text format,
+            during and at the end of the migration.
+--profile   Profile CPU time of functions of the run and write a report in
+            a file next to generated migration scripts.
+--profile-memory Profile memory of the run (maximum RSS and live objects by
+            type at each step) in the same report.
+--snapshot=file Compute the list of scripts to run with -d from a snapshot
+            file, without connecting to database.
 platform    The database platform as defined in configuration file.
 version     The version to install."""
 
@@ -1069,13 +3924,28 @@ version     The version to install."""
         configuration = None
         from_version = None
         keep = False
+        lean = False
+        count_statements = False
+        resume = False
+        export = None
+        snapshot = None
+        coalesce = False
+        ddl_algorithm = False
+        cost = False
+        trace = None
+        metrics_file = None
+        profile = False
+        profile_memory = False
         platform = None
         version = None
         try:
             opts, args = getopt.getopt(arguments,
                                        "hdialus:c:p:m:k",
                                        ["help", "dry-run", "init", "all", "local", "mute",
-                                        "sql-dir=", "config=", "migration=", "keep"])
+                                        "sql-dir=", "config=", "migration=", "keep", "lean",
+                                        "statements", "resume", "export=", "snapshot=", "coalesce",
+                                        "ddl-algorithm", "cost", "trace=", "metrics-file=", "profile",
+                                        "profile-memory"])
         except getopt.GetoptError as exception:
             raise AppException("%s\n%s" % (exception.message, DBMigration.HELP))
         for opt, arg in opts:
@@ -1100,6 +3970,30 @@ version     The version to install."""
                 from_version = arg
             elif opt in ("-k", "--keep"):
                 keep = True
+            elif opt == "--lean":
+                lean = True
+            elif opt == "--statements":
+                count_statements = True
+            elif opt == "--resume":
+                resume = True
+            elif opt == "--export":
+                export = arg
+            elif opt == "--snapshot":
+                snapshot = arg
+            elif opt == "--coalesce":
+                coalesce = True
+            elif opt == "--ddl-algorithm":
+                ddl_algorithm = True
+            elif opt == "--cost":
+                cost = True
+            elif opt == "--trace":
+                trace = arg
+            elif opt == "--metrics-file":
+                metrics_file = arg
+            elif opt == "--profile":
+                profile = True
+            elif opt == "--profile-memory":
+                profile_memory = True
             else:
                 raise AppException("Unhandled option: %s\n%s" % (opt, DBMigration.HELP))
         if len(args) == 0:
@@ -1111,9 +4005,15 @@ version     The version to install."""
             raise AppException("Too many arguments on command line:\n%s" % DBMigration.HELP)
         return DBMigration(dry_run=dry_run, init=init, all_scripts=all_scripts, local=local, mute=mute,
                            platform=platform, version=version, from_version=from_version, keep=keep,
-                           sql_dir=sql_dir, configuration=configuration)
+                           sql_dir=sql_dir, configuration=configuration, lean=lean,
+                           count_statements=count_statements, resume=resume, export=export, snapshot=snapshot,
+                           coalesce=coalesce, ddl_algorithm=ddl_algorithm, cost=cost, trace=trace,
+                           metrics_file=metrics_file, profile=profile, profile_memory=profile_memory)
 
-    def __init__(self, dry_run, init, all_scripts, local, mute, platform, version, from_version, keep, sql_dir, configuration):
+    def __init__(self, dry_run, init, all_scripts, local, mute, platform, version, from_version, keep, sql_dir, configuration,
+                 lean=False, count_statements=False, resume=False, export=None, snapshot=None,
+                 coalesce=False, ddl_algorithm=False, cost=False, trace=None, metrics_file=None,
+                 profile=False, profile_memory=False):
         """
         Constructor with all command line options processed
         :param dry_run:
@@ -1127,6 +4027,18 @@ version     The version to install."""
         :param keep:
         :param sql_dir:
         :param configuration:
+        :param lean:
+        :param count_statements:
+        :param resume:
+        :param export:
+        :param snapshot:
+        :param coalesce:
+        :param ddl_algorithm:
+        :param cost:
+        :param trace:
+        :param metrics_file:
+        :param profile:
+        :param profile_memory:
         """
         self.dry_run = dry_run
         self.init = init
@@ -1138,19 +4050,50 @@ version     The version to install."""
         self.from_version = from_version
         self.keep = keep
         self.sql_dir = sql_dir
+        self.lean = lean
+        self.count_statements = count_statements
+        self.resume = resume
+        self.export = export
+        self.snapshot = snapshot
+        self.coalesce = coalesce
+        self.ddl_algorithm = ddl_algorithm
+        self.cost = cost
+        self.trace = trace
+        self.metrics_file = metrics_file
+        self.profile = profile
+        self.profile_memory = profile_memory
+        self.profiler = None
+        self.tracer = None
+        if trace or metrics_file:
+            self.tracer = Tracer.active = Tracer()
+        self.resume_statements = {}
+        self.rewrites = []
+        self.blocking_ddl = []
+        self.retries = 0
+        self.retry_time = 0.0
+        self.start_time = None
         self.db_config = None
         self.meta_manager = None
+        self.replicas = []
+        self.throttle = None
+        self.observers = []
         self.version_array = None
         self.from_version_array = None
-        self.config = self.load_configuration(configuration)
-        self.check_options()
-        self.initialize()
+        try:
+            self.config = self.load_configuration(configuration)
+            self.check_options()
+            self.initialize()
+        except Exception:
+            if self.tracer:
+                Tracer.active = None
+            raise
 
     ###########################################################################
     #                                INIT STUFF                               #
     ###########################################################################
 
     @staticmethod
+    @traced
     def load_configuration(configuration):
         """
         Load configuration from file.
@@ -1176,9 +4119,28 @@ version     The version to install."""
             raise AppException('Platform must be one of %s' % ', '.join(sorted(self.config.PLATFORMS)))
         if self.from_version and (self.dry_run or self.local):
             raise AppException("Migration script generation is incompatible with options dry_run and local")
+        if self.resume and (self.lean or self.from_version or self.init):
+            raise AppException("Resume is incompatible with options lean, migration and init")
+        if self.coalesce and self.config.DATABASE != 'mysql':
+            raise AppException("Coalescing ALTER TABLE is only available for MySQL")
+        if self.ddl_algorithm and self.config.DATABASE != 'mysql':
+            raise AppException("Enforcing DDL algorithm is only available for MySQL")
+        if self.config.get('DDL_ONLINE') and self.config.DATABASE != 'oracle':
+            raise AppException("DDL_ONLINE is only available for Oracle")
+        if self.snapshot and not self.dry_run:
+            raise AppException("Snapshot can only be used with dry run")
+        if self.export and (self.dry_run or self.init or self.from_version or self.snapshot):
+            raise AppException("Export is incompatible with options dry_run, init, migration and snapshot")
+        if self.cost and (self.dry_run or self.init or self.from_version or self.snapshot or self.export):
+            raise AppException("Cost is incompatible with options dry_run, init, migration, snapshot and export")
+        if self.metrics_file and (self.dry_run or self.from_version or self.export or self.cost):
+            raise AppException("Metrics file is incompatible with options dry_run, migration, export and cost")
+        if (self.profile or self.profile_memory) and self.config.get('PROFILE_SORT', 'cumulative') not in Profiler.SORTS:
+            raise AppException("PROFILE_SORT must be one of %s" % ', '.join(Profiler.SORTS))
         if self.init and self.platform in self.config.CRITICAL_PLATFORMS and not self.local:
             raise AppException("You can't initialize critical platforms (%s)" % ' and '.join(sorted(self.config.CRITICAL_PLATFORMS)))
 
+    @traced
     def initialize(self):
         """
         Initialize the script with configuration.
@@ -1190,16 +4152,43 @@ version     The version to install."""
                 self.db_config.update(self.LOCAL_DB_CONFIG[self.config.DATABASE])
             else:
                 raise Exception("No local configuration set for database '%s'" % self.db_config['DATABASE'])
-        if not self.db_config['password']:
+        # migrations planned from a snapshot or generated with -m don't connect to database
+        offline = self.snapshot or self.from_version
+        if not self.db_config['password'] and not offline:
             self.db_config['password'] = getpass.getpass("Database password for user '%s': " % self.db_config['username'])
         if self.config.DATABASE == 'mysql':
-            mysql = MysqlCommando(configuration=self.db_config, encoding=self.config.ENCODING)
+            mysql = MysqlCommando(configuration=self.db_config, encoding=self.config.ENCODING) \
+                if not offline else None
             self.meta_manager = MysqlDatabaseAdapter(mysql)
         elif self.config.DATABASE == 'oracle':
-            sqlplus = SqlplusCommando(configuration=self.db_config, encoding=self.config.ENCODING)
+            sqlplus = SqlplusCommando(configuration=self.db_config, encoding=self.config.ENCODING) \
+                if not offline else None
             self.meta_manager = SqlplusDatabaseAdapter(sqlplus)
         else:
             raise AppException("DATABASE must be 'mysql' or 'oracle'")
+        # set replicas to check for replication lag
+        if not offline:
+            for replica in self.db_config.get('replicas', []):
+                replica = dict(replica)
+                if not replica.get('password'):
+                    replica['password'] = self.db_config['password']
+                if self.config.DATABASE == 'mysql':
+                    self.replicas.append(MysqlCommando(configuration=replica, encoding=self.config.ENCODING))
+                else:
+                    self.replicas.append(SqlplusCommando(configuration=replica, encoding=self.config.ENCODING))
+        self.throttle = Throttle(ratio=self.config.get('CHUNK_PAUSE', 0.5),
+                                 check=self.replication_lag if self.replicas else None,
+                                 max_lag=self.config.get('REPLICA_LAG_MAX', 10),
+                                 interval=self.config.get('REPLICA_CHECK_INTERVAL', 1),
+                                 timeout=self.config.get('REPLICA_WAIT_TIMEOUT', 3600))
+        self.observers = list(self.config.get('OBSERVERS', []))
+        if self.metrics_file:
+            self.observers.append(PrometheusMetrics(self.metrics_file, self.tracer))
+        if self.profile or self.profile_memory:
+            self.profiler = Profiler(cpu=self.profile, memory=self.profile_memory,
+                                     top=self.config.get('PROFILE_TOP', 40),
+                                     sort=self.config.get('PROFILE_SORT', 'cumulative'))
+            self.observers.append(self.profiler)
         # set default SQL directory
         if not self.sql_dir:
             if self.config.SQL_DIR:
@@ -1210,7 +4199,7 @@ version     The version to install."""
             else:
                 self.sql_dir = os.path.abspath(os.path.dirname(__file__))
         # manage version
-        if not self.version and not self.all_scripts:
+        if not self.version and not self.all_scripts and not self.export and not self.cost:
             raise AppException("You must pass version on command line")
         if not self.version:
             self.version = 'all'
@@ -1225,15 +4214,57 @@ version     The version to install."""
     ###########################################################################
 
     def run(self):
+        """
+        Run the migration and write the trace file and profile report if asked.
+        """
+        try:
+            with Tracer.span('run'):
+                if self.profiler:
+                    self.profiler.run(self.run_migration)
+                else:
+                    self.run_migration()
+        finally:
+            if self.tracer:
+                Tracer.active = None
+            if self.trace:
+                self.tracer.write(self.trace, self.config.get('TRACE_FORMAT', 'chrome'))
+            if self.profiler:
+                self.write_profile()
+
+    def write_profile(self):
+        """
+        Write profile report in a file next to generated migration scripts.
+        Its path is printed on error output not to mix with migration script
+        printed with option -m.
+        """
+        _, filename = tempfile.mkstemp(suffix='.txt', prefix='db_migration_profile_')
+        with open(filename, 'w') as handle:
+            handle.write(self.profiler.report())
+        print("Profile report in '%s'" % filename, file=sys.stderr)
+
+    def run_migration(self):
         """
         Run the migration.
         """
-        if self.from_version:
+        if self.export:
+            self.export_snapshot()
+        elif self.cost:
+            self.print_cost()
+        elif self.from_version:
             scripts = self.select_scripts(passed=True)
+            self.rewrite_scripts(scripts)
             script = self.generate_migration_script(scripts=scripts, meta=False)
+            self.notify('migration_generated', script)
             self.print_script(script)
         else:
-            scripts = self.prepare_run()
+            self.start_time = time.time()
+            try:
+                scripts = self.prepare_plan() if self.snapshot else self.prepare_run()
+            except Exception as e:
+                if not self.dry_run:
+                    self.notify('error', e, None)
+                    self.notify('install_finished', False, time.time() - self.start_time)
+                raise
             if self.dry_run:
                 self.run_dry(scripts)
             else:
@@ -1242,8 +4273,31 @@ version     The version to install."""
                     print("No migration script to run")
                     print('OK')
                 else:
-                    self.perform_run(scripts)
-
+                    try:
+                        self.perform_run(scripts)
+                    except Exception:
+                        self.notify('install_finished', False, time.time() - self.start_time)
+                        raise
+                self.notify('install_finished', True, time.time() - self.start_time)
+
+    def notify(self, event, *arguments):
+        """
+        Notify observers of an event, calling their method named after the
+        event with the migration and given arguments. As observers must not
+        break the migration, their errors are printed as warnings.
+        :param event: the name of the event
+        :param arguments: the arguments of the event
+        """
+        for observer in self.observers:
+            method = getattr(observer, event, None)
+            if not method:
+                continue
+            try:
+                method(self, *arguments)
+            except Exception as e:
+                print("WARNING: Error in observer %s on event %s: %s" % (observer.__class__.__name__, event, e))
+
+    @traced
     def prepare_run(self):
         """
         Prepare migration creating meta tables, getting list of installed
@@ -1259,39 +4313,602 @@ version     The version to install."""
         self.meta_manager.meta_create(self.init)
         if not self.mute:
             print('OK')
+        self.notify('meta_created')
         if not self.mute:
             print("Listing passed scripts... ", end='')
-        self.meta_manager.list_scripts()
+        self.meta_manager.load_scripts(self.meta_manager.list_scripts())
         if not self.mute:
             print('OK')
+        self.notify('scripts_listed', list(self.meta_manager.installed_scripts))
         self.meta_manager.install_begin(self.version)
-        scripts = self.select_scripts(passed=False)
+        scripts = self.plan_scripts()
+        self.notify('plan_computed', scripts)
+        return scripts
+
+    @traced
+    def prepare_plan(self):
+        """
+        Prepare migration offline, loading passed scripts from snapshot file
+        instead of database, and return the list of scripts to run.
+        :return: the list of scripts to run to perform migration
+        """
+        if not self.mute:
+            print("Version '%s' on platform '%s' from snapshot '%s'" % (self.version, self.platform, self.snapshot))
+        self.meta_manager.load_snapshot(self.read_snapshot())
+        return self.plan_scripts()
+
+    @traced
+    def plan_scripts(self):
+        """
+        Select scripts to run, checking those already passed.
+        :return: the list of scripts to run to perform migration
+        """
+        scripts = self.select_scripts(passed=True)
+        self.compute_checksums(scripts)
+        self.check_checksums(scripts)
+        scripts = self.filter_passed(scripts)
+        if self.resume:
+            self.prepare_resume(scripts)
+        self.rewrite_scripts(scripts)
         return scripts
 
+    @traced
+    def rewrite_scripts(self, scripts):
+        """
+        Rewrite statements of scripts to run with optimizations enabled by
+        options. Applied rewrites are listed in rewrites field.
+        :param scripts: the list of scripts to run
+        """
+        if self.coalesce:
+            self.coalesce_alters(scripts)
+        if self.meta_manager.DDL_ANALYZER and (self.ddl_algorithm or self.dry_run or
+                                               self.config.get('DDL_BLOCKING_MAX_SIZE') is not None):
+            self.analyze_ddl(scripts)
+        if self.config.get('DDL_ONLINE'):
+            self.hint_ddl(scripts)
+
+    def coalesce_alters(self, scripts):
+        """
+        Merge consecutive ALTER TABLE statements on a same table of a script
+        into the first one, if no statement in between references the table
+        and no clause uses a column or index added by a pending clause.
+        Merged ALTER TABLE are replaced with a comment so that statements keep
+        their index. Statements of different scripts are not merged, so that a
+        script that failed doesn't leave clauses of next scripts applied.
+        Scripts with steps and resumed script are not rewritten.
+        :param scripts: the list of scripts to run
+        """
+        pending = {}
+        added = {}
+
+        def flush(script, table):
+            alters = pending.pop(table)
+            added.pop(table, None)
+            if len(alters) < 2:
+                return
+            index, reference, clause = alters[0]
+            statement = script.statements[index]
+            prefix = statement.text[:len(statement.text) - len(statement.code())]
+            lines = ', '.join([str(script.statements[number].line) for number, _, _ in alters[1:]])
+            text = "%s-- Coalesced with ALTER TABLE at line%s %s\nALTER TABLE %s\n  %s" % \
+                   (prefix, 's' if len(alters) > 2 else '', lines, reference,
+                    ',\n  '.join([c for _, _, c in alters]))
+            script.statements[index] = Statement(text, statement.delimiter, statement.line)
+            script.rewritten = True
+            for number, _, _ in alters[1:]:
+                statement = script.statements[number]
+                prefix = statement.text[:len(statement.text) - len(statement.code())]
+                comment = "%s-- ALTER TABLE %s coalesced at line %s" % \
+                          (prefix, reference, script.statements[index].line)
+                script.statements[number] = Statement(comment, '', statement.line)
+            self.rewrites.append("Coalesced %s ALTER TABLE %s at line %s of script %s" %
+                                 (len(alters), reference, script.statements[index].line, script))
+
+        for script in scripts:
+            if self.step_script(script) or script.name in self.resume_statements:
+                continue
+            for index, statement in enumerate(self.split_script(script)):
+                code = statement.code()
+                match = self.REGEXP_ALTER.match(code)
+                table = match.group(2).lower() if match else None
+                for name in list(pending):
+                    if name != table and re.search(r'\b%s\b' % re.escape(name), code, re.IGNORECASE):
+                        flush(script, name)
+                if not match:
+                    continue
+                if self.REGEXP_ALTER_ALONE.search(match.group(3)):
+                    if table in pending:
+                        flush(script, table)
+                    continue
+                adds, uses = self.alter_names(match.group(3))
+                if table in pending and uses & added[table]:
+                    flush(script, table)
+                pending.setdefault(table, []).append((index, match.group(1), match.group(3)))
+                added.setdefault(table, set()).update(adds)
+            for name in list(pending):
+                flush(script, name)
+
+    def alter_names(self, clauses):
+        """
+        Return names of columns, indexes and constraints that clauses of an
+        ALTER TABLE add and use, in lower case. Clauses that use a name added
+        by a clause of a same statement fail on MySQL.
+        :param clauses: the clauses of the ALTER TABLE
+        :return: a tuple (added names, used names) of sets
+        """
+        adds = set()
+        uses = set()
+        for clause in MysqlDdlAnalyzer.split_clauses(clauses):
+            match = self.REGEXP_ALTER_ADDS_LIST.match(clause)
+            if match:
+                for column in MysqlDdlAnalyzer.split_clauses(match.group(1)):
+                    adds.add(column.split()[0].strip('`').lower())
+                continue
+            match = self.REGEXP_ALTER_ADDS.match(clause)
+            if match:
+                adds.add(match.group(1).lower())
+            match = self.REGEXP_ALTER_USES.match(clause)
+            if match:
+                uses.add(match.group(1).lower())
+        return adds, uses
+
+    def analyze_ddl(self, scripts):
+        """
+        Analyze DDL statements of scripts to find those that block writes on
+        their table, listed in blocking_ddl field. Print a warning for those
+        on tables bigger than DDL_BLOCKING_MAX_SIZE megabytes, or raise an
+        AppException if configuration field DDL_BLOCKING_STRICT is set. With
+        ddl_algorithm option, append algorithm options to other ones. Scripts
+        with steps and passed statements of resumed script are not analyzed.
+        Only called in dry run, with ddl_algorithm option or if
+        DDL_BLOCKING_MAX_SIZE is set, as it queries table sizes.
+        :param scripts: the list of scripts to run
+        """
+        analyzer = self.meta_manager.DDL_ANALYZER
+        analyzed = []
+        for script in scripts:
+            if self.step_script(script):
+                continue
+            skip = self.resume_statements.get(script.name, 0)
+            for index, statement in enumerate(self.split_script(script)):
+                if index < skip:
+                    continue
+                result = analyzer.analyze(statement.code())
+                if result:
+                    analyzed.append((script, index, result[0], result[1]))
+        if not analyzed:
+            return
+        schemas = sorted(set([table.split('.')[0].lower() for _, _, table, _ in analyzed if '.' in table]))
+        sizes = self.meta_manager.table_sizes(schemas) if not self.from_version else {}
+        max_size = self.config.get('DDL_BLOCKING_MAX_SIZE')
+        refused = []
+        for script, index, table, algorithm in analyzed:
+            statement = script.statements[index]
+            if algorithm in analyzer.BLOCKING:
+                size, rows = sizes.get(table.lower(), (None, None))
+                if size is None:
+                    description = 'unknown size'
+                else:
+                    description = '%.1f MB, %s rows' % (size / 1048576.0, rows)
+                self.blocking_ddl.append("Blocking DDL on table %s in script %s line %s: %s (%s)" %
+                                         (table, script, statement.line, algorithm, description))
+                if max_size is not None and size is not None and size > max_size * 1048576:
+                    refused.append("%s (%s line %s)" % (table, script, statement.line))
+            elif self.ddl_algorithm:
+                options = analyzer.enforce(statement.code(), algorithm)
+                if options:
+                    script.statements[index] = Statement(analyzer.append(statement.text, options),
+                                                         statement.delimiter, statement.line)
+                    script.rewritten = True
+                    self.rewrites.append("Enforced %s on table %s in script %s line %s" %
+                                         (options.strip(', '), table, script, statement.line))
+        if not refused:
+            return
+        message = "DDL blocking writes on tables bigger than %s MB: %s" % (max_size, ', '.join(refused))
+        if self.config.get('DDL_BLOCKING_STRICT'):
+            raise AppException(message)
+        if not self.mute:
+            print("WARNING: %s" % message)
+
+    def hint_ddl(self, scripts):
+        """
+        Add hints to DDL statements that can run online (CREATE INDEX and
+        ALTER TABLE MOVE for Oracle). Statements on tables bigger than
+        DDL_PARALLEL_MIN_SIZE megabytes also run with DDL_PARALLEL_DEGREE.
+        Applied hints are written in a comment before the statement. Scripts
+        with steps and passed statements of resumed script are not rewritten.
+        :param scripts: the list of scripts to run
+        """
+        hinted = []
+        for script in scripts:
+            if self.step_script(script):
+                continue
+            skip = self.resume_statements.get(script.name, 0)
+            for index, statement in enumerate(self.split_script(script)):
+                if index < skip:
+                    continue
+                table = self.meta_manager.online_ddl(statement.code())
+                if table:
+                    hinted.append((script, index, table))
+        if not hinted:
+            return
+        sizes = self.meta_manager.table_sizes() if not self.from_version else {}
+        degree = self.config.get('DDL_PARALLEL_DEGREE', 4)
+        min_size = self.config.get('DDL_PARALLEL_MIN_SIZE', 1024)
+        for script, index, table in hinted:
+            statement = script.statements[index]
+            size = sizes.get(table.lower(), (None, None))[0]
+            parallel = degree if degree and size is not None and size >= min_size * 1048576 else None
+            code = statement.code()
+            prefix = statement.text[:len(statement.text) - len(code)]
+            hints = 'ONLINE PARALLEL %s' % parallel if parallel else 'ONLINE'
+            description = 'unknown size' if size is None else '%.1f MB' % (size / 1048576.0)
+            text = "%s-- Added %s on table %s (%s)\n%s" % \
+                   (prefix, hints, table, description, self.meta_manager.hint_ddl(code, parallel))
+            script.statements[index] = Statement(text, statement.delimiter, statement.line)
+            script.rewritten = True
+            self.rewrites.append("Added %s on table %s in script %s line %s" % (hints, table, script, statement.line))
+
+    @traced
+    def export_snapshot(self):
+        """
+        Export passed scripts and checkpoint of platform in snapshot file.
+        Meta tables are only read, an AppException is raised if they are
+        missing.
+        """
+        if not self.mute:
+            print("Exporting meta tables of platform '%s'... " % self.platform, end='')
+            sys.stdout.flush()
+        try:
+            snapshot = self.meta_manager.snapshot()
+        except (MysqlException, SqlplusException) as e:
+            raise AppException("Error reading meta tables of platform '%s', that are created by migrations: %s" %
+                               (self.platform, e))
+        snapshot['database'] = self.config.DATABASE
+        snapshot['platform'] = self.platform
+        snapshot['date'] = datetime.datetime.now().strftime(MysqlCommando.ISO_FORMAT)
+        try:
+            with open(self.export, 'w') as handle:
+                json.dump(snapshot, handle, separators=(',', ':'))
+        except IOError as e:
+            raise AppException("Error writing snapshot file '%s': %s" % (self.export, e))
+        if not self.mute:
+            print('OK')
+            print("%s passed scripts exported in '%s'" % (len(snapshot['scripts']), self.export))
+
+    @traced
+    def print_cost(self):
+        """
+        Print the COST_TOP scripts recorded in meta tables with the highest
+        server cost, ranked by server time.
+        """
+        scripts = self.meta_manager.scripts_cost(self.config.get('COST_TOP', 20))
+        if not scripts:
+            print("No script cost recorded on platform '%s'" % self.platform)
+            return
+        columns = [column.lower() for column in self.meta_manager.COST_COLUMNS]
+        print("Most costly scripts on platform '%s':" % self.platform)
+        for script, version, costs in scripts:
+            print("- %s (%s): %s" % (script, version, ', '.join(["%s %s" % (column, value)
+                                                                 for column, value in zip(columns, costs)])))
+
+    def read_snapshot(self):
+        """
+        Read snapshot file and check it matches database and platform.
+        :return: the snapshot as a dictionary
+        """
+        try:
+            with open(self.snapshot) as handle:
+                snapshot = json.load(handle)
+        except (IOError, ValueError) as e:
+            raise AppException("Error reading snapshot file '%s': %s" % (self.snapshot, e))
+        if snapshot.get('database') != self.config.DATABASE or snapshot.get('platform') != self.platform:
+            raise AppException("Snapshot file '%s' was exported from %s platform '%s'" %
+                               (self.snapshot, snapshot.get('database'), snapshot.get('platform')))
+        return snapshot
+
+    def prepare_resume(self, scripts):
+        """
+        Find the statement where the script that failed in last migration must
+        be restarted.
+        :param scripts: the list of scripts to run
+        """
+        checkpoint = self.meta_manager.last_checkpoint()
+        if not checkpoint:
+            return
+        name, statement, checksum = checkpoint
+        script = dict([(s.name, s) for s in scripts]).get(name)
+        if not script or not statement:
+            return
+        if checksum and script.checksum != checksum:
+            raise AppException("Can't resume script '%s' that was modified since it failed" % name)
+        self.resume_statements[name] = statement
+        if not self.mute:
+            print("Resuming script '%s' at statement %s" % (name, statement + 1))
+
+    @traced
+    def compute_checksums(self, scripts):
+        """
+        Compute checksums of given scripts using the manifest cache.
+        :param scripts: the list of scripts
+        """
+        path = self.config.get('CHECKSUM_MANIFEST') or ChecksumManifest.default_path(self.sql_dir)
+        manifest = ChecksumManifest(path, threads=self.config.get('CHECKSUM_THREADS'),
+                                    dependencies=self.script_dependencies)
+        manifest.load()
+        manifest.checksums(scripts)
+        manifest.save()
+
+    def check_checksums(self, scripts):
+        """
+        Check that passed scripts were not modified since they were run. Print
+        a warning for modified scripts, or raise an AppException if
+        configuration field CHECKSUM_STRICT is set.
+        :param scripts: the list of scripts with their checksum
+        """
+        if self.init:
+            return
+        modified = []
+        for script in scripts:
+            if script.version == Script.VERSION_DONE:
+                continue
+            checksum = self.meta_manager.script_checksum(script.name)
+            if checksum and script.checksum and checksum != script.checksum:
+                modified.append(script)
+        if not modified:
+            return
+        message = "Scripts modified since they were passed: %s" % \
+                  ', '.join([script.name for script in modified])
+        if self.config.get('CHECKSUM_STRICT'):
+            raise AppException(message)
+        if not self.mute:
+            print("WARNING: %s" % message)
+
+    @traced
     def perform_run(self, scripts):
         """
         Perform a real migration: generate the migration script, run it and
-        manage error if any.
+        manage error if any. Scripts with steps run by migration program are
+        run on their own, other scripts are run in generated migration scripts.
         :param scripts: the list of scripts to run to perform migration
         """
         print("Running %s migration scripts... " % len(scripts), end='')
         sys.stdout.flush()
+        segments = self.segment_scripts(scripts)
+        for index, (step, segment) in enumerate(segments):
+            begin = index == 0
+            end = index == len(segments) - 1
+            self.throttle.throttled = 0.0
+            self.throttle.wait()
+            if self.config.get('LOCK_GUARD'):
+                self.lock_guard(segment)
+            self.notify('scripts_started', segment)
+            start = time.time()
+            with Tracer.span('scripts', scripts=', '.join([script.name for script in segment])):
+                if step:
+                    self.perform_step(segment[0], begin=begin, end=end)
+                else:
+                    self.perform_scripts(segment, begin=begin, end=end)
+                    if self.throttle.throttled:
+                        self.meta_manager.database.run_query(
+                            self.meta_manager.script_throttled(segment[0], self.throttle.throttled))
+            self.notify('scripts_finished', segment, time.time() - start)
+        print('OK')
+        if self.config.get('RECOMPILE_INVALID', True):
+            self.recompile_invalid(scripts)
+        if self.db_config.get('statistics'):
+            self.gather_statistics(scripts)
+
+    @traced
+    def recompile_invalid(self, scripts):
+        """
+        Recompile stored objects left invalid by migration, in levels of
+        objects that don't depend on each other compiled in RECOMPILE_THREADS
+        parallel sessions. Remaining compilation errors are printed with the
+        script that created the object, as a warning or an AppException if
+        RECOMPILE_STRICT is set.
+        :param scripts: the list of passed scripts
+        """
+        objects = self.meta_manager.invalid_objects()
+        if not objects:
+            return
+        if not self.mute:
+            print("Recompiling %s invalid objects... " % len(objects), end='')
+            sys.stdout.flush()
+        threads = self.config.get('RECOMPILE_THREADS', 4)
+        for level in self.meta_manager.compile_levels(objects):
+            pool = multiprocessing.pool.ThreadPool(min(threads, len(level)))
+            try:
+                pool.map(lambda key: self.meta_manager.compile_object(*key), level)
+            finally:
+                pool.close()
+        errors = self.meta_manager.compilation_errors()
+        if not self.mute:
+            print('OK')
+        if not errors:
+            return
+        created = self.created_objects(scripts)
+        lines = []
+        for error in errors:
+            script = created.get((error['TYPE'].upper(), error['NAME'].upper()), 'unknown script')
+            lines.append("- %s %s line %s, position %s (%s): %s" %
+                         (error['TYPE'], error['NAME'], error['LINE'], error['POSITION'], script, error['TEXT']))
+        message = "Compilation errors after migration:\n%s" % '\n'.join(lines)
+        if self.config.get('RECOMPILE_STRICT'):
+            raise AppException(message)
+        print("WARNING: %s" % message)
+
+    def created_objects(self, scripts):
+        """
+        Return the scripts that create stored objects.
+        :param scripts: the list of scripts
+        :return: a dictionary of the last script creating each object, by
+                 upper case (type, name)
+        """
+        created = {}
+        for script in scripts:
+            for statement in self.split_script(script):
+                match = self.REGEXP_CREATE_OBJECT.match(statement.code())
+                if match:
+                    kind = ' '.join(match.group('type').upper().split())
+                    created[(kind, match.group('name').upper())] = script
+        return created
+
+    def touched_tables(self, scripts):
+        """
+        Return the tables modified by statements of scripts.
+        :param scripts: the list of scripts
+        :return: the list of table names, sorted ignoring case
+        """
+        tables = {}
+        for script in scripts:
+            for statement in self.split_script(script):
+                match = self.REGEXP_TOUCHED.match(statement.code())
+                if match:
+                    tables.setdefault(match.group('table').lower(), match.group('table'))
+        return [tables[name] for name in sorted(tables)]
+
+    @traced
+    def gather_statistics(self, scripts):
+        """
+        Refresh optimizer statistics of existing tables modified by scripts,
+        in STATISTICS_THREADS parallel sessions, and print time spent on each
+        table. As migration is done, errors are printed as warnings.
+        :param scripts: the list of passed scripts
+        """
+        sizes = self.meta_manager.table_sizes()
+        tables = [table for table in self.touched_tables(scripts) if table.lower() in sizes]
+        if not tables:
+            return
+        if not self.mute:
+            print("Gathering statistics of %s tables... " % len(tables), end='')
+            sys.stdout.flush()
+
+        def gather(table):
+            start = time.time()
+            try:
+                self.meta_manager.gather_statistics(table)
+                return table, time.time() - start, None
+            except (MysqlException, SqlplusException) as e:
+                return table, time.time() - start, e
+
+        pool = multiprocessing.pool.ThreadPool(min(self.config.get('STATISTICS_THREADS', 4), len(tables)))
+        try:
+            results = pool.map(gather, tables)
+        finally:
+            pool.close()
+        if not self.mute:
+            print('OK')
+        for table, elapsed, error in results:
+            if error:
+                print("WARNING: Error gathering statistics of table %s: %s" % (table, error))
+            elif not self.mute:
+                print("- %s: %.2f s" % (table, elapsed))
+
+    def ddl_tables(self, scripts):
+        """
+        Return the tables locked by DDL statements of scripts.
+        :param scripts: the list of scripts
+        :return: the list of table names, sorted ignoring case
+        """
+        tables = {}
+        for script in scripts:
+            for statement in self.split_script(script):
+                match = self.REGEXP_DDL.match(statement.code())
+                if match:
+                    tables.setdefault(match.group('table').lower(), match.group('table'))
+        return [tables[name] for name in sorted(tables)]
+
+    @traced
+    def lock_guard(self, scripts):
+        """
+        Wait before running DDL statements while other sessions have a
+        transaction open for more than LOCK_GUARD_AGE seconds holding locks on
+        their tables, as DDL would queue behind them and block all queries on
+        these tables. Checks are done with an exponential backoff starting at
+        LOCK_GUARD_INTERVAL seconds, up to one minute, and waiting time is
+        added to throttled time.
+        :param scripts: the list of scripts about to run
+        """
+        tables = self.ddl_tables(scripts)
+        if not tables:
+            return
+        timeout = self.config.get('LOCK_GUARD_TIMEOUT', 300)
+        interval = self.config.get('LOCK_GUARD_INTERVAL', 1)
+        waited = 0.0
+        sessions = self.meta_manager.blocking_sessions(tables, self.config.get('LOCK_GUARD_AGE', 10))
+        while sessions:
+            if waited >= timeout:
+                raise AppException("Sessions still holding locks on tables of script '%s' after %s seconds: %s" %
+                                   (scripts[0], int(waited), ', '.join(["%s (%s, %s s on %s)" %
+                                                                        (session, user, age, table)
+                                                                        for session, user, table, age in sessions])))
+            delay = min(interval, timeout - waited)
+            time.sleep(delay)
+            waited += delay
+            self.throttle.throttled += delay
+            interval = min(interval * 2, 60)
+            sessions = self.meta_manager.blocking_sessions(tables, self.config.get('LOCK_GUARD_AGE', 10))
+
+    def replication_lag(self):
+        """
+        Return the replication lag of replicas of the platform.
+        :return: the greatest lag of replicas in seconds or None if unknown
+        """
+        lags = [self.meta_manager.replica_lag(replica, query=self.config.get('REPLICA_LAG_QUERY'))
+                for replica in self.replicas]
+        if None in lags:
+            return None
+        return max(lags)
+
+    def segment_scripts(self, scripts):
+        """
+        Split scripts into segments of scripts run in a generated migration
+        script and scripts with steps run by migration program. When
+        replicas are checked for lag, each script is run on its own, and so
+        are scripts with DDL statements when locks are guarded.
+        :param scripts: the list of scripts to run
+        :return: a list of tuples (step, scripts) where step tells if scripts
+                 is a single script with steps
+        """
+        segments = []
+        guard = self.config.get('LOCK_GUARD')
+        for script in scripts:
+            step = self.step_script(script)
+            if step or not segments or segments[-1][0] or self.replicas or (guard and self.ddl_tables([script])):
+                segments.append((step, [script]))
+            else:
+                segments[-1][1].append(script)
+        return segments
+
+    def perform_scripts(self, scripts, begin=True, end=True):
+        """
+        Generate migration script for given scripts, run it and manage error
+        if any.
+        :param scripts: the list of scripts to run
+        :param begin: tells if the migration begins with these scripts
+        :param end: tells if the migration ends with these scripts
+        """
         _, filename = tempfile.mkstemp(suffix='.sql', prefix='db_migration_')
         if self.keep:
             print("Generated migration script in '%s'" % filename)
-        script = self.generate_migration_script(scripts, meta=True, version=self.version)
+        script = self.generate_migration_script(scripts, meta=True, version=self.version, begin=begin, end=end)
+        self.notify('migration_generated', script)
         self.write_script(script, filename)
         try:
             self.meta_manager.run_script(script=filename)
             if not self.keep:
                 os.remove(filename)
-            print('OK')
         except Exception as e:
-            if hasattr(e, 'raised') and not e.raised:
+            if self.lean:
+                script = self.lean_error(scripts, e)
+            elif hasattr(e, 'raised') and not e.raised:
                 # the error was not raised while running scripts but was detected
                 # in the output (thanks sqlplus error management)
                 self.meta_manager.scripts_error()
-            script = self.meta_manager.last_error()
+                script = self.meta_manager.last_error()
+            else:
+                script = self.meta_manager.last_error()
             print()
             print('-' * 80)
             if script:
@@ -1300,8 +4917,190 @@ version     The version to install."""
                 print("Error in file '%s':" % filename)
             print(e)
             print('-' * 80)
+            if script and self.checkpoint_script(dict([(s.name, s) for s in scripts]).get(script)):
+                print("Run migration with option --resume to restart script at failing statement")
+            self.notify('error', e, script)
             raise AppException("ERROR")
 
+    def perform_step(self, script, begin=True, end=True):
+        """
+        Run a script with steps, recording it in meta tables, and manage error
+        if any.
+        :param script: the script to run
+        :param begin: tells if the migration begins with this script
+        :param end: tells if the migration ends with this script
+        """
+        query = ''
+        if begin:
+            query += self.meta_manager.install_begin(version=self.version)
+            query += '\n'
+            query += self.meta_manager.COMMIT
+            query += '\n'
+        query += self.meta_manager.script_begin(script=script)
+        query += '\n'
+        query += self.meta_manager.COMMIT
+        self.meta_manager.database.run_query(query)
+        self.retries = 0
+        self.retry_time = 0.0
+        try:
+            self.run_steps(script)
+        except Exception as e:
+            print()
+            print('-' * 80)
+            print("Error running script '%s':" % script)
+            print(e)
+            print('-' * 80)
+            print("Run migration with option --resume to restart script at failing statement")
+            self.notify('error', e, script.name)
+            raise AppException("ERROR")
+        query = self.meta_manager.script_done(script=script)
+        query += '\n'
+        if self.throttle.throttled:
+            query += self.meta_manager.script_throttled(script, self.throttle.throttled)
+            query += '\n'
+        if self.retries:
+            query += self.meta_manager.script_retried(script, self.retries, self.retry_time)
+            query += '\n'
+        query += self.meta_manager.COMMIT
+        if end:
+            query += '\n'
+            query += self.meta_manager.install_done(success=True)
+            query += '\n'
+            query += self.meta_manager.COMMIT
+        self.meta_manager.database.run_query(query)
+
+    def run_steps(self, script):
+        """
+        Run a script with steps: statements handled by a step are run by the
+        step and others are sent to database, recording statement checkpoints,
+        with the lock timeout and session profile of the script. Errors left
+        by the script are then checked as for scripts of migration script.
+        :param script: the script to run
+        """
+        check = self.meta_manager.script_check_start()
+        directives = self.script_directives(script)
+        if self.LOAD_DIRECTIVE in directives:
+            path, table, columns, separator, newline = self.load_descriptor(script)
+            self.meta_manager.load_data(path, table, columns, separator, newline, self.config.ENCODING)
+            self.check_script(script, check)
+            return
+        chunk_size = self.config.get('CHUNK_SIZE', 1000)
+        steps = [(self.meta_manager.STEPS[name](self.meta_manager, self.throttle, chunk_size), directives[name])
+                 for name in sorted(directives) if name in self.meta_manager.STEPS]
+        profile = self.script_profile(script)
+        setup = self.meta_manager.profile_setup(profile[1]) + '\n' if profile else ''
+        timeout = self.script_lock_timeout(script)
+        if timeout:
+            setup = timeout + '\n' + setup
+        statements = self.split_script(script)
+        start = self.resume_statements.get(script.name, 0)
+        for index in range(start, len(statements)):
+            statement = statements[index]
+            for step, arguments in steps:
+                if step.accepts(statement, arguments):
+                    if index > start:
+                        self.run_statements(script, statements[:index], start, setup)
+                    step.run(script, index, statement)
+                    query, _ = self.meta_manager.format_statement(self.meta_manager.statement_checkpoint(index + 1),
+                                                                  self.meta_manager.splitter.DELIMITER)
+                    self.meta_manager.database.run_query(query)
+                    start = index + 1
+                    break
+        if start < len(statements):
+            self.run_statements(script, statements, start, setup)
+        self.check_script(script, check)
+
+    def check_script(self, script, start):
+        """
+        Check errors left by a script run by migration program, such as
+        compilation errors, raising an error if any.
+        :param script: the script
+        :param start: the date returned by script_check_start() before the
+               script or None if database has no such check
+        """
+        if start is None:
+            return
+        query = self.meta_manager.script_check_begin(start)
+        query += '\n'
+        query += self.meta_manager.script_check(script)
+        self.meta_manager.database.run_query(query)
+
+    def run_statements(self, script, statements, start, setup):
+        """
+        Run statements of a script from a given one, recording statement
+        checkpoints. Statements of a script with a retry directive that fail
+        on a transient error, such as a deadlock or a lock wait timeout, are
+        retried from the last checkpoint after a jittered exponential backoff
+        starting at RETRY_DELAY seconds, up to the number of retries of the
+        directive (RETRY_MAX by default).
+        :param script: the script
+        :param statements: the statements of the script
+        :param start: the index of the first statement to run
+        :param setup: the query that prepares the session
+        """
+        retries = self.script_retries(script)
+        delay = self.config.get('RETRY_DELAY', 1)
+        while True:
+            query = self.meta_manager.statements_script(statements, skip=start, checkpoint=True)
+            try:
+                self.meta_manager.run_statements(setup + query)
+                return
+            except (MysqlException, SqlplusException) as e:
+                if not e.transient or self.retries >= retries:
+                    raise
+            pause = delay * random.uniform(0.5, 1.5)
+            time.sleep(pause)
+            self.retries += 1
+            self.retry_time += pause
+            delay *= 2
+            # statements passed before the error were committed with their checkpoint
+            checkpoint = self.meta_manager.last_checkpoint()
+            if checkpoint and checkpoint[0] == script.name:
+                start = max(start, checkpoint[1])
+
+    def lean_error(self, scripts, error):
+        """
+        Record meta rows after a failure in lean mode: scripts passed since
+        the last checkpoint are recorded as successful and the failing script,
+        found with its marker in the output, is recorded in error. If the
+        error was detected in the output, the client went on running the
+        migration: the failing script is the one marked before the first error
+        and all scripts of the migration are recorded in error.
+        :param scripts: the list of scripts of the migration
+        :param error: the exception raised running the migration
+        :return: the name of the script that failed or None if unknown
+        """
+        output = getattr(error, 'output', None)
+        detected = hasattr(error, 'raised') and not error.raised
+        if output and detected:
+            position = output.find(str(error).split('\n')[0])
+            if position >= 0:
+                output = output[:position]
+        name = self.meta_manager.marked_script(output)
+        names = [script.name for script in scripts]
+        if detected:
+            self.meta_manager.scripts_error()
+            return name if name in names else None
+        if name not in names:
+            self.meta_manager.database.run_query(self.meta_manager.install_done(success=False) + '\n' +
+                                                 self.meta_manager.COMMIT)
+            return None
+        index = names.index(name)
+        checkpoint = self.config.get('LEAN_CHECKPOINT')
+        start = index - index % checkpoint if checkpoint else 0
+        query = ''
+        if index > start:
+            query += self.meta_manager.scripts_passed(scripts[start:index], success=True)
+            query += '\n'
+        query += self.meta_manager.scripts_passed(scripts[index:index+1], success=False)
+        query += '\n'
+        query += self.meta_manager.install_done(success=False)
+        query += '\n'
+        query += self.meta_manager.COMMIT
+        self.meta_manager.database.run_query(query)
+        return name
+
+    @traced
     def run_dry(self, scripts):
         """
         Dry run: print the list of scripts to run to perform migration.
@@ -1310,61 +5109,275 @@ version     The version to install."""
         if len(scripts):
             print("%s scripts to run:" % len(scripts))
             for script in scripts:
-                print("- %s" % script)
+                if self.count_statements:
+                    print("- %s (%s statements)" % (script, len(self.split_script(script))))
+                elif script.name in self.resume_statements:
+                    print("- %s (from statement %s)" % (script, self.resume_statements[script.name] + 1))
+                else:
+                    print("- %s" % script)
         else:
             print("No script to run")
+        for rewrite in self.rewrites:
+            print(rewrite)
+        for blocking in self.blocking_ddl:
+            print(blocking)
 
-    def generate_migration_script(self, scripts, meta=True, version=None):
+    @traced
+    def generate_migration_script(self, scripts, meta=True, version=None, begin=True, end=True):
         """
         Generate migration script from the list of scripts.
         :param scripts: the list fo scripts to run
         :param meta: tells if we should send information to database about migration
         :param version: the version we migrate to
+        :param begin: tells if the migration begins with this script
+        :param end: tells if the migration ends with this script
         :return: the migration script
         """
-        result = ''
-        result += "-- Migration base '%s' on platform '%s'\n" % (self.db_config['database'], self.platform)
-        result += "-- From version '%s' to '%s'\n\n" % (self.from_version, self.version)
-        result += self.meta_manager.script_header(self.db_config)
-        result += '\n\n'
-        if meta:
-            result += "-- Meta installation beginning\n"
-            result += self.meta_manager.install_begin(version=version)
-            result += '\n'
-            result += self.meta_manager.COMMIT
-            result += '\n\n'
+        result = []
+        result.append("-- Migration base '%s' on platform '%s'\n" % (self.db_config['database'], self.platform))
+        result.append("-- From version '%s' to '%s'\n\n" % (self.from_version, self.version))
+        result.append(self.meta_manager.script_header(self.db_config))
+        result.append('\n\n')
+        lean = meta and self.lean
+        checkpoint = self.config.get('LEAN_CHECKPOINT')
+        passed = []
+        if meta and begin:
+            result.append("-- Meta installation beginning\n")
+            result.append(self.meta_manager.install_begin(version=version))
+            result.append('\n')
+            result.append(self.meta_manager.COMMIT)
+            result.append('\n\n')
+        check = self.meta_manager.script_check_begin() if meta else None
+        cost = self.meta_manager.script_cost_begin() if meta and not lean and self.config.get('SCRIPT_COST') else None
         for script in scripts:
+            if lean:
+                result.append("-- Meta script marker\n")
+                result.append(self.meta_manager.script_marker(script=script))
+                result.append('\n\n')
+            elif meta:
+                result.append("-- Meta script beginning\n")
+                result.append(self.meta_manager.script_begin(script=script))
+                result.append('\n')
+                result.append(self.meta_manager.COMMIT)
+                result.append('\n\n')
+            if check:
+                result.append("-- Meta script check beginning\n")
+                result.append(check)
+                result.append('\n\n')
+            timeout = self.script_lock_timeout(script)
+            if timeout:
+                result.append("-- Lock timeout\n")
+                result.append(timeout)
+                result.append('\n\n')
+            if cost:
+                result.append("-- Meta script cost beginning\n")
+                result.append(cost)
+                result.append('\n\n')
+            profile = self.script_profile(script)
+            if profile:
+                result.append("-- Session profile '%s' setup\n" % profile[0])
+                result.append(self.meta_manager.profile_setup(profile[1]))
+                result.append('\n\n')
+            result.append("-- Script '%s'\n" % script)
+            result.append(self.script_source(script, meta))
             if meta:
-                result += "-- Meta script beginning\n"
-                result += self.meta_manager.script_begin(script=script)
-                result += '\n'
-                result += self.meta_manager.COMMIT
-                result += '\n\n'
-            result += "-- Script '%s'\n" % script
-            result += self.read_script(script.name)
-            if meta:
-                result += '\n'
-                result += self.meta_manager.COMMIT
-            result += '\n\n'
-            if meta:
-                result += "-- Meta script ending\n"
-                result += self.meta_manager.script_done(script=script)
-                result += '\n'
-                result += self.meta_manager.COMMIT
-                result += '\n\n'
-        if meta:
-            result += "-- Meta installation ending\n"
-            result += self.meta_manager.install_done(success=True)
-            result += '\n'
-            result += self.meta_manager.COMMIT
-            result += '\n\n'
-        result += self.meta_manager.script_footer(self.db_config)
+                result.append('\n')
+                result.append(self.meta_manager.COMMIT)
+            result.append('\n\n')
+            if profile:
+                result.append("-- Session profile '%s' restore\n" % profile[0])
+                result.append(self.meta_manager.profile_restore(profile[1]))
+                result.append('\n\n')
+            if cost:
+                result.append("-- Meta script cost\n")
+                result.append(self.meta_manager.script_cost(script=script))
+                result.append('\n\n')
+            if check:
+                result.append("-- Meta script check\n")
+                result.append(self.meta_manager.script_check(script=script))
+                result.append('\n\n')
+            if lean:
+                passed.append(script)
+                if checkpoint and len(passed) == checkpoint:
+                    result.append(self.lean_checkpoint(passed))
+                    passed = []
+            elif meta:
+                result.append("-- Meta script ending\n")
+                result.append(self.meta_manager.script_done(script=script))
+                result.append('\n')
+                result.append(self.meta_manager.COMMIT)
+                result.append('\n\n')
+        if passed:
+            result.append(self.lean_checkpoint(passed))
+        if meta and end:
+            result.append("-- Meta installation ending\n")
+            result.append(self.meta_manager.install_done(success=True))
+            result.append('\n')
+            result.append(self.meta_manager.COMMIT)
+            result.append('\n\n')
+        result.append(self.meta_manager.script_footer(self.db_config))
+        return ''.join(result)
+
+    def script_source(self, script, meta):
+        """
+        Generate the source of a script in migration script: the script itself
+        or its statements, with checkpoints or skipping statements to resume.
+        :param script: the script
+        :param meta: tells if we send information to database about migration
+        :return: the source of the script
+        """
+        if self.LOAD_DIRECTIVE in self.script_directives(script):
+            path, table, columns, separator, newline = self.load_descriptor(script)
+            query = self.meta_manager.load_query(path, table, columns, separator, newline, self.config.ENCODING)
+            return self.read_script(script.name).rstrip() + '\n' + (query or "-- Data file '%s' must be loaded in table %s" %
+                                                    (path, table))
+        skip = self.resume_statements.get(script.name, 0)
+        checkpoint = meta and self.checkpoint_script(script)
+        if not skip and not checkpoint and not script.rewritten:
+            return self.read_script(script.name)
+        statements = self.split_script(script)
+        return self.meta_manager.statements_script(statements, skip=skip, checkpoint=checkpoint)
+
+    def script_lock_timeout(self, script):
+        """
+        Return the query that sets LOCK_WAIT_TIMEOUT for a script with DDL
+        statements when locks are guarded.
+        :param script: the script
+        :return: the query or None
+        """
+        if not self.config.get('LOCK_GUARD') or not self.ddl_tables([script]):
+            return None
+        return self.meta_manager.lock_timeout(self.config.get('LOCK_WAIT_TIMEOUT', 5))
+
+    def script_retries(self, script):
+        """
+        Return the number of retries of statements of a script after transient
+        errors, given with a directive such as '-- @retry 5' or '-- @retry'
+        for RETRY_MAX retries.
+        :param script: the script
+        :return: the number of retries, 0 if script is not retryable
+        """
+        retries = self.script_directives(script).get(self.RETRY_DIRECTIVE)
+        if retries is None:
+            return 0
+        if not retries:
+            return self.config.get('RETRY_MAX', 3)
+        if not retries.isdigit():
+            raise AppException("Invalid number of retries '%s' in script '%s'" % (retries, script))
+        return int(retries)
+
+    def script_profile(self, script):
+        """
+        Return the session profile of a script, given with a directive such as
+        '-- @profile bulk' and defined in SESSION_PROFILES configuration. Data
+        loads and steps run in sessions of their own, thus their scripts can't
+        have a profile.
+        :param script: the script
+        :return: a tuple (name, settings) or None if script has no profile
+        """
+        directives = self.script_directives(script)
+        name = directives.get(self.PROFILE_DIRECTIVE)
+        if name is None:
+            return None
+        profiles = self.config.get('SESSION_PROFILES', {})
+        if name not in profiles:
+            raise AppException("Unknown session profile '%s' in script '%s'" % (name, script))
+        if self.LOAD_DIRECTIVE in directives or any(step in self.meta_manager.STEPS for step in directives):
+            raise AppException("Session profile '%s' can't apply to data load or steps of script '%s'" %
+                               (name, script))
+        if self.meta_manager.profile_setup(profiles[name]) is None:
+            raise AppException("Session profiles are not available for this database (script '%s')" % script)
+        return name, profiles[name]
+
+    def checkpoint_script(self, script):
+        """
+        Tells if statement checkpoints must be recorded for a given script.
+        :param script: the script
+        :return: True if checkpoints must be recorded
+        """
+        if not script or self.lean:
+            return False
+        return self.resume or 'checkpoint' in self.script_directives(script) or self.step_script(script)
+
+    def step_script(self, script):
+        """
+        Tells if a script has steps run by migration program, such as online
+        schema changes, or is retryable.
+        :param script: the script
+        :return: True if script has steps
+        """
+        directives = self.script_directives(script)
+        return self.LOAD_DIRECTIVE in directives or self.RETRY_DIRECTIVE in directives or \
+            any(name in self.meta_manager.STEPS for name in directives)
+
+    def load_descriptor(self, script):
+        """
+        Read the descriptor of a data load script, that holds a directive such
+        as '-- @load pet pet.csv' with the table to load and the path of the
+        data file, relative to the script. The data file is a CSV or TSV file
+        whose first line holds the names of the columns, with lines terminated
+        by LF or CRLF.
+        :param script: the script
+        :return: a tuple (path, table, columns, separator, newline)
+        """
+        arguments = self.script_directives(script)[self.LOAD_DIRECTIVE].split()
+        if len(arguments) != 2:
+            raise AppException("Load script '%s' must give table and data file, such as '-- @load pet pet.csv'" %
+                               script)
+        table, filename = arguments
+        path = self.load_path(script)
+        separator = self.LOAD_SEPARATORS.get(os.path.splitext(path)[1].lower())
+        if not separator:
+            raise AppException("Data file '%s' of script '%s' must be a .csv or .tsv file" % (filename, script))
+        if not os.path.isfile(path):
+            raise AppException("Data file '%s' of script '%s' not found" % (filename, script))
+        if self.split_script(script):
+            raise AppException("Load script '%s' must only hold directives" % script)
+        with open(path, 'rb') as handle:
+            header = handle.readline()
+        newline = '\r\n' if header.endswith('\r\n') else '\n'
+        columns = [column.strip() for column in next(csv.reader([header.rstrip('\r\n')], delimiter=separator))]
+        return path, table, columns, separator, newline
+
+    def load_path(self, script):
+        """
+        Return the path of the data file of a load script.
+        :param script: the script
+        :return: the path or None if script doesn't load a data file
+        """
+        arguments = self.script_directives(script).get(self.LOAD_DIRECTIVE, '').split()
+        if len(arguments) != 2:
+            return None
+        return os.path.join(os.path.dirname(os.path.join(self.sql_dir, script.name)), arguments[1])
+
+    def script_dependencies(self, script):
+        """
+        Return the files a script depends on, which content is part of its
+        checksum: the data file of a load script.
+        :param script: the script
+        :return: the list of paths of files
+        """
+        path = self.load_path(script)
+        return [path] if path and os.path.isfile(path) else []
+
+    def lean_checkpoint(self, scripts):
+        """
+        Generate the checkpoint recording passed scripts in lean mode.
+        :param scripts: the list of scripts passed since last checkpoint
+        :return: the checkpoint script
+        """
+        result = "-- Meta scripts checkpoint\n"
+        result += self.meta_manager.scripts_passed(scripts, success=True)
+        result += '\n'
+        result += self.meta_manager.COMMIT
+        result += '\n\n'
         return result
 
     ###########################################################################
     #                             SCRIPTS SELECTION                           #
     ###########################################################################
 
+    @traced
     def select_scripts(self, passed=False):
         """
         Generate the list of script to run to perform the migration.
@@ -1444,6 +5457,50 @@ version     The version to install."""
         else:
             return open(filename).read().strip()
 
+    def split_script(self, script):
+        """
+        Split a given script into statements, that are cached in the script.
+        :param script: the script to split
+        :return: the list of statements
+        """
+        if script.statements is None:
+            script.statements = self.meta_manager.splitter.split(self.read_script(script.name))
+        return script.statements
+
+    def script_directives(self, script):
+        """
+        Parse directives in the header of a script, that are comments such as
+        '-- @checkpoint' or '-- @profile bulk' at the beginning of the script,
+        or the kind of script in its file name, such as 'all.batch.sql'.
+        Directives are cached in the script.
+        :param script: the script
+        :return: directives as a dictionary of their arguments
+        """
+        if script.directives is None:
+            script.directives = {}
+            filename = os.path.join(self.sql_dir, script.name)
+            if self.config.ENCODING:
+                handle = codecs.open(filename, mode='r', encoding=self.config.ENCODING, errors='strict')
+            else:
+                handle = open(filename)
+            try:
+                # only the header of the script is read
+                for line in handle:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    if not line.startswith('--'):
+                        break
+                    match = self.REGEXP_DIRECTIVE.match(line)
+                    if match:
+                        script.directives[match.group(1).lower()] = match.group(2).strip()
+            finally:
+                handle.close()
+            # kind of script in file name, such as 'all.batch.sql'
+            if script.kind:
+                script.directives.setdefault(script.kind, '')
+        return script.directives
+
     def write_script(self, script, filename):
         """
         Write a given script, managing encoding.
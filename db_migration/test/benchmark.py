@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# encoding: UTF-8
+
+from __future__ import print_function
+import os
+import re
+import sys
+import json
+import time
+import stat
+import getopt
+import random
+import shutil
+import tempfile
+import datetime
+import platform
+
+from StringIO import StringIO
+
+from db_migration.db_migration import DBMigration, AppException, ChecksumManifest, Script, \
+    MysqlCommando, SqlplusResultParser
+
+
+class ScriptTree(object):
+    """
+    Synthetic SQL directory with a configuration file and scripts spread over
+    versions and platforms. Scripts are generated with a fixed random seed so
+    that trees of a given size are the same from a run to another.
+    """
+
+    PLATFORMS = ('itg', 'prp', 'prod')
+    PLATFORM = 'itg'
+    # ratio of scripts for all platforms
+    ALL_RATIO = 0.7
+    # ratio of scripts for benchmark platform recorded as passed
+    PASSED_RATIO = 0.5
+    TABLES = 500
+    CONFIGURATION = """# encoding: UTF-8
+
+PLATFORMS = %(platforms)r
+CRITICAL_PLATFORMS = []
+ENCODING = 'utf8'
+SQL_DIR = '.'
+DATABASE = %(database)r
+CONFIGURATION = dict((platform, {
+    'hostname': 'localhost',
+    'database': 'bench',
+    'username': 'bench',
+    'password': 'bench',
+}) for platform in PLATFORMS)
+"""
+    SCRIPTS = {
+        'mysql': """-- Synthetic script %(name)s
+CREATE TABLE IF NOT EXISTS t_%(table)s (
+  id integer NOT NULL AUTO_INCREMENT,
+  name varchar(255) NOT NULL,
+  PRIMARY KEY (id)
+);
+INSERT INTO t_%(table)s (name) VALUES ('%(name)s');
+ALTER TABLE t_%(table)s ADD COLUMN c_%(index)s integer;
+UPDATE t_%(table)s SET c_%(index)s = id WHERE name = '%(name)s';
+""",
+        'oracle': """-- Synthetic script %(name)s
+CREATE TABLE T_%(table)s_%(index)s (
+  ID NUMBER NOT NULL,
+  NAME VARCHAR2(255) NOT NULL,
+  CONSTRAINT PK_%(table)s_%(index)s PRIMARY KEY (ID)
+);
+INSERT INTO T_%(table)s_%(index)s (ID, NAME) VALUES (1, '%(name)s');
+ALTER TABLE T_%(table)s_%(index)s ADD (C_%(index)s NUMBER);
+UPDATE T_%(table)s_%(index)s SET C_%(index)s = ID WHERE NAME = '%(name)s';
+""",
+    }
+
+    def __init__(self, directory, size, database, versions=50):
+        """
+        Constructor.
+        :param directory: the directory of the tree
+        :param size: the number of scripts
+        :param database: 'mysql' or 'oracle'
+        :param versions: the number of versions
+        """
+        self.directory = directory
+        self.size = size
+        self.database = database
+        self.versions = versions
+        self.configuration = os.path.join(directory, 'db_configuration.py')
+        self.version = '1.%d' % versions
+        self.passed = []
+
+    def generate(self):
+        """
+        Write configuration and scripts of the tree, and select scripts of
+        benchmark platform recorded as passed, with their checksum.
+        """
+        generator = random.Random(self.size)
+        with open(self.configuration, 'w') as handle:
+            handle.write(self.CONFIGURATION % {'platforms': list(self.PLATFORMS), 'database': self.database})
+        mine = []
+        for index in range(self.size):
+            version = '1.%d' % (index * self.versions // self.size + 1)
+            if generator.random() < self.ALL_RATIO:
+                target = Script.PLATFORM_ALL
+            else:
+                target = generator.choice(self.PLATFORMS)
+            path = os.path.join(self.directory, version, '%s-%06d.sql' % (target, index))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as handle:
+                handle.write(self.SCRIPTS[self.database] % {'name': os.path.basename(path),
+                                                            'table': index % self.TABLES,
+                                                            'index': index})
+            if target in (Script.PLATFORM_ALL, self.PLATFORM):
+                mine.append(Script(path))
+        mine.sort(key=lambda s: s.sort_key())
+        self.passed = [(script.name, ChecksumManifest.compute(script.path))
+                       for script in mine[:int(len(mine) * self.PASSED_RATIO)]]
+
+
+class FakeClient(object):
+    """
+    Stand-in mysql and sqlplus clients, installed as executables that run this
+    module with the root of the project in PYTHONPATH. They answer the query
+    listing passed scripts with scripts of a file, in batch (mysql) or HTML
+    (sqlplus) format, print nothing for other queries and scripts, and wait
+    DELAY seconds per statement to simulate a database server.
+    """
+
+    CLIENTS = ('mysql', 'sqlplus')
+    ENV_DELAY = 'DB_MIGRATION_BENCH_DELAY'
+    ENV_PASSED = 'DB_MIGRATION_BENCH_PASSED'
+    EXECUTABLE = """#!/bin/sh
+exec %(python)s -m db_migration.test.benchmark client %(client)s "$@"
+"""
+    REGEXP_LIST = re.compile(r'\bAS\s+SCRIPT\b', re.IGNORECASE)
+    FIELDS = ('SCRIPT', 'CHECKSUM')
+
+    @staticmethod
+    def install(directory, delay, passed):
+        """
+        Install stand-in clients in a directory and put it first in PATH, and
+        the root of the project first in PYTHONPATH.
+        :param directory: the directory of executables
+        :param delay: the time to wait per statement, in seconds
+        :param passed: the list of passed scripts as tuples (name, checksum)
+        """
+        root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+        for client in FakeClient.CLIENTS:
+            path = os.path.join(directory, client)
+            with open(path, 'w') as handle:
+                handle.write(FakeClient.EXECUTABLE % {'python': sys.executable, 'client': client})
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        listing = os.path.join(directory, 'passed.json')
+        with open(listing, 'w') as handle:
+            json.dump(passed, handle)
+        os.environ[FakeClient.ENV_DELAY] = str(delay)
+        os.environ[FakeClient.ENV_PASSED] = listing
+        os.environ['PATH'] = directory + os.pathsep + os.environ.get('PATH', '')
+        os.environ['PYTHONPATH'] = root + os.pathsep + os.environ.get('PYTHONPATH', '')
+
+    @staticmethod
+    def run(client, arguments):
+        """
+        Run a stand-in client with its command line arguments.
+        :param client: 'mysql' or 'sqlplus'
+        :param arguments: the command line arguments of the client
+        """
+        if client == 'mysql':
+            query = arguments[arguments.index('-e') + 1] if '-e' in arguments else sys.stdin.read()
+        else:
+            query = sys.stdin.read()
+            script = re.search(r'^@(.*)$', query, re.MULTILINE)
+            if script:
+                with open(script.group(1)) as handle:
+                    query = handle.read()
+        time.sleep(float(os.environ.get(FakeClient.ENV_DELAY, 0)) * query.count(';'))
+        if FakeClient.REGEXP_LIST.search(query):
+            with open(os.environ[FakeClient.ENV_PASSED]) as handle:
+                rows = [[name, checksum or 'NULL'] for name, checksum in json.load(handle)]
+            if client == 'mysql':
+                sys.stdout.write(FakeClient.batch_output(FakeClient.FIELDS, rows))
+            else:
+                sys.stdout.write(FakeClient.html_output(FakeClient.FIELDS, rows))
+
+    @staticmethod
+    def batch_output(fields, rows):
+        """
+        Format a result as mysql in batch mode.
+        :param fields: the names of the columns
+        :param rows: the rows as lists of values
+        :return: the output
+        """
+        return ''.join(['\t'.join([str(value) for value in row]) + '\n' for row in [fields] + list(rows)])
+
+    @staticmethod
+    def html_output(fields, rows):
+        """
+        Format a result as sqlplus with HTML markup.
+        :param fields: the names of the columns
+        :param rows: the rows as lists of values
+        :return: the output
+        """
+        output = ["<p>\n<table border='1' width='90%' align='center' summary='Script output'>\n<tr>\n"]
+        output.extend(['<th scope="col">\n%s\n</th>\n' % field for field in fields])
+        output.append('</tr>\n')
+        for row in rows:
+            output.append('<tr>\n' + ''.join(['<td>\n%s\n</td>\n' % value for value in row]) + '</tr>\n')
+        output.append('</table>\n<p>\n')
+        return ''.join(output)
+
+
+class Benchmark(object):
+    """
+    Time selection of scripts, generation of migration scripts, parsing of
+    client results and end-to-end runs with stand-in clients on synthetic
+    trees, and save results in a JSON file.
+    """
+
+    BENCHMARKS = ('select_scripts', 'generate_migration_script', 'parse_result', 'run')
+    DATABASES = ('mysql', 'oracle')
+    SIZES = (1000, 10000, 100000)
+    HELP = """python -m db_migration.test.benchmark [-h] [-s sizes] [-b benchmarks]
+            [-r repeat] [-d delay] [-o output] [-c compare]
+-h          Print this help page.
+-s sizes    Comma separated numbers of scripts of trees (default to
+            1000,10000,100000).
+-b names    Comma separated benchmarks to run among select_scripts,
+            generate_migration_script, parse_result and run (default to all).
+-r repeat   Number of times each benchmark is run (default to 3).
+-d delay    Time in seconds stand-in clients wait per statement (default to 0).
+-o output   JSON file where results are saved (default to benchmark.json).
+-c compare  JSON file of previous results to compare with."""
+
+    def __init__(self, sizes=SIZES, benchmarks=BENCHMARKS, repeat=3, delay=0.0,
+                 output='benchmark.json', compare=None):
+        """
+        Constructor.
+        :param sizes: the numbers of scripts of trees
+        :param benchmarks: the names of benchmarks to run
+        :param repeat: the number of times each benchmark is run
+        :param delay: the time stand-in clients wait per statement
+        :param output: the JSON file of results
+        :param compare: the JSON file of previous results, if any
+        """
+        for name in benchmarks:
+            if name not in self.BENCHMARKS:
+                raise AppException("Benchmark must be one of %s" % ', '.join(self.BENCHMARKS))
+        self.sizes = sizes
+        self.benchmarks = benchmarks
+        self.repeat = repeat
+        self.delay = delay
+        self.output = output
+        self.compare = compare
+        self.results = []
+
+    @staticmethod
+    def run_command_line():
+        """
+        Called while running from command line.
+        """
+        if len(sys.argv) > 2 and sys.argv[1] == 'client':
+            FakeClient.run(sys.argv[2], sys.argv[3:])
+            return
+        try:
+            Benchmark.parse_command_line(sys.argv[1:]).run()
+        except AppException as e:
+            print(str(e))
+            sys.exit(1)
+
+    @staticmethod
+    def parse_command_line(arguments):
+        """
+        Parse options on command line.
+        :param arguments: the command line arguments
+        :return: built Benchmark object, ready to run
+        """
+        options = {}
+        try:
+            opts, args = getopt.getopt(arguments, "hs:b:r:d:o:c:")
+            for opt, arg in opts:
+                if opt == '-h':
+                    print(Benchmark.HELP)
+                    sys.exit(0)
+                elif opt == '-s':
+                    options['sizes'] = [int(size) for size in arg.split(',')]
+                elif opt == '-b':
+                    options['benchmarks'] = arg.split(',')
+                elif opt == '-r':
+                    options['repeat'] = int(arg)
+                elif opt == '-d':
+                    options['delay'] = float(arg)
+                elif opt == '-o':
+                    options['output'] = arg
+                elif opt == '-c':
+                    options['compare'] = arg
+        except (getopt.GetoptError, ValueError) as e:
+            raise AppException("%s\n%s" % (e, Benchmark.HELP))
+        if args:
+            raise AppException("Too many arguments on command line:\n%s" % Benchmark.HELP)
+        return Benchmark(**options)
+
+    def run(self):
+        """
+        Run benchmarks on trees of each size and database, save results and
+        compare them with previous ones if asked.
+        """
+        for size in self.sizes:
+            for database in self.DATABASES:
+                directory = tempfile.mkdtemp(prefix='db_migration_bench_')
+                try:
+                    tree = ScriptTree(os.path.join(directory, 'sql'), size, database)
+                    os.makedirs(tree.directory)
+                    start = time.time()
+                    tree.generate()
+                    print("Generated %s scripts for %s in %.3f s" % (size, database, time.time() - start))
+                    bin_dir = os.path.join(directory, 'bin')
+                    os.makedirs(bin_dir)
+                    environment = dict(os.environ)
+                    FakeClient.install(bin_dir, self.delay, tree.passed)
+                    try:
+                        for name in self.benchmarks:
+                            self.measure(name, tree)
+                    finally:
+                        os.environ.clear()
+                        os.environ.update(environment)
+                finally:
+                    shutil.rmtree(directory)
+        self.save()
+        if self.compare:
+            self.print_comparison()
+
+    def measure(self, name, tree):
+        """
+        Run a benchmark repeat times on a tree and record its timings.
+        :param name: the name of the benchmark
+        :param tree: the ScriptTree
+        """
+        function = getattr(self, 'bench_%s' % name)
+        times = []
+        for _ in range(self.repeat):
+            times.append(function(tree))
+        result = {
+            'benchmark': name,
+            'database': tree.database,
+            'scripts': tree.size,
+            'times': times,
+            'min': min(times),
+            'median': sorted(times)[len(times) // 2],
+        }
+        self.results.append(result)
+        print("%-26s %-7s %7d scripts: min %.3f s, median %.3f s" %
+              (name, tree.database, tree.size, result['min'], result['median']))
+
+    @staticmethod
+    def migration(tree, options):
+        """
+        Build a migration on a tree.
+        :param tree: the ScriptTree
+        :param options: the command line options, without configuration,
+               SQL directory, platform and version
+        :return: the DBMigration
+        """
+        return DBMigration.parse_command_line(['-c', tree.configuration, '-s', tree.directory] + options +
+                                              [tree.PLATFORM, tree.version])
+
+    def bench_select_scripts(self, tree):
+        """
+        Time selection of scripts of a migration from the beginning.
+        :param tree: the ScriptTree
+        :return: the time in seconds
+        """
+        migration = self.migration(tree, ['-m', 'init'])
+        start = time.time()
+        migration.select_scripts(passed=True)
+        return time.time() - start
+
+    def bench_generate_migration_script(self, tree):
+        """
+        Time generation of the migration script with meta queries of scripts
+        of a migration from the beginning.
+        :param tree: the ScriptTree
+        :return: the time in seconds
+        """
+        migration = self.migration(tree, ['-m', 'init'])
+        scripts = migration.select_scripts(passed=True)
+        start = time.time()
+        migration.generate_migration_script(scripts, meta=True, version=tree.version)
+        return time.time() - start
+
+    def bench_parse_result(self, tree):
+        """
+        Time parsing of client outputs listing all scripts of the tree.
+        :param tree: the ScriptTree
+        :return: the time in seconds
+        """
+        rows = [['%s/all-%06d.sql' % (tree.version, index), '%064x' % index] for index in range(tree.size)]
+        if tree.database == 'mysql':
+            output = FakeClient.batch_output(FakeClient.FIELDS, rows)
+            start = time.time()
+            MysqlCommando(hostname='localhost', database='bench', username='bench', password='bench').\
+                _output_to_result(output, cast=True) # pylint: disable=W0212
+        else:
+            output = FakeClient.html_output(FakeClient.FIELDS, rows)
+            start = time.time()
+            SqlplusResultParser.parse(output, cast=True, check_errors=True)
+        return time.time() - start
+
+    def bench_run(self, tree):
+        """
+        Time a migration run with stand-in clients, half of the scripts of
+        the platform being already passed.
+        :param tree: the ScriptTree
+        :return: the time in seconds
+        """
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            start = time.time()
+            self.migration(tree, ['-u']).run()
+            return time.time() - start
+        finally:
+            sys.stdout = stdout
+
+    def save(self):
+        """
+        Save results in output JSON file.
+        """
+        report = {
+            'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': self.repeat,
+            'delay': self.delay,
+            'results': self.results,
+        }
+        with open(self.output, 'w') as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        print("Results saved in '%s'" % self.output)
+
+    def print_comparison(self):
+        """
+        Print ratio of minimum times with previous results.
+        """
+        with open(self.compare) as handle:
+            previous = dict(((r['benchmark'], r['database'], r['scripts']), r)
+                            for r in json.load(handle)['results'])
+        print("Comparison with '%s' (minimum time ratio):" % self.compare)
+        for result in self.results:
+            key = result['benchmark'], result['database'], result['scripts']
+            if key in previous and previous[key]['min']:
+                print("%-26s %-7s %7d scripts: %.2f" % (key + (result['min'] / previous[key]['min'],)))
+
+
+if __name__ == '__main__':
+    Benchmark.run_command_line()
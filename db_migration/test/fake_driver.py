@@ -0,0 +1,534 @@
+#!/usr/bin/env python
+# encoding: UTF-8
+
+import os
+import re
+import codecs
+
+from db_migration.db_migration import Tracer, MysqlCommando, MysqlException, MysqlDatabaseAdapter, \
+    SqlplusCommando, SqlplusException, SqlplusDatabaseAdapter, SqlplusResultParser, OnlineSchemaChange
+from db_migration.test.benchmark import FakeClient
+
+
+class FakeDatabase(object):
+    """
+    In-memory database of meta tables, run by fake drivers in place of mysql
+    and sqlplus clients. Meta statements issued by database adapters are
+    recognized with their templates and update installs and scripts of the
+    database; other statements are recorded, with the script they belong to.
+    Tables of the database all have columns 'id', primary key, and 'name'.
+    """
+
+    def __init__(self):
+        """
+        Constructor.
+        """
+        # meta rows as dictionaries, statements run as tuples (script,
+        # statement) and SQL*Loader control files loaded
+        self.installs = []
+        self.scripts = []
+        self.statements = []
+        self.loads = []
+        self.failures = []
+        self.current = None
+        # tuples (size, rows) of tables by name, as 'schema.table' for
+        # tables of other schemas than the current one
+        self.tables = {}
+        # progress rows of steps and tables of triggers by name
+        self.progress = []
+        self.triggers = {}
+
+    def install(self, migration):
+        """
+        Replace driver of a migration with a fake driver on this database.
+        :param migration: the DBMigration
+        :return: the fake driver
+        """
+        if migration.config.DATABASE == 'mysql':
+            driver = FakeMysqlCommando(self, encoding=migration.config.ENCODING)
+        else:
+            driver = FakeSqlplusCommando(self, encoding=migration.config.ENCODING)
+        migration.meta_manager.database = driver
+        return driver
+
+    def fail(self, regexp, message, raised=True, times=None):
+        """
+        Make statements matching a regular expression fail.
+        :param regexp: the regular expression searched in statements
+        :param message: the error message
+        :param raised: tells if client stops on error, else message is
+               printed in output and client goes on
+        :param times: the number of times statements fail, None for always
+        """
+        self.failures.append((re.compile(regexp, re.IGNORECASE), message, raised, times))
+
+    def passed_scripts(self):
+        """
+        Return names of scripts successfully passed.
+        :return: the list of script names
+        """
+        return [script['filename'] for script in self.scripts if script['success'] == 1]
+
+    def script_statements(self, name):
+        """
+        Return statements run in a script.
+        :param name: the name of the script
+        :return: the list of statements
+        """
+        return [statement for script, statement in self.statements if script == name]
+
+    def last_install(self):
+        """
+        Return the last install.
+        :return: the install as a dictionary or None
+        """
+        return self.installs[-1] if self.installs else None
+
+    def current_scripts(self):
+        """
+        Return scripts of the last install.
+        :return: the list of scripts as dictionaries
+        """
+        install = self.last_install()
+        return [script for script in self.scripts if install and script['install_id'] == install['id']]
+
+    # meta statements, called with values of template parameters
+
+    def drop_meta(self):
+        self.installs = []
+        self.scripts = []
+
+    def install_begin(self, version):
+        self.installs.append({'id': len(self.installs) + 1, 'version': version, 'success': 0})
+
+    def install_done(self, success):
+        self.last_install()['success'] = success
+
+    def add_script(self, script, checksum, success):
+        install = self.last_install()
+        self.scripts.append({'id': len(self.scripts) + 1, 'filename': script, 'success': success,
+                             'install_id': install['id'] if install else None, 'checksum': checksum,
+                             'last_statement': None, 'throttled': None, 'retries': None, 'retry_time': None})
+
+    def script_begin(self, script, checksum):
+        self.add_script(script, checksum, 0)
+        self.current = script
+
+    def script_done(self):
+        self.scripts[-1]['success'] = 1
+        self.current = None
+
+    def scripts_error(self):
+        for script in self.current_scripts():
+            script['success'] = 0
+
+    def scripts_passed(self, values):
+        for value in values:
+            self.add_script(**value)
+
+    def script_checkpoint(self, statement):
+        self.scripts[-1]['last_statement'] = statement
+
+    def script_update(self, script, **values):
+        for line in self.current_scripts():
+            if line['filename'] == script:
+                line.update(values)
+
+    def script_marker(self, script=None):
+        if script is not None:
+            self.current = script
+            return None
+        return [{'db_migration_script': self.current}]
+
+    def check_start(self):
+        return [{'START_DATE': '2000-01-01 00:00:00'}]
+
+    def table_sizes(self, schemas=None):
+        if schemas is None:
+            names = [name for name in self.tables if '.' not in name]
+        else:
+            schemas = re.findall(r'\w+', schemas)
+            names = [name for name in self.tables if '.' in name and name.split('.')[0] in schemas]
+        return [{'NAME': name, 'SIZE': self.tables[name][0], 'ROWS': self.tables[name][1]} for name in names]
+
+    def progress_begin(self, script, statement, step, target):
+        self.progress.append({'id': len(self.progress) + 1, 'filename': script, 'statement': statement,
+                              'step': step, 'target': target, 'position': None, 'status': 'running'})
+
+    def progress_find(self, script, statement):
+        rows = [row for row in self.progress if row['filename'] == script and row['statement'] == statement
+                and row['status'] != 'done']
+        return [{'ID': rows[-1]['id'], 'POSITION': rows[-1]['position'], 'STATUS': rows[-1]['status']}] \
+            if rows else None
+
+    def primary_key(self, table): # pylint: disable=W0613
+        return [{'NAME': 'id'}]
+
+    def table_columns(self, table): # pylint: disable=W0613
+        return [{'NAME': 'id'}, {'NAME': 'name'}]
+
+    def foreign_keys(self, table): # pylint: disable=W0613
+        return [{'NB': 0}]
+
+    def table_triggers(self, table):
+        return [{'NB': len([name for name in self.triggers if self.triggers[name] == table])}]
+
+    def list_scripts(self):
+        return [{'SCRIPT': script['filename'], 'CHECKSUM': script['checksum']}
+                for script in self.scripts if script['success'] == 1]
+
+    def last_error(self):
+        errors = [script for script in self.scripts if script['success'] == 0]
+        return [{'SCRIPT': errors[-1]['filename']}] if errors else None
+
+    def last_checkpoint(self):
+        install = self.last_install()
+        errors = [script for script in self.current_scripts() if script['success'] == 0]
+        if not install or install['success'] or not errors:
+            return None
+        return [{'SCRIPT': errors[-1]['filename'], 'STATEMENT': errors[-1]['last_statement'],
+                 'CHECKSUM': errors[-1]['checksum']}]
+
+
+class FakeDriver(object):
+    """
+    Mixin of fake drivers that run queries and scripts on a FakeDatabase.
+    Meta statements are matched against templates of the database adapter,
+    split into statements with the adapter splitter and with whitespaces
+    normalized. Drivers format result rows as printed by their client with
+    format_output() and cast values with cast_value().
+    """
+
+    ADAPTER = None
+    CLIENT = None
+    # NULL values in client output
+    NULL = None
+    # templates of adapter, method of database and the template parameter
+    # that is a list of values with its value template
+    TEMPLATES = (
+        ('SQL_DROP_META', 'drop_meta', None),
+        ('SQL_CREATE_META', None, None),
+        ('SQL_ADD_COLUMN', None, None),
+        ('SQL_LIST_SCRIPTS', 'list_scripts', None),
+        ('SQL_INSTALL_BEGIN', 'install_begin', None),
+        ('SQL_INSTALL_DONE', 'install_done', None),
+        ('SQL_SCRIPT_BEGIN', 'script_begin', None),
+        ('SQL_SCRIPT_DONE', 'script_done', None),
+        ('SQL_SCRIPTS_ERROR', 'scripts_error', None),
+        ('SQL_LAST_ERROR', 'last_error', None),
+        ('SQL_SCRIPTS_PASSED', 'scripts_passed', ('values', 'SQL_SCRIPTS_PASSED_VALUE')),
+        ('SQL_SCRIPT_MARKER', 'script_marker', None),
+        ('SQL_SCRIPT_CHECKPOINT', 'script_checkpoint', None),
+        ('SQL_LAST_CHECKPOINT', 'last_checkpoint', None),
+        ('SQL_SCRIPT_THROTTLED', 'script_update', None),
+        ('SQL_SCRIPT_RETRIED', 'script_update', None),
+        ('SQL_SCRIPT_CHECK_START', 'check_start', None),
+        ('SQL_TABLE_SIZES', 'table_sizes', None),
+        ('SQL_SCHEMA_TABLE_SIZES', 'table_sizes', None),
+    )
+    # classes of steps which templates are also recognized
+    STEPS = ()
+    REGEXP_PARAMETER = re.compile(r"('?)%\((\w+)\)s\1")
+    REGEXP_TRIGGER = re.compile(r'^(?:CREATE TRIGGER `?(\w+)`? .*? ON `?(\w+)`?|DROP TRIGGER (?:IF EXISTS )?`?(\w+)`?)',
+                                re.IGNORECASE)
+    REGEXP_PROMPT = re.compile(r'^pro(?:mpt)?\b\s*(.*)$', re.IGNORECASE)
+    PATTERNS = {}
+
+    def __init__(self, database):
+        """
+        Constructor.
+        :param database: the FakeDatabase
+        """
+        self.fake = database
+        self.splitter = self.ADAPTER.SPLITTER()
+        if self.__class__ not in FakeDriver.PATTERNS:
+            FakeDriver.PATTERNS[self.__class__] = self.compile_templates()
+        self.patterns = FakeDriver.PATTERNS[self.__class__]
+
+    def compile_templates(self):
+        """
+        Compile templates of adapter into regular expressions.
+        :return: a list of tuples (regexp, method, (parameter, value regexp))
+        """
+        patterns = []
+        for name, method, values in self.TEMPLATES:
+            template = getattr(self.ADAPTER, name, None)
+            for step in self.STEPS:
+                template = template or getattr(step, name, None)
+            if not template:
+                continue
+            if values:
+                values = values[0], self.compile_template(getattr(self.ADAPTER, values[1]), anchored=False)
+            for statement in self.splitter.split(template):
+                patterns.append((self.compile_template(statement.code()), method, values))
+        return patterns
+
+    def compile_template(self, template, anchored=True):
+        """
+        Compile a template into a regular expression with a named group for
+        each parameter, that includes quotes of string parameters.
+        :param template: the template
+        :param anchored: tells if regular expression matches the whole text
+        :return: the compiled regular expression
+        """
+        parts = self.REGEXP_PARAMETER.split(self.normalize(template))
+        pattern = re.escape(parts[0].replace('%%', '%'))
+        names = set()
+        for index in range(1, len(parts), 3):
+            quote, name, literal = parts[index:index+3]
+            if name in names:
+                pattern += '(?P=%s)' % name
+            else:
+                names.add(name)
+                pattern += "(?P<%s>'(?:[^']|'')*')" % name if quote else '(?P<%s>.*?)' % name
+            pattern += re.escape(literal.replace('%%', '%'))
+        return re.compile('^%s$' % pattern if anchored else pattern, re.DOTALL)
+
+    @staticmethod
+    def normalize(text):
+        """
+        Normalize whitespaces of a statement.
+        :param text: the text of the statement
+        :return: the normalized text
+        """
+        return ' '.join(text.split())
+
+    @staticmethod
+    def parse_value(value):
+        """
+        Parse an SQL value of a meta statement.
+        :param value: the value as SQL text
+        :return: the value
+        """
+        value = value.strip()
+        if value.upper() == 'NULL':
+            return None
+        if value.startswith("'") and value.endswith("'"):
+            return value[1:-1].replace("''", "'")
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+        return value
+
+    def execute(self, source, error):
+        """
+        Run statements of a source on the fake database.
+        :param source: the source of queries or script
+        :param error: the function that builds driver exception with a
+               message and the output
+        :return: a tuple (rows, output)
+        """
+        rows = []
+        output = ''
+        for statement in self.splitter.split(source):
+            code = statement.code()
+            if not code:
+                continue
+            prompt = self.REGEXP_PROMPT.match(code) if statement.delimiter == '' else None
+            if prompt:
+                output += prompt.group(1) + '\n'
+                continue
+            failure = self.failure(code)
+            if failure:
+                message, raised = failure
+                if raised:
+                    raise error(message, output)
+                output += message + '\n'
+                continue
+            result = self.execute_statement(code)
+            if result is False:
+                self.fake.statements.append((self.fake.current, code))
+            elif result:
+                rows = [dict((key, self.format_value(value)) for key, value in row.items()) for row in result]
+                output += self.format_output(rows)
+        return rows, output
+
+    def failure(self, code):
+        """
+        Find the failure of a statement.
+        :param code: the code of the statement
+        :return: a tuple (message, raised) or None if statement doesn't fail
+        """
+        for index, (regexp, message, raised, times) in enumerate(self.fake.failures):
+            if times != 0 and regexp.search(code):
+                if times is not None:
+                    self.fake.failures[index] = (regexp, message, raised, times - 1)
+                return message, raised
+        return None
+
+    def execute_statement(self, code):
+        """
+        Run a meta statement on the fake database.
+        :param code: the code of the statement
+        :return: the result rows of the statement, None if it has no result
+                 and False if it is not a meta statement
+        """
+        text = self.normalize(code)
+        for regexp, method, values in self.patterns:
+            match = regexp.match(text)
+            if not match:
+                continue
+            if not method:
+                return None
+            parameters = dict((key, self.parse_value(value)) for key, value in match.groupdict().items())
+            if values:
+                name, value = values
+                parameters[name] = [dict((key, self.parse_value(v)) for key, v in m.groupdict().items())
+                                    for m in value.finditer(match.group(name))]
+            return getattr(self.fake, method)(**parameters)
+        match = self.REGEXP_TRIGGER.match(text)
+        if match and match.group(1):
+            self.fake.triggers[match.group(1)] = match.group(2)
+        elif match:
+            self.fake.triggers.pop(match.group(3), None)
+        return False
+
+    def format_value(self, value):
+        """
+        Format a value as printed by client.
+        :param value: the value
+        :return: the value as a string
+        """
+        return self.NULL if value is None else unicode(value)
+
+    def run(self, source, cast, error, check=None, **arguments):
+        """
+        Run a source, recording a span of client call.
+        :param source: the source of queries or script
+        :param cast: tells if we should cast result
+        :param error: the function that builds driver exception
+        :param check: the function that checks output for errors, if any
+        :param arguments: the arguments of the span
+        :return: result query as a tuple of dictionaries or None
+        """
+        with Tracer.span(self.CLIENT, size=len(source), **arguments):
+            rows, output = self.execute(source, error)
+        if check:
+            check(output)
+        if not rows:
+            return None
+        if cast:
+            rows = [dict((key, self.cast_value(value)) for key, value in row.items()) for row in rows]
+        return tuple(rows)
+
+    def read_script(self, script):
+        """
+        Read a script file.
+        :param script: the path of the script
+        :return: the source of the script
+        """
+        if self.encoding:
+            with codecs.open(script, encoding=self.encoding) as handle:
+                return handle.read()
+        with open(script) as handle:
+            return handle.read()
+
+
+class FakeMysqlCommando(FakeDriver, MysqlCommando):
+    """
+    Fake MySQL driver running queries and scripts on a FakeDatabase.
+    """
+
+    ADAPTER = MysqlDatabaseAdapter
+    CLIENT = 'mysql'
+    NULL = 'NULL'
+    STEPS = (OnlineSchemaChange,)
+    TEMPLATES = FakeDriver.TEMPLATES + (
+        ('SQL_PROGRESS_BEGIN', 'progress_begin', None),
+        ('SQL_PROGRESS_FIND', 'progress_find', None),
+        ('SQL_PRIMARY_KEY', 'primary_key', None),
+        ('SQL_COLUMNS', 'table_columns', None),
+        ('SQL_FOREIGN_KEYS', 'foreign_keys', None),
+        ('SQL_TABLE_TRIGGERS', 'table_triggers', None),
+    )
+
+    def __init__(self, database, encoding=None, cast=True):
+        """
+        Constructor.
+        :param database: the FakeDatabase
+        :param encoding: database encoding
+        :param cast: tells if we should cast result
+        """
+        FakeDriver.__init__(self, database)
+        MysqlCommando.__init__(self, hostname='fake', database='fake', username='fake', password='fake',
+                               encoding=encoding, cast=cast)
+
+    def run_query(self, query, parameters=None, cast=None,
+                  last_insert_id=False, local_infile=False): # pylint: disable=W0613
+        if last_insert_id:
+            raise MysqlException('Last insert id is not available with fake driver')
+        query = self._process_parameters(query, parameters)
+        return self.run(query, self.cast if cast is None else cast, self.error, query=query)
+
+    def run_script(self, script, cast=None):
+        return self.run(self.read_script(script), self.cast if cast is None else cast, self.error, script=script)
+
+    @staticmethod
+    def error(message, output):
+        if not MysqlException.REGEXP_CODE.search(message):
+            message = "ERROR 1064 (42000) at line 1: %s" % message
+        return MysqlException(message, output=output)
+
+    def format_output(self, rows):
+        fields = sorted(rows[0])
+        return FakeClient.batch_output(fields, [[row[field] for field in fields] for row in rows])
+
+    @staticmethod
+    def cast_value(value):
+        return MysqlCommando._cast(value) # pylint: disable=W0212
+
+
+class FakeSqlplusCommando(FakeDriver, SqlplusCommando):
+    """
+    Fake Oracle driver running queries and scripts on a FakeDatabase.
+    """
+
+    ADAPTER = SqlplusDatabaseAdapter
+    CLIENT = 'sqlplus'
+    NULL = ''
+
+    def __init__(self, database, encoding=None, cast=True):
+        """
+        Constructor.
+        :param database: the FakeDatabase
+        :param encoding: database encoding
+        :param cast: tells if we should cast result
+        """
+        FakeDriver.__init__(self, database)
+        SqlplusCommando.__init__(self, hostname='fake', database='fake', username='fake', password='fake',
+                                 encoding=encoding, cast=cast)
+
+    def run_query(self, query, parameters={}, cast=True, check_errors=True): # pylint: disable=W0102
+        if parameters:
+            query = self._process_parameters(query, parameters)
+        return self.run(query, cast, self.error, check=self.checker(check_errors), query=query)
+
+    def run_script(self, script, cast=True, check_errors=True):
+        if not os.path.isfile(script):
+            raise SqlplusException("Script '%s' was not found" % script)
+        return self.run(self.read_script(script), cast, self.error, check=self.checker(check_errors), script=script)
+
+    def run_loader(self, control):
+        self.fake.loads.append(control)
+
+    @staticmethod
+    def error(message, output):
+        if not SqlplusException.REGEXP_CODE.search(message):
+            message = "ORA-00942: %s" % message
+        return SqlplusException(message, raised=True, output=output)
+
+    @staticmethod
+    def checker(check_errors):
+        if not check_errors:
+            return None
+        return lambda output: SqlplusResultParser.parse(output, cast=False, check_errors=check_errors)
+
+    def format_output(self, rows):
+        fields = sorted(rows[0])
+        return FakeClient.html_output(fields, [[row[field] for field in fields] for row in rows])
+
+    @staticmethod
+    def cast_value(value):
+        return SqlplusResultParser._cast(value) # pylint: disable=W0212
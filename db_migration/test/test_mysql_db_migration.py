@@ -2,12 +2,47 @@
 # encoding: UTF-8
 
 import os
+import re
+import json
+import shutil
+import tempfile
 import unittest
+from contextlib import contextmanager
 
 import sys
 from StringIO import StringIO
 
 import db_migration
+from db_migration.test.benchmark import FakeClient
+from db_migration.test.fake_driver import FakeDatabase
+
+
+@contextmanager
+def sql_directory(database, scripts=None, config=''):
+    """
+    Copy test SQL directory of a database in a temporary directory, removed
+    on exit, with additional files and configuration.
+    :param database: the database, 'mysql' or 'oracle'
+    :param scripts: the contents of additional files by path in SQL directory
+    :param config: the text appended to db_configuration.py
+    :return: the path of the SQL directory
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        sql_dir = os.path.join(directory, 'sql')
+        shutil.copytree(os.path.join(os.path.dirname(__file__), 'sql', database), sql_dir)
+        for name, source in sorted((scripts or {}).items()):
+            path = os.path.join(sql_dir, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as handle:
+                handle.write(source)
+        if config:
+            with open(os.path.join(sql_dir, 'db_configuration.py'), 'a') as handle:
+                handle.write(config)
+        yield sql_dir
+    finally:
+        shutil.rmtree(directory)
 
 
 class TestDBMigration(unittest.TestCase):
@@ -99,6 +134,7 @@ class TestDBMigration(unittest.TestCase):
             os.makedirs(os.path.join(self.ROOT_DIR, 'build'))
         except Exception:
             pass
+        self.MYSQL.run_query("DROP TABLE IF EXISTS test._progress")
         self.MYSQL.run_query("DROP TABLE IF EXISTS test._scripts")
         self.MYSQL.run_query("DROP TABLE IF EXISTS test._install")
         self.MYSQL.run_query("DROP TABLE IF EXISTS test.pet")
@@ -109,6 +145,48 @@ class TestDBMigration(unittest.TestCase):
         self.assertEqual(db_migration.Script.VERSION_INIT, db_migration.Script.split_version('init'))
         self.assertEqual(db_migration.Script.VERSION_NEXT, db_migration.Script.split_version('next'))
 
+    def test_migrate_batch(self):
+        with sql_directory('mysql', {'1.1/all.batch.sql': "UPDATE pet SET age = age + 1 WHERE species = 'cat';\n"},
+                           config="CHUNK_SIZE = 2\n") as sql_dir:
+            self.run_db_migration(['-iu',
+                                   '-c', '%s/db_configuration.py' % sql_dir,
+                                   '-s', sql_dir,
+                                   'itg', '1.1'])
+            ages = self.MYSQL.run_query("SELECT age FROM test.pet ORDER BY id")
+            self.assertEqual([14, 14, 20, 7, 7], [line['age'] for line in ages])
+            progress = self.MYSQL.run_query("SELECT step, rows_done, chunks, status FROM test._progress")
+            self.assertEqual(({'step': 'batch', 'rows_done': 2, 'chunks': 2, 'status': 'done'},), progress)
+
+    def test_migrate_load(self):
+        with sql_directory('mysql', {'1.1/all.sql': "-- @load pet pet.csv\n",
+                                     '1.1/pet.csv': 'name,age,species\nFelix,3,cat\n"Rex, Jr",2,dog\n'}) as sql_dir:
+            self.run_db_migration(['-iu',
+                                   '-c', '%s/db_configuration.py' % sql_dir,
+                                   '-s', sql_dir,
+                                   'itg', '1.1'])
+            names = self.MYSQL.run_query("SELECT name FROM test.pet WHERE age < 5 ORDER BY id")
+            self.assertEqual(['Felix', 'Rex, Jr'], [line['name'] for line in names])
+            scripts = self.MYSQL.run_query("SELECT success FROM test._scripts WHERE filename = '1.1/all.sql'")
+            self.assertEqual(({'success': 1},), scripts)
+
+    def test_migrate_online(self):
+        with sql_directory('mysql', {'1.1/all.sql': "-- @online pet\nALTER TABLE pet ADD color VARCHAR(10);\n"
+                                                    "UPDATE pet SET color = 'red';\n"}) as sql_dir:
+            self.run_db_migration(['-iu',
+                                   '-c', '%s/db_configuration.py' % sql_dir,
+                                   '-s', sql_dir,
+                                   'itg', '1.1'])
+            EXPECTED_DATA = (
+                {'species': 'dog',    'tatoo': '2-GKB-951', 'age': 14, 'id': 1, 'name': 'Réglisse', 'color': 'red'},
+                {'species': 'cat',    'tatoo': None,        'age': 13, 'id': 2, 'name': 'Mignonne', 'color': 'red'},
+                {'species': 'cat',    'tatoo': None,        'age': 19, 'id': 3, 'name': 'Ophélie', 'color': 'red'},
+                {'species': 'beaver', 'tatoo': None,        'age':  7, 'id': 4, 'name': 'Nico', 'color': 'red'},
+                {'species': 'wombat', 'tatoo': None,        'age':  7, 'id': 5, 'name': 'Robert', 'color': None},
+            )
+            self.assert_data(EXPECTED_DATA)
+            progress = self.MYSQL.run_query("SELECT target, rows_done, status FROM test._progress")
+            self.assertEqual(({'target': 'pet', 'rows_done': 4, 'status': 'done'},), progress)
+
     def test_init_nominal(self):
         self.run_db_migration(['-ilu',
                                '-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
@@ -235,6 +313,50 @@ class TestDBMigration(unittest.TestCase):
         )
         self.assert_data(EXPECTED_DATA)
 
+    def test_migrate_lean(self):
+        self.run_db_migration(['-ilu', '--lean',
+                               '-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                               '-s', '%s/db_migration/test/sql/mysql' % self.ROOT_DIR,
+                               'itg', '0.0'])
+        self.run_db_migration(['-lu', '--lean',
+                               '-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                               '-s', '%s/db_migration/test/sql/mysql' % self.ROOT_DIR,
+                               'itg', '1.0'])
+        EXPECTED_DATA = (
+            {'species': 'dog',    'tatoo': '2-GKB-951', 'age': 14, 'id': 1, 'name': 'Réglisse'},
+            {'species': 'cat',    'tatoo': None,        'age': 13, 'id': 2, 'name': 'Mignonne'},
+            {'species': 'cat',    'tatoo': None,        'age': 19, 'id': 3, 'name': 'Ophélie'},
+            {'species': 'wombat', 'tatoo': None,        'age':  7, 'id': 4, 'name': 'Robert'},
+            {'species': 'beaver', 'tatoo': None,        'age':  7, 'id': 5, 'name': 'Nico'},
+            {'species': 'wombat', 'tatoo': None,        'age':  7, 'id': 6, 'name': 'Robert'},
+        )
+        self.assert_data(EXPECTED_DATA)
+        scripts = self.MYSQL.run_query("SELECT filename FROM test._scripts WHERE success = 1 ORDER BY id")
+        self.assertEqual(['init/all.sql', 'init/itg.sql', 'done/all.sql',
+                          '0.1/all.sql', '0.1/itg.sql', '1.0/all.sql', 'done/all.sql'],
+                         [s['filename'] for s in scripts])
+
+    def test_migrate_snapshot(self):
+        directory = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join(directory, 'snapshot.json')
+            self.run_db_migration(['-iu',
+                                   '-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                                   '-s', '%s/db_migration/test/sql/mysql' % self.ROOT_DIR,
+                                   'itg', '0.1'])
+            self.run_db_migration(['-u', '--export=%s' % snapshot,
+                                   '-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                                   '-s', '%s/db_migration/test/sql/mysql' % self.ROOT_DIR,
+                                   'itg'])
+            self.MYSQL.run_query("DROP TABLE IF EXISTS _scripts")
+            output = self.run_db_migration(['-du', '--snapshot=%s' % snapshot,
+                                            '-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                                            '-s', '%s/db_migration/test/sql/mysql' % self.ROOT_DIR,
+                                            'itg', '1.0'])
+            self.assertEqual("2 scripts to run:\n- 1.0/all.sql\n- done/all.sql\n", output)
+        finally:
+            shutil.rmtree(directory)
+
     def test_migration_script_mysql(self):
         # nominal case
         expected = """-- Migration base 'test' on platform 'itg'
@@ -566,5 +688,799 @@ Listing passed scripts... OK
             self.assertTrue("Migration script generation is incompatible with options dry_run and local" in e.message)
 
 
+
+class TestUnits(unittest.TestCase):
+    """
+    Unit tests that don't need a database server.
+    """
+
+    SCRIPT_DIR = os.path.dirname(__file__)
+    ROOT_DIR = os.path.normpath(os.path.join(SCRIPT_DIR, '..', '..'))
+    CONFIG_FILE = os.path.join(SCRIPT_DIR, 'sql', 'mysql', 'db_configuration.py')
+
+    run_db_migration = staticmethod(TestDBMigration.run_db_migration)
+
+    def test_split_mysql(self):
+        source = """-- comment; here
+INSERT INTO pet VALUES ('a;b', "c\\";d", `e;f`); # x;y
+UPDATE pet SET name = 'it''s;'
+  WHERE id = 1;
+DELIMITER $$
+CREATE PROCEDURE p()
+BEGIN
+  SELECT 1;
+END$$
+DELIMITER ;
+SELECT 2"""
+        statements = db_migration.MysqlSplitter().split(source)
+        self.assertEqual([(2, ';'), (3, ';'), (6, '$$'), (11, None)],
+                         [(s.line, s.delimiter) for s in statements])
+        self.assertEqual("CREATE PROCEDURE p()\nBEGIN\n  SELECT 1;\nEND", statements[2].text)
+        self.assertEqual("SELECT 2", statements[3].text)
+        statements = db_migration.MysqlSplitter().split("DELIMITER //\nCREATE PROCEDURE p() BEGIN SELECT 1; END//\n"
+                                                        "DELIMITER --\nSELECT '--' --\nDELIMITER ;\nSELECT 2;")
+        self.assertEqual([("CREATE PROCEDURE p() BEGIN SELECT 1; END", '//'), ("SELECT '--'", '--'),
+                          ("SELECT 2", ';')], [(s.text, s.delimiter) for s in statements])
+
+    def test_split_oracle(self):
+        source = """WHENEVER SQLERROR EXIT SQL.SQLCODE;
+PROMPT it's here
+UPDATE pet
+SET name = 'x;
+y';
+CREATE OR REPLACE PACKAGE BODY pk AS
+  PROCEDURE p IS BEGIN NULL; END;
+END pk;
+/
+SELECT q'[a;b]' FROM dual;
+SELECT 1 FROM dual
+/
+"""
+        statements = db_migration.SqlplusSplitter().split(source)
+        self.assertEqual([(1, ''), (2, ''), (3, ';'), (6, '/'), (10, ';'), (11, '/')],
+                         [(s.line, s.delimiter) for s in statements])
+        self.assertEqual("CREATE OR REPLACE PACKAGE BODY pk AS\n  PROCEDURE p IS BEGIN NULL; END;\nEND pk;",
+                         statements[3].text)
+        statements = db_migration.SqlplusSplitter().split("BEGIN\r\n NULL;\r\nEND;\r\n/\r\nSELECT 1 FROM DUAL;")
+        self.assertEqual([(1, '/'), (5, ';')], [(s.line, s.delimiter) for s in statements])
+
+    def test_statements_script(self):
+        adapter = db_migration.MysqlDatabaseAdapter(None)
+        statements = adapter.splitter.split("""SELECT 1;
+DELIMITER $$
+CREATE PROCEDURE p() BEGIN SELECT 2; END$$
+DELIMITER ;
+SELECT 3;""")
+        expected = """UPDATE _scripts SET last_statement = 1 ORDER BY id DESC LIMIT 1;
+DELIMITER $$
+CREATE PROCEDURE p() BEGIN SELECT 2; END$$
+UPDATE _scripts SET last_statement = 2 ORDER BY id DESC LIMIT 1$$
+DELIMITER ;
+SELECT 3;
+UPDATE _scripts SET last_statement = 3 ORDER BY id DESC LIMIT 1;"""
+        self.assertEqual(expected, adapter.statements_script(statements, skip=1, checkpoint=True))
+        self.assertEqual("SELECT '--' -- comment\n;", adapter.terminate("SELECT '--' -- comment", ';'))
+        self.assertEqual("SELECT '#'$$", adapter.terminate("SELECT '#'", '$$'))
+
+    def test_compile_levels(self):
+        objects = {
+            ('PACKAGE', 'P'): set(),
+            ('PACKAGE BODY', 'P'): {('PACKAGE', 'P'), ('VIEW', 'V')},
+            ('VIEW', 'V'): {('TABLE', 'T')},
+            ('VIEW', 'W'): {('VIEW', 'V')},
+            ('FUNCTION', 'F'): {('FUNCTION', 'G')},
+            ('FUNCTION', 'G'): {('FUNCTION', 'F')},
+        }
+        self.assertEqual([[('PACKAGE', 'P'), ('VIEW', 'V')],
+                          [('PACKAGE BODY', 'P'), ('VIEW', 'W')],
+                          [('FUNCTION', 'F'), ('FUNCTION', 'G')]],
+                         db_migration.SqlplusDatabaseAdapter.compile_levels(objects))
+        output = ("<table><tr><th>TYPE</th><th>NAME</th><th>REFERENCED_TYPE</th><th>REFERENCED_NAME</th></tr>"
+                  "<tr><td>PACKAGE</td><td>PKG_ERROR_LOG</td><td></td><td></td></tr></table>")
+        database = db_migration.db_migration.Config(
+            run_query=lambda query, cast, check_errors: db_migration.db_migration.SqlplusResultParser.parse(
+                output, cast=cast, check_errors=check_errors))
+        adapter = db_migration.SqlplusDatabaseAdapter(database)
+        self.assertEqual({('PACKAGE', 'PKG_ERROR_LOG'): set()}, adapter.invalid_objects())
+
+    def test_script_check_oracle(self):
+        migration = db_migration.DBMigration.parse_command_line(
+            ('-c', '%s/db_migration/test/sql/oracle/db_configuration.py' % self.ROOT_DIR,
+             '-s', '%s/db_migration/test/sql/oracle' % self.ROOT_DIR, '-m', 'init', 'itg', '0.1'))
+        scripts = migration.select_scripts(passed=True)
+        script = migration.generate_migration_script(scripts[-1:], meta=True, version='0.1')
+        self.assertTrue("-- Meta script check beginning\nVARIABLE db_migration_start VARCHAR2(19)\n" in script)
+        self.assertTrue("RAISE_APPLICATION_ERROR(-20000, 'Compilation errors in script 0.1/itg.sql:'" in script)
+        self.assertTrue(script.index("-- Meta script check\n") < script.index("-- Meta script ending\n"))
+        self.assertFalse("Meta script check" in migration.generate_migration_script(scripts[-1:], meta=False))
+        output = "<p>Unknown error in data</p>\n<table><tr><th>NAME</th></tr><tr><td>error</td></tr></table>"
+        self.assertEqual(({'NAME': 'error'},), db_migration.db_migration.SqlplusResultParser.parse(
+            output, cast=False, check_errors=db_migration.db_migration.SqlplusResultParser.REGEXP_CLIENT_ERRORS))
+
+    def test_benchmark_clients(self):
+        rows = [['1.0/all.sql', 'abc'], ['1.1/itg.sql', 'NULL']]
+        expected = ({'SCRIPT': '1.0/all.sql', 'CHECKSUM': 'abc'}, {'SCRIPT': '1.1/itg.sql', 'CHECKSUM': 'NULL'})
+        output = FakeClient.batch_output(FakeClient.FIELDS, rows)
+        mysql = db_migration.MysqlCommando(configuration=TestDBMigration.DB_CONFIG)
+        self.assertEqual(expected, mysql._output_to_result(output, cast=False))
+        output = FakeClient.html_output(FakeClient.FIELDS, rows)
+        self.assertEqual(expected, db_migration.db_migration.SqlplusResultParser.parse(output, cast=False,
+                                                                                        check_errors=True))
+
+    def test_batch_parse(self):
+        adapter = db_migration.MysqlDatabaseAdapter(None)
+        step = db_migration.BatchStatement(adapter, db_migration.Throttle(), 1000)
+        update, delete, insert, values = adapter.splitter.split(
+            "UPDATE pet p SET age = (SELECT 1 FROM owner WHERE id = 1) WHERE species = 'cat' OR age > 10;\n"
+            "DELETE FROM pet;\n"
+            "INSERT INTO old SELECT * FROM pet WHERE age > 10 ON DUPLICATE KEY UPDATE age = 0;\n"
+            "INSERT INTO pet VALUES (1);")
+        self.assertEqual(('pet', 'p', 'UPDATE pet p SET age = (SELECT 1 FROM owner WHERE id = 1)',
+                          "species = 'cat' OR age > 10", ''), step.parse(update))
+        self.assertEqual(('pet', 'pet', 'DELETE FROM pet', None, ''), step.parse(delete))
+        self.assertEqual(('pet', 'pet', 'INSERT INTO old SELECT * FROM pet', 'age > 10',
+                          ' ON DUPLICATE KEY UPDATE age = 0'), step.parse(insert))
+        self.assertEqual(None, step.parse(values))
+        for statement in adapter.splitter.split("DELETE FROM pet WHERE age > 10 LIMIT 100;\n"
+                                                "UPDATE pet SET age = 1 ORDER BY id DESC;\n"
+                                                "INSERT INTO old SELECT * FROM pet LIMIT 10;"):
+            self.assertEqual(None, step.parse(statement))
+        insert = adapter.splitter.split("INSERT INTO old SELECT * FROM pet WHERE age > (SELECT 1 LIMIT 1) "
+                                        "ORDER BY id")[0]
+        self.assertEqual(('pet', 'pet', 'INSERT INTO old SELECT * FROM pet', 'age > (SELECT 1 LIMIT 1)',
+                          ' ORDER BY id'), step.parse(insert))
+        self.assertFalse(step.accepts(update, 'owner'))
+
+    def test_online_accepts(self):
+        adapter = db_migration.MysqlDatabaseAdapter(None)
+        step = db_migration.OnlineSchemaChange(adapter, db_migration.Throttle(), 1000)
+        alter, update = adapter.splitter.split("-- comment\nALTER TABLE `pet` ADD color VARCHAR(10);\n"
+                                               "UPDATE pet SET age = 1;")
+        self.assertTrue(step.accepts(alter, ''))
+        self.assertTrue(step.accepts(alter, 'pet owner'))
+        self.assertFalse(step.accepts(alter, 'owner'))
+        self.assertFalse(step.accepts(update, ''))
+        database = db_migration.db_migration.Config(
+            run_query=lambda query, cast: ({'NB': '1' if 'triggers' in query else '0', 'TYPE': 'bigint(20) unsigned'},))
+        adapter = db_migration.MysqlDatabaseAdapter(database)
+        self.assertEqual('CAST(position AS UNSIGNED)', adapter.position_cast('pet', 'id'))
+        step = db_migration.OnlineSchemaChange(adapter, db_migration.Throttle(), 1000)
+        self.assertRaisesRegexp(db_migration.AppException, "because of its triggers", step.check_table, 'pet')
+        self.assertEqual('position', db_migration.SqlplusDatabaseAdapter(None).position_cast('pet', 'id'))
+
+    def test_session_profile(self):
+        scripts = {'1.1/all.sql': "-- @profile bulk\n"
+                                  "INSERT INTO pet (name, age, species) VALUES ('Felix', 3, 'cat');\n",
+                   '1.2/all.sql': "-- @profile bulk\n-- @batch\nUPDATE pet SET age = 1;\n"}
+        config = "SESSION_PROFILES = {'bulk': {'unique_checks': 0, 'foreign_key_checks': False}}\n"
+        with sql_directory('mysql', scripts, config) as sql_dir:
+            output = self.run_db_migration(['-c', '%s/db_configuration.py' % sql_dir,
+                                            '-s', sql_dir, '-m', '1.0', 'itg', '1.1'])
+            self.assertTrue("-- Session profile 'bulk' setup\n"
+                            "SET @db_migration_foreign_key_checks = @@session.foreign_key_checks, "
+                            "@db_migration_unique_checks = @@session.unique_checks;\n"
+                            "SET SESSION foreign_key_checks = 0, unique_checks = 0;\n\n"
+                            "-- Script '1.1/all.sql'\n" in output)
+            self.assertTrue("-- Session profile 'bulk' restore\n"
+                            "SET SESSION foreign_key_checks = @db_migration_foreign_key_checks, "
+                            "unique_checks = @db_migration_unique_checks;\n" in output)
+            self.assertRaisesRegexp(db_migration.AppException, "can't apply to data load or steps",
+                                    self.run_db_migration, ['-c', '%s/db_configuration.py' % sql_dir,
+                                                            '-s', sql_dir, '-m', '1.0', 'itg', '1.2'])
+            adapter = db_migration.SqlplusDatabaseAdapter(None)
+            profile = {'parallel dml': 'ENABLE', 'PARALLEL QUERY': 'FORCE PARALLEL 4'}
+            self.assertEqual("ALTER SESSION FORCE PARALLEL QUERY PARALLEL 4;\nALTER SESSION ENABLE PARALLEL DML;",
+                             adapter.profile_setup(profile))
+            self.assertEqual("COMMIT;\nALTER SESSION ENABLE PARALLEL QUERY;\nALTER SESSION DISABLE PARALLEL DML;",
+                             adapter.profile_restore(profile))
+
+    def test_hint_ddl_oracle(self):
+        adapter = db_migration.SqlplusDatabaseAdapter(None)
+        index = "CREATE INDEX idx_name ON pet (name) TABLESPACE users"
+        move = "ALTER TABLE pet MOVE TABLESPACE users UPDATE INDEXES"
+        self.assertEqual('pet', adapter.online_ddl(index))
+        self.assertEqual('pet', adapter.online_ddl(move))
+        self.assertEqual(None, adapter.online_ddl("CREATE INDEX idx_name ON pet (name) ONLINE"))
+        self.assertEqual("CREATE INDEX idx_name ON pet (name) TABLESPACE users ONLINE", adapter.hint_ddl(index, None))
+        self.assertEqual("CREATE INDEX idx_name ON pet (name) TABLESPACE users ONLINE PARALLEL 4;\n"
+                         "ALTER INDEX idx_name NOPARALLEL", adapter.hint_ddl(index, 4))
+        self.assertEqual("ALTER TABLE pet MOVE ONLINE TABLESPACE users PARALLEL 4 UPDATE INDEXES;\n"
+                         "ALTER TABLE pet NOPARALLEL", adapter.hint_ddl(move, 4))
+        self.assertEqual("CREATE INDEX idx ON pet (name) ONLINE -- search", adapter.hint_ddl(
+            "CREATE INDEX idx ON pet (name) -- search", None))
+        self.assertEqual("CREATE INDEX idx ON pet (name) ONLINE PARALLEL 4 /* it's */ -- search\n;\n"
+                         "ALTER INDEX idx NOPARALLEL", adapter.hint_ddl(
+                             "CREATE INDEX idx ON pet (name) /* it's */ -- search", 4))
+        self.assertEqual("ALTER TABLE pet MOVE ONLINE PARALLEL 4 UPDATE INDEXES /* x */;\n"
+                         "ALTER TABLE pet NOPARALLEL", adapter.hint_ddl(
+                             "ALTER TABLE pet MOVE UPDATE INDEXES /* x */", 4))
+        directory = tempfile.mkdtemp()
+        try:
+            config = os.path.join(directory, 'db_configuration.py')
+            shutil.copy(self.CONFIG_FILE, config)
+            with open(config, 'a') as handle:
+                handle.write("DDL_ONLINE = True\n")
+            self.assertRaisesRegexp(db_migration.AppException, "DDL_ONLINE is only available for Oracle",
+                                    db_migration.DBMigration.parse_command_line,
+                                    ['-c', config, '-s', os.path.dirname(self.CONFIG_FILE), '-m', 'init', 'itg', '1.0'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_observers(self):
+        config = ("class Recorder(object):\n"
+                  "    events = []\n"
+                  "    def migration_generated(self, migration, script):\n"
+                  "        self.events.append((migration.platform, script.count('-- Script')))\n"
+                  "class Failing(object):\n"
+                  "    def migration_generated(self, migration, script):\n"
+                  "        raise Exception('broken')\n"
+                  "OBSERVERS = [Recorder(), Failing()]\n")
+        with sql_directory('mysql', config=config) as sql_dir:
+            migration = db_migration.DBMigration.parse_command_line(
+                ['-c', '%s/db_configuration.py' % sql_dir, '-s', sql_dir, '-m', 'init', 'itg', '1.0'])
+            old_stdout = sys.stdout
+            sys.stdout = output = StringIO()
+            try:
+                migration.run()
+            finally:
+                sys.stdout = old_stdout
+            self.assertEqual([('itg', 6)], migration.observers[0].events)
+            self.assertTrue("WARNING: Error in observer Failing on event migration_generated: broken\n"
+                            in output.getvalue())
+
+    def test_trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            trace = os.path.join(directory, 'trace.json')
+            self.run_db_migration(['-c', self.CONFIG_FILE, '-s', os.path.join(self.SCRIPT_DIR, 'sql', 'mysql'),
+                                   '-m', 'init', '--trace=%s' % trace, 'itg', '1.0'])
+            self.assertEqual(None, db_migration.db_migration.Tracer.active)
+            with open(trace) as handle:
+                events = json.load(handle)['traceEvents']
+            names = [event['name'] for event in events]
+            self.assertEqual(['load_configuration', 'initialize', 'run', 'select_scripts', 'rewrite_scripts',
+                              'generate_migration_script'], names)
+            run = events[2]
+            for event in events[3:]:
+                self.assertTrue(run['ts'] <= event['ts'] and event['ts'] + event['dur'] <= run['ts'] + run['dur'])
+            tracer = db_migration.db_migration.Tracer()
+            db_migration.db_migration.Tracer.active = tracer
+            try:
+                with db_migration.db_migration.Tracer.span('run'):
+                    with db_migration.db_migration.Tracer.span('mysql', query='SELECT 1;'):
+                        pass
+            finally:
+                db_migration.db_migration.Tracer.active = None
+            tracer.write(trace, 'otlp')
+            with open(trace) as handle:
+                spans = json.load(handle)['resourceSpans'][0]['scopeSpans'][0]['spans']
+            self.assertEqual(['run', 'mysql'], [span['name'] for span in spans])
+            self.assertEqual(spans[0]['spanId'], spans[1]['parentSpanId'])
+            self.assertEqual([{'key': 'query', 'value': {'stringValue': 'SELECT 1;'}}], spans[1]['attributes'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_metrics_file(self):
+        self.assertRaises(db_migration.AppException, db_migration.DBMigration.parse_command_line,
+                          ['-c', self.CONFIG_FILE, '-m', 'init', '--metrics-file=metrics.prom', 'itg', '1.0'])
+        self.assertEqual(None, db_migration.db_migration.Tracer.active)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'db_migration.prom')
+            tracer = db_migration.db_migration.Tracer()
+            db_migration.db_migration.Tracer.active = tracer
+            try:
+                with db_migration.db_migration.Tracer.span('mysql', query='SELECT 1;', size=9):
+                    pass
+                with db_migration.db_migration.Tracer.span('mysql', script='/tmp/all.sql', size=100):
+                    pass
+            finally:
+                db_migration.db_migration.Tracer.active = None
+            metrics = db_migration.db_migration.PrometheusMetrics(path, tracer)
+            migration = db_migration.db_migration.Config(platform='itg', version='1.0', start_time=0)
+            script = db_migration.db_migration.Config(name='1.0/a"ll.sql')
+            metrics.plan_computed(migration, [script, script])
+            with open(path) as handle:
+                self.assertTrue('db_migration_running{platform="itg",version="1.0"} 1\n' in handle.read())
+            metrics.scripts_finished(migration, [script, script], 1.5)
+            metrics.install_finished(migration, True, 2.5)
+            with open(path) as handle:
+                lines = handle.read().split('\n')
+            self.assertTrue('# TYPE db_migration_scripts_total counter' in lines)
+            for line in ('db_migration_running{platform="itg",version="1.0"} 0',
+                         'db_migration_failed{platform="itg",version="1.0"} 0',
+                         'db_migration_duration_seconds{platform="itg",version="1.0"} 2.5',
+                         'db_migration_scripts_total{platform="itg",version="1.0"} 2',
+                         'db_migration_sql_bytes_total{platform="itg",version="1.0"} 109',
+                         'db_migration_session_duration_seconds{platform="itg",script="1.0/a\\"ll.sql",version="1.0"} 1.5',
+                         'db_migration_driver_calls_total{client="mysql",platform="itg",version="1.0"} 2'):
+                self.assertTrue(line in lines, line)
+            self.assertEqual(['db_migration.prom'], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_profile(self):
+        old_stderr = sys.stderr
+        sys.stderr = errors = StringIO()
+        try:
+            output = self.run_db_migration(['-c', self.CONFIG_FILE, '-s', os.path.join(self.SCRIPT_DIR, 'sql', 'mysql'),
+                                            '-m', 'init', '--profile', '--profile-memory', 'itg', '1.0'])
+        finally:
+            sys.stderr = old_stderr
+        self.assertTrue(output.startswith('-- Migration base'))
+        match = re.match(r"Profile report in '(.*)'\n", errors.getvalue())
+        self.assertTrue(match)
+        try:
+            with open(match.group(1)) as handle:
+                report = handle.read()
+        finally:
+            os.remove(match.group(1))
+        self.assertTrue('Top 40 functions sorted by cumulative:' in report)
+        self.assertTrue('(generate_migration_script)' in report)
+        self.assertTrue('(census)' not in report)
+        self.assertTrue('Memory at migration_generated' in report)
+        self.assertTrue(re.search(r'\nScript +6 +\+6 ', report))
+
+    def test_coalesce_alters(self):
+        scripts = {'1.1/all.sql': "ALTER TABLE pet ADD color VARCHAR(10);\n"
+                                  "ALTER TABLE pet ADD size INT;\nUPDATE pet SET size = 1;\n",
+                   '1.2/all.sql': "ALTER TABLE pet ADD weight INT;\n",
+                   '1.3/all.sql': "ALTER TABLE pet ADD tail INT;\nALTER TABLE pet MODIFY tail BIGINT;\n"
+                                  "ALTER TABLE pet ADD INDEX idx_t (tail);\nALTER TABLE pet DROP INDEX idx_t;\n"}
+        with sql_directory('mysql', scripts) as sql_dir:
+            output = self.run_db_migration(['-c', '%s/db_configuration.py' % sql_dir,
+                                            '-s', sql_dir, '--coalesce',
+                                            '-m', '1.0', 'itg', '1.3'])
+            self.assertTrue("-- Coalesced with ALTER TABLE at line 2\n"
+                            "ALTER TABLE pet\n  ADD color VARCHAR(10),\n  ADD size INT;" in output)
+            self.assertTrue("-- ALTER TABLE pet coalesced at line 1\n"
+                            "UPDATE pet SET size = 1;" in output)
+            self.assertTrue("ALTER TABLE pet ADD weight INT;" in output)
+            self.assertTrue("ALTER TABLE pet ADD tail INT;\n" in output)
+            self.assertTrue("-- Coalesced with ALTER TABLE at line 3\n"
+                            "ALTER TABLE pet\n  MODIFY tail BIGINT,\n  ADD INDEX idx_t (tail);" in output)
+            self.assertTrue("ALTER TABLE pet DROP INDEX idx_t;" in output)
+
+    def test_ddl_analyze(self):
+        analyzer = db_migration.MysqlDdlAnalyzer
+        self.assertEqual(('pet', 'instant'), analyzer.analyze("ALTER TABLE pet ADD color VARCHAR(10) DEFAULT 'a,b'"))
+        self.assertEqual(('pet', 'inplace'), analyzer.analyze("ALTER TABLE `pet` ADD INDEX idx (name, age), DROP tatoo"))
+        self.assertEqual(('pet', 'copy'), analyzer.analyze("ALTER TABLE pet ADD color INT, MODIFY age BIGINT"))
+        self.assertEqual(('pet', 'lock'), analyzer.analyze("ALTER TABLE pet ADD INDEX idx (name), LOCK=SHARED"))
+        self.assertEqual(('pet', 'lock'), analyzer.analyze("CREATE FULLTEXT INDEX idx ON pet (name)"))
+        self.assertEqual(('pet', 'inplace'), analyzer.analyze("DROP INDEX idx ON pet"))
+        self.assertEqual(None, analyzer.analyze("UPDATE pet SET age = 1"))
+        self.assertEqual(('test.pet', 'copy'), analyzer.analyze("ALTER TABLE test.pet MODIFY age BIGINT"))
+        self.assertEqual(('test.pet', 'copy'), analyzer.analyze("ALTER TABLE `test`.`pet` MODIFY age BIGINT"))
+        self.assertEqual(('test.pet', 'inplace'), analyzer.analyze("DROP INDEX idx ON `test`.pet"))
+        self.assertEqual(', ALGORITHM=INPLACE, LOCK=NONE', analyzer.enforce("ALTER TABLE pet FORCE", 'inplace'))
+        self.assertEqual(None, analyzer.enforce("ALTER TABLE pet ADD x INT, ALGORITHM=INSTANT", 'instant'))
+        self.assertEqual("ALTER TABLE pet ADD x INT DEFAULT '-- a', ALGORITHM=INSTANT -- b\n# c",
+                         analyzer.append("ALTER TABLE pet ADD x INT DEFAULT '-- a' -- b\n# c", ', ALGORITHM=INSTANT'))
+
+    def test_ddl_algorithm(self):
+        scripts = {'1.1/all.sql': "ALTER TABLE pet ADD color VARCHAR(10);\nALTER TABLE pet MODIFY age BIGINT;\n"
+                                  "CREATE INDEX idx_name ON pet (name) -- for search\n;\n"}
+        with sql_directory('mysql', scripts) as sql_dir:
+            output = self.run_db_migration(['-c', '%s/db_configuration.py' % sql_dir,
+                                            '-s', sql_dir, '--ddl-algorithm',
+                                            '-m', '1.0', 'itg', '1.1'])
+            self.assertTrue("ALTER TABLE pet ADD color VARCHAR(10), ALGORITHM=INSTANT;\n"
+                            "ALTER TABLE pet MODIFY age BIGINT;\n"
+                            "CREATE INDEX idx_name ON pet (name) ALGORITHM=INPLACE LOCK=NONE -- for search\n;"
+                            in output)
+
+    def test_throttle_replica_lag(self):
+        lags = [30, None, 12, 3]
+        throttle = db_migration.Throttle(ratio=0, check=lambda: lags.pop(0), max_lag=10, interval=0.01)
+        throttle.wait()
+        self.assertEqual([], lags)
+        self.assertAlmostEqual(0.03, throttle.throttled)
+        throttle = db_migration.Throttle(ratio=0, check=lambda: 30, max_lag=10, interval=0.01, timeout=0.02)
+        self.assertRaises(db_migration.AppException, throttle.wait)
+        throttle = db_migration.Throttle(ratio=0.5)
+        throttle.pause(0.02)
+        self.assertAlmostEqual(0.01, throttle.throttled)
+        adapter = db_migration.MysqlDatabaseAdapter(None)
+        replica = db_migration.db_migration.Config(hostname='db2', run_query=lambda query, cast: None)
+        self.assertRaises(db_migration.AppException, adapter.replica_lag, replica)
+        replica.run_query = lambda query, cast: ({'Seconds_Behind_Master': 'NULL'},)
+        self.assertEqual(None, adapter.replica_lag(replica))
+
+    def test_load_script(self):
+        with sql_directory('mysql', {'1.1/all.sql': "-- @load pet pet.tsv\n",
+                                     '1.1/pet.tsv': "name\tage\tspecies\nFelix\t3\tcat\n",
+                                     '1.2/all.sql': "-- @load pet pet.csv\n",
+                                     '1.2/pet.csv': "name,age,species\r\nRex,2,dog\r\n"}) as sql_dir:
+            output = self.run_db_migration(['-c', '%s/db_configuration.py' % sql_dir,
+                                            '-s', sql_dir, '-m', '1.0', 'itg', '1.2'])
+            self.assertTrue("-- @load pet pet.tsv\nLOAD DATA LOCAL INFILE '%s/1.1/pet.tsv' INTO TABLE `pet` CHARACTER SET utf8\n"
+                            "  FIELDS TERMINATED BY '\\t' OPTIONALLY ENCLOSED BY '\"'\n"
+                            "  LINES TERMINATED BY '\\n' IGNORE 1 LINES\n"
+                            "  (`name`, `age`, `species`);" % sql_dir in output)
+            self.assertTrue("  LINES TERMINATED BY '\\r\\n' IGNORE 1 LINES\n"
+                            "  (`name`, `age`, `species`);" in output)
+            controls = []
+
+            def run_loader(control):
+                with open(control) as handle:
+                    controls.append(handle.read())
+
+            adapter = db_migration.SqlplusDatabaseAdapter(db_migration.db_migration.Config(run_loader=run_loader))
+            adapter.load_data('pet.csv', 'PET', ['NAME', 'AGE'], ',', '\r\n', 'utf8')
+            self.assertTrue("LOAD DATA CHARACTERSET AL32UTF8\nINFILE 'pet.csv' \"STR X'0D0A'\"\n" in controls[0])
+            adapter.load_data('pet.csv', 'PET', ['NAME', 'AGE'], ',', '\n', None)
+            self.assertTrue("LOAD DATA\nINFILE 'pet.csv'\n" in controls[1])
+            self.assertRaises(db_migration.AppException, adapter.load_data,
+                              'pet.csv', 'PET', ['NAME', 'AGE'], ',', '\n', 'koi8-r')
+
+    def test_checksum_manifest(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(directory, '1.0'))
+            path = os.path.join(directory, '1.0', 'all.sql')
+            with open(path, 'w') as handle:
+                handle.write('SELECT 1;')
+            manifest_path = os.path.join(directory, 'manifest')
+            manifest = db_migration.ChecksumManifest(manifest_path)
+            script = db_migration.Script(path)
+            manifest.checksums([script])
+            manifest.save()
+            checksum = script.checksum
+            self.assertEqual(64, len(checksum))
+            manifest = db_migration.ChecksumManifest(manifest_path)
+            manifest.load()
+            script = db_migration.Script(path)
+            manifest.checksums([script])
+            self.assertEqual(checksum, script.checksum)
+            self.assertFalse(manifest.changed)
+            with open(path, 'w') as handle:
+                handle.write('SELECT 2;')
+            os.utime(path, (0, 0))
+            manifest.checksums([script])
+            self.assertNotEqual(checksum, script.checksum)
+            self.assertTrue(manifest.changed)
+            data = os.path.join(directory, '1.0', 'pet.csv')
+            with open(data, 'w') as handle:
+                handle.write('name\nFelix\n')
+            manifest = db_migration.ChecksumManifest(manifest_path, dependencies=lambda script: [data])
+            manifest.checksums([script])
+            checksum = script.checksum
+            self.assertEqual(db_migration.ChecksumManifest.compute(path, data), checksum)
+            manifest.checksums([script])
+            self.assertEqual(checksum, script.checksum)
+            with open(data, 'w') as handle:
+                handle.write('name\nRex\n')
+            os.utime(data, (0, 0))
+            manifest.checksums([script])
+            self.assertNotEqual(checksum, script.checksum)
+            default = db_migration.ChecksumManifest.default_path(directory)
+            self.assertFalse(os.path.abspath(default).startswith(os.path.abspath(directory) + os.sep))
+            self.assertEqual(default, db_migration.ChecksumManifest.default_path(directory + os.sep))
+            self.assertNotEqual(default, db_migration.ChecksumManifest.default_path(os.path.join(directory, '1.0')))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_touched_tables(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(directory, '1.0'))
+            with open(os.path.join(directory, '1.0', 'all.sql'), 'w') as handle:
+                handle.write("INSERT INTO Pet VALUES (1);\nUPDATE LOW_PRIORITY owner SET age = 1;\n"
+                             "DELETE FROM test.pet;\nSELECT * FROM shop;\nCREATE INDEX idx ON `vet` (name);\n")
+            migration = db_migration.DBMigration.parse_command_line(
+                ('-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                 '-s', directory, '-m', 'init', 'itg', '1.0'))
+            scripts = migration.select_scripts(passed=True)
+            self.assertEqual(['owner', 'Pet', 'vet'], migration.touched_tables(scripts))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lock_guard(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(directory, '1.0'))
+            with open(os.path.join(directory, '1.0', 'all.sql'), 'w') as handle:
+                handle.write("INSERT INTO pet VALUES (1);\n")
+            with open(os.path.join(directory, '1.0', 'itg.sql'), 'w') as handle:
+                handle.write("ALTER TABLE Pet ADD color VARCHAR(10);\nCREATE INDEX idx ON `vet` (name);\n")
+            migration = db_migration.DBMigration.parse_command_line(
+                ('-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+                 '-s', directory, '-m', 'init', 'itg', '1.0'))
+            scripts = migration.select_scripts(passed=True)
+            self.assertEqual(['Pet', 'vet'], migration.ddl_tables(scripts))
+            self.assertEqual(1, len(migration.segment_scripts(scripts)))
+            migration.config.LOCK_GUARD = True
+            migration.config.LOCK_GUARD_TIMEOUT = 0
+            self.assertEqual(2, len(migration.segment_scripts(scripts)))
+            script = migration.generate_migration_script(scripts, meta=False)
+            self.assertTrue("-- Lock timeout\nSET SESSION lock_wait_timeout = 5, innodb_lock_wait_timeout = 5;\n\n"
+                            "-- Script '1.0/itg.sql'\n" in script)
+            self.assertEqual(1, script.count("-- Lock timeout"))
+            migration.meta_manager.blocking_sessions = lambda tables, age: [('12', 'app', tables[0], age)]
+            migration.lock_guard(scripts[:1])
+            self.assertRaisesRegexp(db_migration.AppException, r"1.0/itg.sql.*: 12 \(app, 10 s on Pet\)",
+                                    migration.lock_guard, scripts[1:])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_script_cost(self):
+        migration = db_migration.DBMigration.parse_command_line(
+            ('-c', '%s/db_migration/test/sql/mysql/db_configuration.py' % self.ROOT_DIR,
+             '-s', '%s/db_migration/test/sql/mysql' % self.ROOT_DIR, '-m', 'init', 'itg', '0.1'))
+        scripts = migration.select_scripts(passed=True)
+        self.assertFalse("Meta script cost" in migration.generate_migration_script(scripts[-1:], meta=True))
+        migration.config.SCRIPT_COST = True
+        script = migration.generate_migration_script(scripts[-1:], meta=True)
+        self.assertTrue(script.index("-- Meta script cost beginning\nSELECT SUM(SUM_TIMER_WAIT)") <
+                        script.index("-- Script '%s'" % scripts[-1]) < script.index("-- Meta script cost\n") <
+                        script.index("-- Meta script ending\n"))
+        self.assertTrue("WHERE s.filename = '%s' AND s.install_id" % scripts[-1] in script)
+        result = ({'SCRIPT': '0.1/all.sql', 'VERSION': '0.1', 'STATEMENT_TIME': '12.5', 'LOCK_TIME': '0.1',
+                   'ROWS_EXAMINED': '1000', 'ROWS_AFFECTED': '10', 'TMP_TABLES': '0', 'TMP_DISK_TABLES': '0'},)
+        migration.meta_manager.database = db_migration.db_migration.Config(run_query=lambda query, cast: result)
+        old_stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            migration.print_cost()
+        finally:
+            sys.stdout = old_stdout
+        self.assertEqual("Most costly scripts on platform 'itg':\n"
+                         "- 0.1/all.sql (0.1): statement_time 12.5, lock_time 0.1, rows_examined 1000, "
+                         "rows_affected 10, tmp_tables 0, tmp_disk_tables 0\n", output.getvalue())
+
+
+class TestFakeDriver(unittest.TestCase):
+    """
+    Tests of migrations run on a fake driver, without database server.
+    """
+
+    SCRIPT_DIR = os.path.dirname(__file__)
+
+    def migration(self, database, fake, options):
+        sql_dir = os.path.join(self.SCRIPT_DIR, 'sql', database)
+        migration = db_migration.DBMigration.parse_command_line(['-c', os.path.join(sql_dir, 'db_configuration.py'),
+                                                                 '-s', sql_dir, '-u'] + options)
+        fake.install(migration)
+        return migration
+
+    def run_migration(self, database, fake, options):
+        old_stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            self.migration(database, fake, options).run()
+            return output.getvalue()
+        finally:
+            sys.stdout = old_stdout
+
+    def test_run(self):
+        for database, scripts in (('mysql', ['init/all.sql', 'init/itg.sql', '0.1/all.sql', '0.1/itg.sql',
+                                             '1.0/all.sql', 'done/all.sql']),
+                                  ('oracle', ['init/all.sql', 'init/itg.sql', '0.1/all.sql', '0.1/itg.sql',
+                                              '1.0/all.sql'])):
+            fake = FakeDatabase()
+            self.run_migration(database, fake, ['itg', '1.0'])
+            self.assertEqual(scripts, fake.passed_scripts())
+            self.assertEqual([{'id': 1, 'version': '1.0', 'success': 1}], fake.installs)
+            self.assertTrue(all([script['checksum'] for script in fake.scripts]))
+            self.assertTrue([s for s in fake.script_statements('1.0/all.sql') if 'Nico' in s])
+            migration = self.migration(database, fake, ['-a', 'itg'])
+            installed = migration.meta_manager.list_scripts()
+            self.assertIsNone(migration.meta_manager.installed_checksums)
+            self.assertEqual(scripts, [script for script, _ in installed])
+            migration.meta_manager.load_scripts(installed)
+            self.assertEqual(['next/all.sql'], [script.name for script in migration.select_scripts()
+                                                if script.name != 'done/all.sql'])
+
+    def test_error(self):
+        for database in ('mysql', 'oracle'):
+            for lean in ([], ['--lean']):
+                fake = FakeDatabase()
+                fake.fail('Nico', 'Table does not exist')
+                output = self.run_migration(database, fake, lean + ['itg', '0.1'])
+                self.assertTrue('OK' in output)
+                self.assertRaises(db_migration.AppException, self.run_migration, database, fake,
+                                  lean + ['itg', '1.0'])
+                self.assertEqual(['init/all.sql', 'init/itg.sql', '0.1/all.sql', '0.1/itg.sql'],
+                                 [name for name in fake.passed_scripts() if name != 'done/all.sql'])
+                self.assertEqual(0, fake.last_install()['success'])
+                self.assertEqual(('1.0/all.sql', 0, fake.scripts[-1]['checksum']),
+                                 self.migration(database, fake, ['itg', '1.0']).meta_manager.last_checkpoint())
+
+    def test_resume(self):
+        source = "INSERT INTO pet (name) VALUES ('a');\nINSERT INTO pet (name) VALUES ('b');\n" \
+                 "INSERT INTO pet (name) VALUES ('c');\n"
+        for database in ('mysql', 'oracle'):
+            with sql_directory(database, {'1.1/all.sql': source}) as sql_dir:
+                # statements before the failing one are not replayed
+                fake = FakeDatabase()
+                fake.fail(r"VALUES \('c'\)", 'Duplicate entry', times=1)
+                options = ['-s', sql_dir, '--resume', 'itg', '1.1']
+                self.assertRaises(db_migration.AppException, self.run_migration, database, fake, options)
+                self.run_migration(database, fake, options)
+                statements = fake.script_statements('1.1/all.sql')
+                for value in ('a', 'b', 'c'):
+                    self.assertEqual(1, len([s for s in statements if "VALUES ('%s')" % value in s]), value)
+                self.assertTrue('1.1/all.sql' in fake.passed_scripts())
+                # script modified since it failed
+                fake = FakeDatabase()
+                fake.fail(r"VALUES \('c'\)", 'Duplicate entry')
+                self.assertRaises(db_migration.AppException, self.run_migration, database, fake, options)
+                with open(os.path.join(sql_dir, '1.1', 'all.sql'), 'ab') as handle:
+                    handle.write("INSERT INTO pet (name) VALUES ('d');\n")
+                self.assertRaisesRegexp(db_migration.AppException, "Can't resume script '1.1/all.sql'",
+                                        self.run_migration, database, fake, options)
+
+    def test_error_detected(self):
+        for lean in ([], ['--lean']):
+            fake = FakeDatabase()
+            fake.fail('TATOO VARCHAR', 'SP2-0042: unknown command', raised=False)
+            errors = []
+            migration = self.migration('oracle', fake, lean + ['itg', '1.0'])
+            migration.observers.append(db_migration.db_migration.Config(
+                error=lambda migration, error, script: errors.append(script)))
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertRaises(db_migration.AppException, migration.run)
+            finally:
+                sys.stdout = old_stdout
+            self.assertEqual(0, fake.last_install()['success'])
+            self.assertEqual([], [script for script in fake.current_scripts() if script['success']])
+            if lean:
+                self.assertEqual(['0.1/all.sql'], errors)
+
+    def test_step_check(self):
+        with sql_directory('oracle', {'1.1/all.sql': "-- @retry\nCREATE OR REPLACE PROCEDURE p AS\nBEGIN\n  NULL;\n"
+                                                     "END;\n/\n"}) as sql_dir:
+            fake = FakeDatabase()
+            fake.fail("Compilation errors in script 1.1/all.sql", 'Compilation errors in script 1.1/all.sql')
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertRaises(db_migration.AppException, self.migration('oracle', fake, ['-s', sql_dir,
+                                                                                             'itg', '1.1']).run)
+            finally:
+                sys.stdout = old_stdout
+            self.assertTrue([s for s in fake.script_statements('1.1/all.sql') if 'PROCEDURE p' in s])
+            self.assertTrue([s for s in fake.script_statements('1.1/all.sql') if "'2000-01-01 00:00:00'" in s])
+            self.assertFalse('1.1/all.sql' in fake.passed_scripts())
+
+    def test_step_output(self):
+        with sql_directory('oracle', {'1.1/all.sql': "-- @retry\nCREATE TABLE error_log (id NUMBER);\n"}) as sql_dir:
+            for message, success in (('Table ERROR_LOG created.', True), ('SP2-0042: unknown command', False)):
+                fake = FakeDatabase()
+                fake.fail('CREATE TABLE error_log', message, raised=False)
+                old_stdout = sys.stdout
+                sys.stdout = StringIO()
+                try:
+                    if success:
+                        self.run_migration('oracle', fake, ['-s', sql_dir, 'itg', '1.1'])
+                    else:
+                        self.assertRaises(db_migration.AppException, self.run_migration, 'oracle', fake,
+                                          ['-s', sql_dir, 'itg', '1.1'])
+                finally:
+                    sys.stdout = old_stdout
+                self.assertEqual(success, '1.1/all.sql' in fake.passed_scripts())
+
+    def test_retry_transient(self):
+        self.assertTrue(db_migration.db_migration.MysqlException(
+            'ERROR 1213 (40001) at line 2: Deadlock found when trying to get lock').transient)
+        self.assertFalse(db_migration.db_migration.MysqlException(
+            'ERROR 1064 (42000) at line 2: You have an error in your SQL syntax').transient)
+        self.assertTrue(db_migration.db_migration.SqlplusException(
+            'ORA-00054: resource busy and acquire with NOWAIT specified').transient)
+        with sql_directory('mysql', {'1.1/all.sql': "-- @retry 2\nUPDATE pet SET age = 1;\n"
+                                                    "UPDATE owner SET age = 2;\n"}) as sql_dir:
+            for times, success in ((2, True), (3, False)):
+                fake = FakeDatabase()
+                fake.fail('UPDATE owner', 'ERROR 1205 (HY000): Lock wait timeout exceeded', times=times)
+                migration = self.migration('mysql', fake, ['-s', sql_dir, 'itg', '1.1'])
+                migration.config.RETRY_DELAY = 0
+                old_stdout = sys.stdout
+                sys.stdout = StringIO()
+                try:
+                    if success:
+                        migration.run()
+                    else:
+                        self.assertRaises(db_migration.AppException, migration.run)
+                finally:
+                    sys.stdout = old_stdout
+                statements = fake.script_statements('1.1/all.sql')
+                self.assertEqual(1, len([s for s in statements if s.startswith('UPDATE pet')]))
+                self.assertEqual(1 if success else 0, len([s for s in statements if s.startswith('UPDATE owner')]))
+                self.assertEqual(success, '1.1/all.sql' in fake.passed_scripts())
+                self.assertEqual(2, migration.retries)
+                if success:
+                    self.assertEqual([2], [s['retries'] for s in fake.scripts if s['filename'] == '1.1/all.sql'])
+
+    def test_ddl_blocking(self):
+        scripts = {'1.1/all.sql': "ALTER TABLE pet ADD color VARCHAR(10);\n"
+                                  "ALTER TABLE `test`.`pet` MODIFY age BIGINT;\n"}
+        with sql_directory('mysql', scripts) as sql_dir:
+            fake = FakeDatabase()
+            fake.tables = {'pet': (1024, 5), 'test.pet': (2 * 1048576, 5)}
+            output = self.run_migration('mysql', fake, ['-s', sql_dir, '-d', 'itg', '1.1'])
+            self.assertTrue("Blocking DDL on table test.pet in script 1.1/all.sql line 2: copy (2.0 MB, 5 rows)"
+                            in output)
+            migration = self.migration('mysql', fake, ['-s', sql_dir, 'itg', '1.1'])
+            migration.config.DDL_BLOCKING_MAX_SIZE = 1
+            migration.config.DDL_BLOCKING_STRICT = True
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertRaisesRegexp(db_migration.AppException,
+                                        r"bigger than 1 MB: test\.pet \(1\.1/all\.sql line 2\)", migration.run)
+            finally:
+                sys.stdout = old_stdout
+            self.assertEqual([], fake.script_statements('1.1/all.sql'))
+
+    def test_online_restart(self):
+        with sql_directory('mysql', {'1.1/all.sql': "-- @online pet\nALTER TABLE pet ADD color VARCHAR(10);\n"}) \
+                as sql_dir:
+            fake = FakeDatabase()
+            fake.fail('CREATE TRIGGER `_pet_new_upd`', "ERROR 1142 (42000): TRIGGER command denied", times=1)
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertRaises(db_migration.AppException, self.run_migration, 'mysql', fake,
+                                  ['-s', sql_dir, 'itg', '1.1'])
+                self.assertEqual({'_pet_new_ins': 'pet'}, fake.triggers)
+                self.run_migration('mysql', fake, ['-s', sql_dir, 'itg', '1.1'])
+            finally:
+                sys.stdout = old_stdout
+            statements = fake.script_statements('1.1/all.sql')
+            self.assertEqual(2, len([s for s in statements if s.startswith('CREATE TABLE `_pet_new`')]))
+            self.assertTrue([s for s in statements if s.startswith('RENAME TABLE `pet` TO `_pet_old`')])
+            self.assertEqual(1, len(fake.progress))
+            self.assertTrue('1.1/all.sql' in fake.passed_scripts())
+
+    def test_export_read_only(self):
+        directory = tempfile.mkdtemp()
+        try:
+            snapshot = os.path.join(directory, 'snapshot.json')
+            fake = FakeDatabase()
+            fake.fail('_scripts', "ERROR 1146 (42S02): Table 'test._scripts' doesn't exist")
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertRaises(db_migration.AppException,
+                                  self.migration('mysql', fake, ['--export=%s' % snapshot, 'itg']).run)
+            finally:
+                sys.stdout = old_stdout
+            self.assertFalse(os.path.exists(snapshot))
+            migration = db_migration.DBMigration.parse_command_line(
+                ['-c', os.path.join(self.SCRIPT_DIR, 'sql', 'mysql', 'db_configuration.py'), '-m', '0.1', 'itg', '1.0'])
+            self.assertEqual(None, migration.meta_manager.database)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_prepare_error(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'db_migration.prom')
+            migration = self.migration('mysql', FakeDatabase(), ['--metrics-file=%s' % path, 'itg', '1.0'])
+
+            def plan_scripts():
+                raise db_migration.AppException('Broken plan')
+
+            migration.plan_scripts = plan_scripts
+            errors = []
+            migration.observers.append(db_migration.db_migration.Config(
+                error=lambda migration, error, script: errors.append((str(error), script))))
+            old_stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                self.assertRaises(db_migration.AppException, migration.run)
+            finally:
+                sys.stdout = old_stdout
+            with open(path) as handle:
+                lines = handle.read().split('\n')
+            self.assertTrue('db_migration_running{platform="itg",version="1.0"} 0' in lines)
+            self.assertTrue('db_migration_failed{platform="itg",version="1.0"} 1' in lines)
+            self.assertEqual([('Broken plan', None)], errors)
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == '__main__':
     unittest.main()